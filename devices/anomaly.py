@@ -0,0 +1,241 @@
+import math
+import time
+import random
+import argparse
+import tracemalloc
+
+from deadband import PHASES
+
+# Streaming anomaly detection at the edge. Every signal keeps a constant
+# amount of state (EWMA mean/variance, two CUSUM sums, the previous value),
+# so memory per device does not grow with history, and a device emits a
+# compact event only when something looks wrong.
+SIGNALS = {
+    "water": ("flowRate", "pressure"),
+    "gas": ("flowRate", "pressure"),
+    "energy": ("imbalance",),  # per-phase current imbalance, (max - min) / mean
+}
+ALPHA = 0.05          # EWMA weight of the newest reading
+WARMUP = 20           # readings before a signal may raise events
+SPIKE_Z = 4.0         # |z| of a single reading against the EWMA
+CUSUM_K = 0.5         # slack, in standard deviations
+CUSUM_H = 8.0         # decision threshold, in standard deviations
+RATE_LIMITS = {       # largest plausible change per second
+    "pressure": 0.5,  # bar/s
+}
+LIMITS = {            # absolute ceilings, reported when crossed
+    "imbalance": 0.3,
+}
+
+
+def signal_value(data, signal):
+    if signal == "imbalance":
+        currents = [data["phases"][phase]["current"] for phase in PHASES]
+        mean = sum(currents) / len(currents)
+        return (max(currents) - min(currents)) / mean if mean else 0.0
+    return data[signal]
+
+
+class SignalState:
+    __slots__ = ("mean", "var", "count", "high", "low", "last", "last_time", "over")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.high = 0.0  # CUSUM of upward shifts
+        self.low = 0.0   # CUSUM of downward shifts
+        self.last = None
+        self.last_time = None
+        self.over = False  # above its absolute limit
+
+
+class AnomalyDetector:
+    __slots__ = ("device_id", "device_type", "signals", "states", "events")
+
+    def __init__(self, device_id, device_type):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.signals = SIGNALS.get(device_type, ())
+        self.states = [SignalState() for _ in self.signals]
+        self.events = 0
+
+    def update(self, data, now):
+        # -> list of events for this reading (usually empty)
+        events = []
+        for signal, state in zip(self.signals, self.states):
+            value = signal_value(data, signal)
+            for kind, score in check(signal, state, value, now):
+                events.append({"deviceId": self.device_id, "type": self.device_type, "signal": signal,
+                               "kind": kind, "value": value, "mean": round(state.mean, 4),
+                               "score": round(score, 2), "timestamp": data.get("timestamp")})
+        self.events += len(events)
+        return events
+
+
+def check(signal, state, value, now):
+    # Updates one signal's state with a reading -> [(kind, score)]
+    found = []
+    limit = LIMITS.get(signal)
+    if limit is not None:
+        if value > limit and not state.over:
+            found.append(("limit", value / limit))
+        state.over = value > limit
+
+    rate_limit = RATE_LIMITS.get(signal)
+    if rate_limit is not None and state.last is not None and now > state.last_time:
+        rate = abs(value - state.last) / (now - state.last_time)
+        if rate > rate_limit:
+            found.append(("rate", rate / rate_limit))
+    state.last = value
+    state.last_time = now
+
+    deviation = value - state.mean
+    if state.count >= WARMUP and state.var > 0:
+        z = deviation / math.sqrt(state.var)
+        if abs(z) > SPIKE_Z:
+            found.append(("spike", z))
+        state.high = max(0.0, state.high + z - CUSUM_K)
+        state.low = max(0.0, state.low - z - CUSUM_K)
+        if state.high > CUSUM_H or state.low > CUSUM_H:
+            found.append(("shift", state.high if state.high > CUSUM_H else -state.low))
+            state.high = state.low = 0.0
+    # Plain running mean/variance until 1/count drops below ALPHA, so the
+    # variance is not underestimated right after warmup
+    state.count += 1
+    weight = max(ALPHA, 1.0 / state.count)
+    state.mean += weight * deviation
+    state.var = (1 - weight) * (state.var + weight * deviation * deviation)
+    return found
+
+
+class BatchDetector:
+    # The same EWMA/CUSUM/rate checks over one signal of many devices at once,
+    # one NumPy pass per fleet tick instead of one Python call per device
+    def __init__(self, signal, devices):
+        import numpy as np
+
+        self.np = np
+        self.signal = signal
+        self.mean = np.zeros(devices)
+        self.var = np.zeros(devices)
+        self.high = np.zeros(devices)
+        self.low = np.zeros(devices)
+        self.last = np.full(devices, np.nan)
+        self.over = np.zeros(devices, dtype=bool)
+        self.count = 0
+
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.mean, self.var, self.high, self.low, self.last, self.over))
+
+    def update(self, values, dt):
+        # values: readings of every device for this tick -> {kind: device indices}
+        np = self.np
+        events = {}
+        limit = LIMITS.get(self.signal)
+        if limit is not None:
+            above = values > limit
+            events["limit"] = np.flatnonzero(above & ~self.over)
+            self.over = above
+        rate_limit = RATE_LIMITS.get(self.signal)
+        if rate_limit is not None and dt > 0:
+            events["rate"] = np.flatnonzero(np.abs(values - self.last) / dt > rate_limit)
+        self.last = values.copy()
+
+        deviation = values - self.mean
+        if self.count >= WARMUP:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                z = np.where(self.var > 0, deviation / np.sqrt(self.var), 0.0)
+            events["spike"] = np.flatnonzero(np.abs(z) > SPIKE_Z)
+            self.high = np.maximum(0.0, self.high + z - CUSUM_K)
+            self.low = np.maximum(0.0, self.low - z - CUSUM_K)
+            shifted = (self.high > CUSUM_H) | (self.low > CUSUM_H)
+            events["shift"] = np.flatnonzero(shifted)
+            self.high[shifted] = 0.0
+            self.low[shifted] = 0.0
+        self.count += 1
+        weight = max(ALPHA, 1.0 / self.count)
+        self.mean += weight * deviation
+        self.var = (1 - weight) * (self.var + weight * deviation * deviation)
+        return events
+
+
+def benchmark(devices, ticks, interval, leak_share=0.01):
+    # Water meters with leaks injected halfway (flow steps up and stays up on
+    # leak_share of the devices) plus rare pressure jumps
+    from sensors import create_sensor
+
+    random.seed(1)
+    leaking = set(random.sample(range(devices), max(1, int(devices * leak_share))))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    detectors = [AnomalyDetector(str(i), "water") for i in range(devices)]
+    scalar_bytes = (tracemalloc.get_traced_memory()[0] - before) / devices
+    tracemalloc.stop()
+
+    sensors = [create_sensor("water", str(i), update_interval=interval, state={}) for i in range(devices)]
+    readings = []  # per tick, per device: (flowRate, pressure)
+    for tick in range(ticks):
+        row = []
+        for i, sensor in enumerate(sensors):
+            sensor.generate_data(interval)
+            flow, pressure = sensor.data["flowRate"], sensor.data["pressure"]
+            if tick >= ticks // 2 and i in leaking:
+                flow += 6.0
+            if random.random() < 1e-4:
+                pressure += 3.0
+            row.append((flow, pressure))
+        readings.append(row)
+
+    events = 0
+    flagged = set()
+    started = time.perf_counter()
+    for tick, row in enumerate(readings):
+        now = tick * interval
+        for i, (detector, (flow, pressure)) in enumerate(zip(detectors, row)):
+            found = detector.update({"flowRate": flow, "pressure": pressure}, now)
+            events += len(found)
+            if any(e["signal"] == "flowRate" and e["kind"] in ("shift", "spike") for e in found):
+                flagged.add(i)
+    scalar_elapsed = time.perf_counter() - started
+
+    result = {
+        "devices": devices,
+        "readings": devices * ticks,
+        "events": events,
+        "leaksDetected": f"{len(flagged & leaking)}/{len(leaking)}",
+        "falsePositiveDevices": len(flagged - leaking),
+        "scalarReadingsPerSecond": round(devices * ticks / scalar_elapsed),
+        "scalarBytesPerDevice": round(scalar_bytes),
+    }
+    try:
+        import numpy as np
+    except ImportError:
+        return result
+
+    flow_values = np.array([[flow for flow, _ in row] for row in readings])
+    pressure_values = np.array([[pressure for _, pressure in row] for row in readings])
+    batch = [BatchDetector("flowRate", devices), BatchDetector("pressure", devices)]
+    batch_events = 0
+    started = time.perf_counter()
+    for tick in range(ticks):
+        for detector, values in zip(batch, (flow_values[tick], pressure_values[tick])):
+            batch_events += sum(len(indices) for indices in detector.update(values, interval).values())
+    batch_elapsed = time.perf_counter() - started
+    result.update({
+        "batchEvents": batch_events,
+        "batchReadingsPerSecond": round(devices * ticks / batch_elapsed),
+        "batchBytesPerDevice": round(sum(d.nbytes() for d in batch) / devices),
+    })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming anomaly detectors")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    for key, value in benchmark(args.devices, args.ticks, args.interval).items():
+        print(f"[Anomaly] {key}: {value}")
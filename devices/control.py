@@ -0,0 +1,189 @@
+import hmac
+import json
+import queue
+import fnmatch
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTROL_TIMEOUT = 10.0  # seconds an HTTP caller waits for the fleet to apply a command
+MAX_ADD = 1000          # devices one add command may create
+TOKEN_ENV = "FLEET_CONTROL_TOKEN"  # overrides the manifest's control.token
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# Commands, as JSON objects with an "action" key:
+#   {"action": "add", "deviceId": "4000", "type": "water"}
+#   {"action": "add", "type": "gas", "count": 100, "firstId": 5000, "prefix": "gas-"}
+#   {"action": "remove" | "pause" | "resume", "deviceId": "4000"}  (or "deviceIds": [...])
+#   {"action": "retype", "deviceId": "4000", "type": "solar"}
+#   {"action": "list"}
+#   {"action": "profile", "target": "cpu" | "memory" | "stages", "op": "start" | "stop" | "snapshot"}
+#   {"action": "configure", "site": "Demo_Site", "type": "gas", "deviceId": "22*",
+#    "set": {"interval": 10, "deadband": {"enabled": true, "heartbeat": 300, "bands": {...}},
+#            "encoding": "json" | "compact"},
+#    "reset": true}
+# configure selectors are glob patterns (site by name or its underscored key);
+# a missing selector matches every device.
+# With a control token set, every command carries it: "token" in the JSON
+# object, or "Authorization: Bearer <token>" over HTTP. MQTT commands are only
+# taken with a token, since anyone on the broker can publish them.
+ACTIONS = ("add", "remove", "pause", "resume", "retype", "list", "profile", "configure")
+SETTINGS = ("interval", "deadband", "encoding")
+ENCODINGS = ("json", "compact")  # compact: no static metadata, tight separators
+
+
+def command_ids(command):
+    ids = command.get("deviceIds")
+    if ids is None:
+        ids = [command["deviceId"]] if "deviceId" in command else []
+    elif not isinstance(ids, list):
+        raise ValueError("deviceIds must be a list")
+    for device_id in ids:
+        if not isinstance(device_id, (str, int)) or isinstance(device_id, bool):
+            raise ValueError(f"Invalid deviceId: {device_id!r}")
+    return [str(device_id) for device_id in ids]
+
+
+def parse_command(payload):
+    command = json.loads(payload)
+    if not isinstance(command, dict):
+        raise ValueError("Command must be a JSON object")
+    if command.get("action") not in ACTIONS:
+        raise ValueError(f"Unknown action: {command.get('action')}")
+    return command
+
+
+def authorized(command, token, header=None):
+    # Removes the command's "token" and checks it, or the HTTP Authorization
+    # header, against the control token; no token set lets everything in
+    given = command.pop("token", None)
+    if token is None:
+        return True
+    if header is not None and header.startswith("Bearer "):
+        given = header[len("Bearer "):]
+    return isinstance(given, str) and hmac.compare_digest(given.encode(), token.encode())
+
+
+def topic_selector(topic, prefix):
+    # <prefix>/<site>/<type>/<deviceId>; "*" or a missing level matches anything
+    levels = topic[len(prefix) + 1:].split("/")
+    return {key: level for key, level in zip(("site", "type", "deviceId"), levels) if level and level != "*"}
+
+
+def is_pattern(value):
+    return any(char in value for char in "*?[")
+
+
+def matches(pattern, value):
+    return pattern is None or (value is not None and fnmatch.fnmatchcase(value, pattern))
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_settings(settings):
+    if not isinstance(settings, dict):
+        raise ValueError("set must be an object")
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    interval = settings.get("interval", 1)
+    if not is_number(interval) or interval <= 0:
+        raise ValueError("interval must be positive")
+    if "deadband" in settings:
+        check_deadband(settings["deadband"])
+    if "encoding" in settings and settings["encoding"] not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {settings['encoding']}")
+
+
+def check_deadband(deadband):
+    # {"enabled": bool, "heartbeat": seconds, "bands": {field: {"abs" | "pct": number}}}
+    if not isinstance(deadband, dict):
+        raise ValueError("deadband must be an object")
+    if not isinstance(deadband.get("enabled", True), bool):
+        raise ValueError("deadband.enabled must be true or false")
+    heartbeat = deadband.get("heartbeat", 1)
+    if not is_number(heartbeat) or heartbeat <= 0:
+        raise ValueError("deadband.heartbeat must be positive")
+    bands = deadband.get("bands", {})
+    if not isinstance(bands, dict):
+        raise ValueError("deadband.bands must be an object")
+    for field, band in bands.items():
+        kind, threshold = next(iter(band.items())) if isinstance(band, dict) and len(band) == 1 else (None, None)
+        if kind not in ("abs", "pct") or not is_number(threshold) or threshold < 0:
+            raise ValueError(f"deadband band for {field} must be {{\"abs\" | \"pct\": number}}")
+
+
+class ControlQueue:
+    # Commands arrive on the MQTT network thread or HTTP threads and are applied
+    # by the scheduler thread between readings, so devices never need locking
+    def __init__(self):
+        self.commands = queue.SimpleQueue()
+
+    def submit(self, command, callback):
+        self.commands.put((command, callback))
+
+    def call(self, command, timeout=CONTROL_TIMEOUT):
+        replies = queue.SimpleQueue()
+        self.submit(command, replies.put)
+        try:
+            return replies.get(timeout=timeout)
+        except queue.Empty:
+            return {"ok": False, "error": "timed out waiting for the fleet"}
+
+    def wait(self, timeout):
+        # Sleep until timeout or the next command, whichever comes first
+        try:
+            return self.commands.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def pending(self):
+        return not self.commands.empty()
+
+    def get_nowait(self):
+        return self.commands.get_nowait()
+
+
+def start_http_control(control, host, port, token=None):
+    # Without a token the API only listens on loopback
+    if token is None and host not in LOOPBACK_HOSTS:
+        print(f"[Fleet] Control API not started: {host} is not loopback and no control token is set")
+        return None
+
+    class ControlHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/devices":
+                return self.reply(404, {"ok": False, "error": "not found"})
+            if not authorized({}, token, self.headers.get("Authorization")):
+                return self.reply(401, {"ok": False, "error": "unauthorized"})
+            self.reply(200, control.call({"action": "list"}))
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/devices":
+                return self.reply(404, {"ok": False, "error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                command = parse_command(self.rfile.read(length))
+            except (ValueError, KeyError) as e:
+                return self.reply(400, {"ok": False, "error": str(e)})
+            if not authorized(command, token, self.headers.get("Authorization")):
+                return self.reply(401, {"ok": False, "error": "unauthorized"})
+            result = control.call(command)
+            self.reply(200 if result.get("ok") else 400, result)
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ControlHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[Fleet] Control API on http://{host}:{port}/devices")
+    return server
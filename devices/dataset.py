@@ -0,0 +1,168 @@
+import sys
+import json
+import time
+import random
+import argparse
+from array import array
+from pathlib import Path
+from datetime import datetime, timezone
+
+from sensors import create_sensor, SEQUENCE_FIELDS
+from topology import load_topology, device_sites
+
+DEVICES_DIR = Path(__file__).parent.resolve()
+DATASET_DIR = DEVICES_DIR / "dataset"
+DATASET_FILE = "dataset.json"
+INDEX_FILE = "index.json"
+TIMESTAMP_COLUMN = "timestamp.i8"  # int64 epoch milliseconds
+VALUE_SUFFIX = ".f8"               # float64 per numeric field
+NOT_COLUMNS = ("timestamp",) + SEQUENCE_FIELDS
+HISTORY_INTERVAL = 900             # seconds between generated readings
+
+# On-disk layout, one directory per device and UTC month:
+#   dataset/dataset.json                      devices, sites, fields per type
+#   dataset/<type>/<id>/index.json            partitions with first/last timestamp and rows
+#   dataset/<type>/<id>/<YYYY-MM>/timestamp.i8
+#   dataset/<type>/<id>/<YYYY-MM>/<field>.f8  e.g. consumption.f8, phases.L1.current.f8
+# Columns are fixed width and native byte order, so a reader can map them
+# and use them in place.
+
+
+def numeric_paths(data, prefix=()):
+    # Key paths of every numeric leaf of a sensor's data, except the timestamp
+    # and the sequence fields
+    paths = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            paths.extend(numeric_paths(value, prefix + (key,)))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in NOT_COLUMNS:
+            paths.append(prefix + (key,))
+    return paths
+
+
+def partition_of(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc).strftime("%Y-%m")
+
+
+class PartitionWriter:
+    def __init__(self, directory, fields):
+        self.directory = directory
+        self.fields = fields
+        self.partitions = []
+        self.name = None
+        self.timestamps = array("q")
+        self.columns = [array("d") for _ in fields]
+
+    def append(self, timestamp_ms, values):
+        name = partition_of(timestamp_ms)
+        if name != self.name:
+            self.flush()
+            self.name = name
+        self.timestamps.append(timestamp_ms)
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def flush(self):
+        if not self.timestamps:
+            return
+        directory = self.directory / self.name
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / TIMESTAMP_COLUMN, 'wb') as f:
+            self.timestamps.tofile(f)
+        for field, column in zip(self.fields, self.columns):
+            with open(directory / f"{field}{VALUE_SUFFIX}", 'wb') as f:
+                column.tofile(f)
+        self.partitions.append({"name": self.name, "start": self.timestamps[0],
+                                "end": self.timestamps[-1], "rows": len(self.timestamps)})
+        self.timestamps = array("q")
+        self.columns = [array("d") for _ in self.fields]
+
+    def close(self):
+        self.flush()
+        with open(self.directory / INDEX_FILE, 'w') as f:
+            json.dump({"fields": self.fields, "partitions": self.partitions}, f)
+
+
+def generate_device(root, device_type, device_id, start_ms, end_ms, interval, seed=0):
+    # Runs the sensor model over [start, end) on a simulated clock
+    random.seed(f"{seed}-{device_id}")
+    sensor = create_sensor(device_type, device_id, update_interval=interval, start_from_zero=True)
+    now = [start_ms / 1000]
+    sensor.clock = lambda: now[0]
+    paths = numeric_paths(sensor.data)
+    writer = PartitionWriter(root / device_type / device_id, [".".join(path) for path in paths])
+
+    step = int(interval * 1000)
+    rows = 0
+    for timestamp in range(start_ms, end_ms, step):
+        now[0] = timestamp / 1000
+        sensor.generate_data(interval)
+        values = []
+        for path in paths:
+            value = sensor.data
+            for key in path:
+                value = value[key]
+            values.append(value)
+        writer.append(timestamp, values)
+        rows += 1
+    writer.close()
+    return writer.fields, rows
+
+
+def generate_dataset(root, specs, start_ms, end_ms, interval=HISTORY_INTERVAL, seed=0):
+    # specs: [{"deviceId", "type", "site"}]
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    fields = {}
+    rows = 0
+    for spec in specs:
+        device_fields, device_rows = generate_device(root, spec["type"], spec["deviceId"],
+                                                     start_ms, end_ms, interval, seed)
+        fields[spec["type"]] = device_fields
+        rows += device_rows
+    with open(root / DATASET_FILE, 'w') as f:
+        json.dump({"start": start_ms, "end": end_ms, "interval": interval, "byteorder": sys.byteorder,
+                   "fields": fields, "devices": specs}, f)
+    return rows
+
+
+def dataset_specs(generate, sites, topology=None):
+    # The topology's devices keep their site; generated ones are spread
+    # round-robin over `sites` synthetic sites
+    specs = []
+    if topology:
+        for device_id, (site, device_type) in device_sites(load_topology(topology)).items():
+            specs.append({"deviceId": device_id, "type": device_type, "site": site})
+    for device_type, count in generate:
+        for i in range(count):
+            specs.append({"deviceId": f"{device_type}-{i}", "type": device_type, "site": f"Site {i % sites}"})
+    return specs
+
+
+def parse_generate(value):
+    device_type, _, count = value.partition(":")
+    return device_type, int(count)
+
+
+def parse_date(value):
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a columnar history dataset from the sensor models")
+    parser.add_argument("--output", default=str(DATASET_DIR))
+    parser.add_argument("--generate", action="append", type=parse_generate, default=[], metavar="TYPE:COUNT")
+    parser.add_argument("--sites", type=int, default=10, help="synthetic sites for generated devices")
+    parser.add_argument("--no-topology", action="store_true", help="leave out the devices of sites.json")
+    parser.add_argument("--start", type=parse_date, default="2024-01-01", help="YYYY-MM-DD, UTC")
+    parser.add_argument("--end", type=parse_date, default="2025-01-01")
+    parser.add_argument("--interval", type=float, default=HISTORY_INTERVAL, help="seconds between readings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    specs = dataset_specs(args.generate, args.sites, None if args.no_topology else DEVICES_DIR / "sites.json")
+    started = time.perf_counter()
+    rows = generate_dataset(args.output, specs, args.start, args.end, args.interval, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"[Dataset] {len(specs)} devices, {rows} readings in {elapsed:.1f} s "
+          f"({rows / elapsed:.0f} readings/s) -> {args.output}")
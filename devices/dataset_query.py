@@ -0,0 +1,127 @@
+import sys
+import json
+import mmap
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from dataset import DATASET_DIR, DATASET_FILE, INDEX_FILE, TIMESTAMP_COLUMN, VALUE_SUFFIX, parse_date
+
+
+class Dataset:
+    # Read side of dataset.py. Columns are memory-mapped once and exposed as
+    # NumPy views of the mapping, so range queries slice without copying and
+    # only touch the pages they read.
+    def __init__(self, root=DATASET_DIR):
+        self.root = Path(root)
+        with open(self.root / DATASET_FILE, 'r') as f:
+            self.meta = json.load(f)
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Dataset written on a {self.meta['byteorder']}-endian machine")
+        self.devices = {spec["deviceId"]: spec for spec in self.meta["devices"]}
+        self.indexes = {}  # deviceId -> index.json contents
+        self.maps = {}     # column path -> ndarray over its mmap
+
+    def index(self, device_id):
+        index = self.indexes.get(device_id)
+        if index is None:
+            with open(self.device_dir(device_id) / INDEX_FILE, 'r') as f:
+                index = self.indexes[device_id] = json.load(f)
+        return index
+
+    def device_dir(self, device_id):
+        spec = self.devices[device_id]
+        return self.root / spec["type"] / spec["deviceId"]
+
+    def column(self, path, dtype):
+        array = self.maps.get(path)
+        if array is None:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            array = self.maps[path] = np.frombuffer(mapped, dtype=dtype)
+        return array
+
+    def segments(self, device_id, field, start_ms, end_ms):
+        # [(timestamps, values)] views per partition overlapping [start, end)
+        directory = self.device_dir(device_id)
+        result = []
+        for partition in self.index(device_id)["partitions"]:
+            if partition["end"] < start_ms or partition["start"] >= end_ms:
+                continue
+            timestamps = self.column(directory / partition["name"] / TIMESTAMP_COLUMN, np.int64)
+            values = self.column(directory / partition["name"] / f"{field}{VALUE_SUFFIX}", np.float64)
+            first, last = np.searchsorted(timestamps, [start_ms, end_ms])
+            if last > first:
+                result.append((timestamps[first:last], values[first:last]))
+        return result
+
+    def query(self, device_id, field, start_ms, end_ms):
+        # One (timestamps, values) pair; views when the range stays within a
+        # partition, a copy when it has to join several
+        segments = self.segments(device_id, field, start_ms, end_ms)
+        if len(segments) == 1:
+            return segments[0]
+        if not segments:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        return (np.concatenate([timestamps for timestamps, _ in segments]),
+                np.concatenate([values for _, values in segments]))
+
+    def latest(self, device_id, field, at_ms=None):
+        # Last value at or before at_ms (default: the end of the data)
+        directory = self.device_dir(device_id)
+        for partition in reversed(self.index(device_id)["partitions"]):
+            if at_ms is not None and partition["start"] > at_ms:
+                continue
+            timestamps = self.column(directory / partition["name"] / TIMESTAMP_COLUMN, np.int64)
+            position = len(timestamps) if at_ms is None else np.searchsorted(timestamps, at_ms, side="right")
+            if position:
+                values = self.column(directory / partition["name"] / f"{field}{VALUE_SUFFIX}", np.float64)
+                return float(values[position - 1])
+        return None
+
+    def site_totals(self, field, at_ms=None, device_type=None):
+        # Sum of each device's latest `field` per (site, type), e.g.
+        # consumption: types are never summed together, kWh and m³ do not add
+        totals = {}
+        for device_id, spec in self.devices.items():
+            if device_type and spec["type"] != device_type:
+                continue
+            if field not in self.meta["fields"][spec["type"]]:
+                continue
+            value = self.latest(device_id, field, at_ms)
+            if value is not None:
+                key = (spec["site"], spec["type"])
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a columnar history dataset")
+    parser.add_argument("--dataset", default=str(DATASET_DIR))
+    parser.add_argument("--device", help="device id for a range query")
+    parser.add_argument("--field", default="consumption")
+    parser.add_argument("--start", type=parse_date)
+    parser.add_argument("--end", type=parse_date)
+    parser.add_argument("--site-totals", action="store_true", help="sum of the latest --field per site and type")
+    parser.add_argument("--type", help="only devices of this type, for --site-totals")
+    args = parser.parse_args()
+
+    dataset = Dataset(args.dataset)
+    start = args.start if args.start is not None else dataset.meta["start"]
+    end = args.end if args.end is not None else dataset.meta["end"]
+    if args.device:
+        started = time.perf_counter()
+        timestamps, values = dataset.query(args.device, args.field, start, end)
+        mean = float(values.mean()) if len(values) else None
+        elapsed = time.perf_counter() - started
+        print(f"[Dataset] {args.device} {args.field}: {len(values)} readings, mean {mean}, "
+              f"{(timestamps.nbytes + values.nbytes) / elapsed / 1e6:.0f} MB/s in {elapsed * 1000:.2f} ms")
+    if args.site_totals:
+        started = time.perf_counter()
+        totals = dataset.site_totals(args.field, end, args.type)
+        elapsed = time.perf_counter() - started
+        for (site, device_type), total in sorted(totals.items()):
+            print(f"[Dataset] {site} {device_type}: {total:.3f}")
+        print(f"[Dataset] {len(dataset.devices)} devices summed in {elapsed * 1000:.2f} ms")
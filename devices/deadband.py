@@ -0,0 +1,101 @@
+HEARTBEAT = 300  # seconds, longest a device may stay silent
+PHASES = ("L1", "L2", "L3")
+
+# Default bands per device type: field -> {"abs": units} or {"pct": percent of
+# the last published value}. Energy "voltage"/"current" apply to every phase.
+# Each band is twice the per-reading noise (standard deviation) of the field in
+# the sensors.py models, where a uniform draw over a width w has a deviation of
+# w / sqrt(12). A field that moves to or from zero (a meter going idle or
+# starting, sunrise, an outage) is reported whatever its band.
+DEFAULT_BANDS = {
+    "water": {
+        "flowRate": {"abs": 2.0},      # L/min, uniform(1.5, 5.0): sd 1.01
+        "pressure": {"abs": 1.2},      # bar, uniform(2.0, 4.0) + 0.015 per °C: sd 0.59
+        "temperature": {"abs": 14.4},  # °C, uniform(10.0, 35.0): sd 7.2
+    },
+    "gas": {
+        "flowRate": {"abs": 0.35},     # m³/h, uniform(0.15, 0.75): sd 0.17
+        "pressure": {"abs": 0.5},      # bar, uniform(0.9, 1.7) + 0.012 per °C: sd 0.25
+        "temperature": {"abs": 15.6},  # °C, uniform(18.0, 45.0): sd 7.8
+    },
+    "solar": {
+        "powerOutput": {"pct": 26},    # cloud factor uniform(0.7, 1.1): sd 13 % of its mean
+    },
+    "energy": {
+        "voltage": {"abs": 2.3},       # V, 230 ± 2: sd 1.15
+        "current": {"abs": 0.6},       # A, 5 ± 0.5: sd 0.29
+    },
+}
+
+
+def build_bands(device_type, overrides=None):
+    # Flatten the band config of one type to (path, kind, threshold) tuples
+    fields = dict(DEFAULT_BANDS.get(device_type, {}))
+    fields.update((overrides or {}).get(device_type, {}))
+    bands = []
+    for field, band in fields.items():
+        kind, threshold = next(iter(band.items()))
+        if kind not in ("abs", "pct"):
+            raise ValueError(f"Unknown deadband kind for {device_type}.{field}: {kind}")
+        if device_type == "energy" and field in ("voltage", "current"):
+            bands.extend((("phases", phase, field), kind, threshold) for phase in PHASES)
+        else:
+            bands.append(((field,), kind, threshold))
+    return bands
+
+
+def lookup(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+class DeadbandFilter:
+    # Per-device report-by-exception state. Suppressed readings only skip the
+    # publish: the sensor keeps integrating, so the next published reading
+    # carries the full consumption/production total.
+    __slots__ = ("bands", "heartbeat", "last_values", "last_publish")
+
+    def __init__(self, bands, heartbeat=HEARTBEAT):
+        self.bands = bands  # shared by every device of the type
+        self.heartbeat = heartbeat
+        self.last_values = None
+        self.last_publish = 0.0
+
+    def check(self, data, now):
+        # True when the reading should be published
+        if self.last_values is None or now - self.last_publish >= self.heartbeat:
+            return self.accept(data, now)
+        for (path, kind, threshold), last in zip(self.bands, self.last_values):
+            value = lookup(data, path)
+            band = threshold if kind == "abs" else abs(last) * threshold / 100
+            if abs(value - last) > band or (value == 0) != (last == 0):
+                return self.accept(data, now)
+        return False
+
+    def accept(self, data, now):
+        self.last_values = [lookup(data, path) for path, _, _ in self.bands]
+        self.last_publish = now
+        return True
+
+
+class DeadbandStats:
+    def __init__(self):
+        self.sampled = {}    # device type -> readings generated
+        self.published = {}  # device type -> readings published
+
+    def record(self, device_type, published):
+        self.sampled[device_type] = self.sampled.get(device_type, 0) + 1
+        if published:
+            self.published[device_type] = self.published.get(device_type, 0) + 1
+
+    def summary(self):
+        summary = {}
+        for device_type, sampled in self.sampled.items():
+            published = self.published.get(device_type, 0)
+            summary[device_type] = {
+                "sampled": sampled,
+                "published": published,
+                "reduction": round(1 - published / sampled, 3),
+            }
+        return summary
@@ -1,12 +1,16 @@
 import os
+import sys
 import json
 import time
-import math
-import random
 from pathlib import Path
-from datetime import datetime, timezone
 import paho.mqtt.client as mqtt
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # Shared device modules
+from logpipe import ReadingLog
+from publisher import Publisher
+from rollups import RollupAggregator
+from sensors import SolarProductionSensor
+
 SCRIPT_NAME = Path(__file__).stem  # Gets the filename without extension
 
 # Configuration
@@ -15,107 +19,25 @@ MQTT_PORT = 1883
 MQTT_TOPIC = f"sensor/{SCRIPT_NAME}/data"
 REQUEST_TOPIC = f"sensor/{SCRIPT_NAME}/request"
 RESPONSE_TOPIC = f"sensor/{SCRIPT_NAME}/respond"
+ROLLUP_TOPIC = f"sensor/{SCRIPT_NAME}/rollup"
 UPDATE_INTERVAL = 5  # seconds
 START_FROM_ZERO = False  # Set to True to reset consumption
+LOG_EVERY = 1  # log 1 reading in LOG_EVERY; all of them show in the periodic summary
+TRACE = False  # Set to True to log every payload and request in full
 
 SCRIPT_DIR = Path(__file__).parent.resolve()
 DATA_FILE = SCRIPT_DIR / f"{SCRIPT_NAME}.json"
 
-class SolarProductionSensor:
-    def __init__(self, sensor_id):
-        self.sensor_id = SCRIPT_NAME
-        self.panel_area = 10.0  # m²
-        self.panel_efficiency = 0.18  # 18%
-        self.hardwareVersion = "1.5.0"
-        self.software_version = "1.2.0"
-        self.product_number = "SOL-PRO-1001"
-        self.manufacturer = "GreenTech Solar"
-        self.data = self.initialize_data_structure()
-        self.load_existing_data()
-
-    def initialize_data_structure(self):
-        return {
-            "sensorId": self.sensor_id,
-            "type": "solar",
-            "hardwareVersion": self.hardwareVersion,
-            "softwareVersion": self.software_version,
-            "productNumber": self.product_number,
-            "manufacturer": self.manufacturer,
-            "production": 0.0,
-            "powerOutput": 0.0,
-            "irradiance": 0.0,
-            "panelTemperature": 0.0,
-            "timestamp": int(datetime.now(timezone.utc).timestamp() * 1000)
-        }
-
-    def load_existing_data(self):
-        if not START_FROM_ZERO and DATA_FILE.exists():
-            try:
-                with open(DATA_FILE, 'r') as f:
-                    existing_data = json.load(f)
-                    self.data['totalProduction'] = existing_data.get('totalProduction', 0.0)
-                    print(f"Loaded previous production: {self.data['totalProduction']} kWh")
-            except Exception as e:
-                print(f"Error loading solar data: {e}")
-        elif START_FROM_ZERO:
-            self.data['totalProduction'] = 0.0
-            print("Starting solar production from zero")
-
-    def save_data(self):
-        try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(self.data, f, indent=2)
-        except Exception as e:
-            print(f"Error saving solar data: {e}")
-
-    def simulate_solar_irradiance(self, hour):
-        peak_irradiance = 1000  # W/m²
-        if 6 <= hour <= 18:
-            irradiance = peak_irradiance * math.exp(-0.5 * ((hour - 12) / 3.5) ** 2)
-            cloud_effect = random.uniform(0.7, 1.1)
-            irradiance *= cloud_effect
-        else:
-            irradiance = 0.0
-        return round(irradiance, 1)
-
-    def generate_data(self):
-        now = datetime.now()
-        current_hour = now.hour + now.minute / 60
-
-        # Irradiance simulation
-        irradiance = self.simulate_solar_irradiance(current_hour)
-        self.data["irradiance"] = irradiance
-
-        # Panel temperature
-        base_temp = 20 + (irradiance / 1000) * 25 + random.uniform(-2, 2)
-        self.data["panelTemperature"] = round(base_temp, 1)
-
-        # Efficiency loss
-        temp_loss = max(0, self.data["panelTemperature"] - 25) * 0.005
-        effective_efficiency = max(0.1, self.panel_efficiency * (1 - temp_loss))
-
-        # Power output
-        power = irradiance * self.panel_area * effective_efficiency
-        self.data["powerOutput"] = round(power, 1)
-
-        # Energy production in kWh
-        produced = round(power * UPDATE_INTERVAL / 3600000, 4)
-        self.data["production"] += produced
-
-        # ✅ Correct timestamp update
-        self.data["timestamp"] = int(datetime.now(timezone.utc).timestamp() * 1000)
-
-        return self.data
+log = ReadingLog(default_every=LOG_EVERY, trace=[SCRIPT_NAME] if TRACE else ())
 
 def on_connect(client, userdata, flags, rc):
-    print(f"[Solar] Connected to broker with result code {rc}")
+    log.info(f"[Solar] Connected to broker with result code {rc}")
     client.subscribe(REQUEST_TOPIC)
 
 def on_message(client, userdata, msg):
-    print(f"[Solar] Received on {msg.topic}: {msg.payload.decode()}")
+    log.received("solar", SCRIPT_NAME, msg.topic, msg.payload)
     if msg.topic == REQUEST_TOPIC:
         client.publish(RESPONSE_TOPIC, "ok")
-        print(f"[Solar] Responded with 'ok' on topic {RESPONSE_TOPIC}")
 
 def run_solar_sensor():
     client = mqtt.Client()
@@ -123,18 +45,23 @@ def run_solar_sensor():
     client.on_message = on_message
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_start()
+    publisher = Publisher(client)
+    log.start()
 
-    sensor = SolarProductionSensor("solar001")
+    sensor = SolarProductionSensor(SCRIPT_NAME, data_file=DATA_FILE, update_interval=UPDATE_INTERVAL,
+                                   start_from_zero=START_FROM_ZERO)
+    rollups = RollupAggregator(SCRIPT_NAME, sensor.data["type"])
     last_save_time = time.time()
 
     try:
         while True:
-            payload = sensor.generate_data()
-            client.publish(MQTT_TOPIC, json.dumps(payload), qos=1)
-
-            print(f"[Solar] Published: {payload['powerOutput']} W | "
-                  f"{payload['irradiance']} W/m² | {payload['panelTemperature']} °C | "
-                  f"Total: {payload['production']:.2f} kWh")
+            payload = sensor.stamp(sensor.generate_data())
+            if not publisher.publish(MQTT_TOPIC, json.dumps(payload)):
+                log.error("solar", SCRIPT_NAME, f"Publish window full ({publisher.window} awaiting ack), "
+                                                "reading coalesced into the next one")
+            for rollup in rollups.update(sensor.data):
+                publisher.publish(f"{ROLLUP_TOPIC}/{rollup['window']}", json.dumps(rollup), force=True)
+            log.reading("solar", SCRIPT_NAME, payload)
 
             if time.time() - last_save_time > 300:
                 sensor.save_data()
@@ -144,8 +71,13 @@ def run_solar_sensor():
 
     except KeyboardInterrupt:
         sensor.save_data()
+        # The open buckets go out as partial rollups before the loop stops
+        for rollup in rollups.flush():
+            publisher.publish(f"{ROLLUP_TOPIC}/{rollup['window']}", json.dumps(rollup), force=True)
+        publisher.drain()
         client.loop_stop()
-        print("[Solar] Stopped. Final saved production:", sensor.data['totalProduction'])
+        log.close()
+        print("[Solar] Stopped. Final saved production:", sensor.data['production'])
 
 if __name__ == "__main__":
     print("Starting solar production sensor...")
@@ -0,0 +1,1145 @@
+import os
+import json
+import time
+import heapq
+import socket
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+
+from anomaly import AnomalyDetector
+from control import (MAX_ADD, TOKEN_ENV, ControlQueue, authorized, check_settings, command_ids, is_pattern,
+                     matches, parse_command, start_http_control, topic_selector)
+from deadband import DeadbandFilter, DeadbandStats, build_bands, lookup, HEARTBEAT
+from logpipe import ReadingLog, RATE_LIMIT, SUMMARY_INTERVAL
+from profiling import Profiler
+from mqtt5 import V5Options, V5Session, connect_properties, split_metadata
+from publisher import Publisher, ACK_TIMEOUT, QOS1_WINDOW, IN_FLIGHT_WINDOW
+from reconnect import ReconnectManager, SESSION_EXPIRY
+from rollups import RollupAggregator
+from sharding import BrokerHealth, HashRing, parse_brokers
+from status import StatusTable
+from sampling import AdaptiveSampler, INTERVAL_LIMITS, CHANGE_THRESHOLD
+from tls import create_tls_context, MQTTS_PORT
+from topology import TOPOLOGY_FILE, device_sites, load_topology, site_key
+from sensors import create_sensor, device_topics, read_state, topic_device_id, UPDATE_INTERVAL
+
+DEVICES_DIR = Path(__file__).parent.resolve()
+MANIFEST_FILE = DEVICES_DIR / "fleet.json"
+PROFILE_DIR = DEVICES_DIR / "profiles"
+
+# Defaults, overridable from the manifest
+MQTT_BROKER = "broker.hivemq.com"
+MQTT_PORT = 1883
+CONNECTIONS = 4          # connections per broker, shared by the fleet
+CONNECT_RATE = 20        # new connections per second
+LOAD_WORKERS = 16        # threads reading per-device state files
+SAVE_INTERVAL = 300      # seconds between snapshot saves
+RETRY_DELAY = 0.1        # seconds before retrying a device whose connection is not up yet
+SUBSCRIBE_BATCH = 500    # request topics per SUBSCRIBE packet
+CLIENT_ID_PREFIX = f"fleet-{socket.gethostname()}-{os.getpid()}"  # + slot; set clientIdPrefix to resume sessions after a restart
+STATS_INTERVAL = 30      # seconds between publisher stats lines
+COMPACT_SEPARATORS = (",", ":")
+TOPIC_LAYOUT_FLAT = "flat"
+TOPIC_LAYOUT_SITE = "site"
+
+# What the scheduler does with a device that is due while its connection's
+# in-flight window is full
+BACKPRESSURE_COALESCE = "coalesce"  # generate on time, keep only the newest unsent reading
+BACKPRESSURE_SLOW = "slow"          # hold the device back until the window has room
+
+
+def load_manifest(path):
+    # Manifest lists explicit devices (optionally with their saved state file,
+    # relative to the manifest) and generated groups of devices of one type
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    base = Path(path).parent
+
+    specs = []
+    for device in manifest.get("devices", []):
+        state_file = device.get("stateFile")
+        specs.append({
+            "deviceId": str(device["deviceId"]),
+            "type": device["type"],
+            "stateFile": base / state_file if state_file else None,
+        })
+    for group in manifest.get("generate", []):
+        specs.extend(generate_specs(group["type"], group["count"],
+                                    group.get("firstId", 0), group.get("prefix", "")))
+    # "topologyDevices": every device of the topology file (Site.js layout)
+    # that is not listed above
+    if manifest.get("topology"):
+        manifest["topology"] = base / manifest["topology"]
+    if manifest.get("topologyDevices"):
+        listed = {spec["deviceId"] for spec in specs}
+        for device_id, (_, device_type) in device_sites(load_topology(manifest.get("topology", TOPOLOGY_FILE))).items():
+            if device_id not in listed:
+                specs.append({"deviceId": device_id, "type": device_type, "stateFile": None})
+    return manifest, specs
+
+
+def generate_specs(device_type, count, first_id=0, prefix=""):
+    return [
+        {"deviceId": f"{prefix}{int(first_id) + i}", "type": device_type, "stateFile": None}
+        for i in range(count)
+    ]
+
+
+def load_states(specs, snapshot_file=None, workers=LOAD_WORKERS):
+    # One parse of the consolidated snapshot when there is one; per-device state
+    # files are only read (in parallel) for devices the snapshot does not cover
+    states = {}
+    if snapshot_file and Path(snapshot_file).exists():
+        states = read_state(snapshot_file) or {}
+
+    pending = [spec for spec in specs if spec["stateFile"] and spec["deviceId"] not in states]
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for spec, state in zip(pending, pool.map(lambda s: read_state(s["stateFile"]), pending)):
+                if state is not None:
+                    states[spec["deviceId"]] = state
+    return states
+
+
+def save_snapshot(devices, snapshot_file):
+    tmp_file = Path(f"{snapshot_file}.tmp")
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump({device.device_id: device.sensor.data for device in devices if device is not None}, f)
+        os.replace(tmp_file, snapshot_file)
+    except IOError as e:
+        print(f"[Fleet] Error saving snapshot: {e}")
+
+
+# Reading pipeline stages; the fleet calls them through attributes so stage
+# timing can swap in timed wrappers without any cost while it is off
+def generate_reading(sensor, elapsed):
+    return sensor.generate_data(elapsed)
+
+
+def send_reading(publisher, topic, message):
+    return publisher.publish(topic, message)
+
+
+class NullMessageInfo:
+    rc = mqtt.MQTT_ERR_SUCCESS
+
+    def __init__(self, mid):
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class NullClient:
+    # Stands in for a broker connection in --dry-run mode; every publish is
+    # acknowledged immediately
+    def __init__(self):
+        self.mid = 0
+        self.on_publish = None
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.mid += 1
+        if self.on_publish is not None:
+            self.on_publish(self, None, self.mid)
+        return NullMessageInfo(self.mid)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class ConnectionPool:
+    # `size` connections to each broker of `brokers` [(host, port)]; slot
+    # b * size + i is connection i of broker b. Devices are spread across
+    # brokers by consistent hashing on their id and fail over along the ring.
+    def __init__(self, brokers, size, connect_rate, publish_mode=QOS1_WINDOW,
+                 window=IN_FLIGHT_WINDOW, dry_run=False, tls_context=None, v5_options=None,
+                 reconnect=None, persistent=False, client_id_prefix=CLIENT_ID_PREFIX):
+        self.brokers = brokers
+        self.size = size
+        self.ring = HashRing([f"{host}:{port}" for host, port in brokers])
+        self.health = [BrokerHealth(f"{host}:{port}") for host, port in brokers]
+        self.epoch = 0  # bumped whenever a broker is skipped or comes back
+        self.reconnect = reconnect or ReconnectManager()
+        self.persistent = persistent  # clean session off: the broker keeps subscriptions across reconnects
+        self.client_id_prefix = client_id_prefix
+        self.tls_context = tls_context  # shared by every connection, for TLS session reuse
+        self.v5_options = v5_options    # MQTT 5 connections when set
+        self.publish_mode = publish_mode
+        self.window = window
+        self.dry_run = dry_run
+        slots = len(brokers) * size
+        self.clients = [None] * slots
+        self.publishers = [None] * slots
+        self.v5_sessions = [None] * slots
+        # subscriptions and subscribed are changed by the scheduler (devices
+        # placed, moved, removed) and read by paho's network threads in
+        # on_connect; the lock covers both, never a paho call
+        self.lock = threading.Lock()
+        self.subscriptions = [set() for _ in range(slots)]  # request topics per connection
+        self.subscribed = [set() for _ in range(slots)]     # topics the broker session holds, as far as we sent them
+        self.responses = {}                                # request topic -> response topic
+        self.control_topic = None
+        self.config_topic = None  # fan-out configuration, <topic>/<site>/<type>/<deviceId>
+        self.on_control = None    # callback(client, topic, payload) for control and config topics
+        self.on_request = None    # callback(client, topic, response topic, payload) for JSON requests
+        self.on_received = None   # callback(topic, payload) for every device request, for logging
+        self.connect_interval = 1.0 / connect_rate if connect_rate else 0.0
+        self.next_connect = 0.0
+        self.connects = 0
+
+    def add(self, device, index):
+        device.brokers = self.ring.preference(device.device_id) if len(self.brokers) > 1 else (0,)
+        self.place(device, self.route(device, index))
+
+    def route(self, device, index):
+        # The first available broker in the device's ring order (its owner
+        # unless that one is down); the owner when none is
+        broker = next((b for b in device.brokers if self.health[b].available), device.brokers[0])
+        return broker * self.size + index % self.size
+
+    def move(self, device, slot):
+        self.remove(device)
+        self.place(device, slot)
+
+    def place(self, device, slot):
+        device.slot = slot
+        device.route_epoch = self.epoch
+        topic = device.topics["request"]
+        with self.lock:
+            self.subscriptions[device.slot].add(topic)
+            self.responses[topic] = device.topics["response"]
+        # Devices added at runtime subscribe on the live connection
+        client = self.clients[device.slot]
+        if client is not None and client.is_connected() and not self.dry_run:
+            self.subscribe(client, device.slot, [topic])
+
+    def remove(self, device):
+        topic = device.topics["request"]
+        with self.lock:
+            self.subscriptions[device.slot].discard(topic)
+            self.responses.pop(topic, None)
+        client = self.clients[device.slot]
+        if client is not None and client.is_connected() and not self.dry_run:
+            client.unsubscribe(topic)
+            with self.lock:
+                self.subscribed[device.slot].discard(topic)
+
+    def subscribe(self, client, slot, topics):
+        rc, _ = client.subscribe([(topic, 0) for topic in topics])
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            with self.lock:
+                self.subscribed[slot].update(topics)
+
+    def publisher_for(self, slot):
+        # Connections are opened lazily, on the first publish of one of their
+        # devices, and no faster than connect_rate; None means "not yet"
+        client = self.clients[slot]
+        if client is None:
+            now = time.monotonic()
+            if now < self.next_connect:
+                return None
+            self.next_connect = now + self.connect_interval
+            client = self.clients[slot] = self.open(slot)
+            self.publishers[slot] = Publisher(client, self.publish_mode, self.window,
+                                              v5=self.v5_sessions[slot])
+            self.connects += 1
+        return self.publishers[slot] if client.is_connected() else None
+
+    def open(self, slot):
+        if self.dry_run:
+            return NullClient()
+        client_id = f"{self.client_id_prefix}-{slot}"
+        if self.v5_options is not None:
+            self.v5_sessions[slot] = V5Session(self.v5_options)
+            client = mqtt.Client(client_id, userdata=slot, protocol=mqtt.MQTTv5)
+        else:
+            client = mqtt.Client(client_id, clean_session=not self.persistent, userdata=slot)
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        client.on_disconnect = self.on_disconnect
+        client.on_connect_fail = self.on_connect_fail
+        if self.tls_context is not None:
+            client.tls_set_context(self.tls_context)
+        self.connect(client, slot)
+        return client
+
+    def connect(self, client, slot):
+        host, port = self.brokers[slot // self.size]
+        if self.v5_options is not None and self.persistent:
+            client.connect_async(host, port, 60, clean_start=False,
+                                 properties=connect_properties(SESSION_EXPIRY))
+        else:
+            client.connect_async(host, port, 60)
+        client.loop_start()
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        print(f"[Fleet] Connection {userdata} up with result code {rc}")
+        if rc != 0:
+            return
+        self.reconnect.connected(userdata)
+        if self.health[userdata // self.size].up():
+            self.epoch += 1
+            print(f"[Fleet] Broker {self.health[userdata // self.size].name} is back, devices return to it")
+        session = self.v5_sessions[userdata]
+        if session is not None:
+            session.reset(getattr(properties, "TopicAliasMaximum", 0))
+        control = []
+        if userdata == 0:
+            control = [topic for topic in (self.control_topic, self.config_topic and f"{self.config_topic}/#")
+                       if topic]
+        # A resumed session keeps what was subscribed before the drop; devices
+        # placed or removed on this slot since then still need their change
+        with self.lock:
+            if not (self.persistent and flags.get("session present")):
+                self.subscribed[userdata] = set()
+            wanted = self.subscriptions[userdata] | set(control)
+            stale = list(self.subscribed[userdata] - wanted)
+            self.subscribed[userdata].difference_update(stale)
+            missing = wanted - self.subscribed[userdata]
+        if stale:
+            client.unsubscribe(stale)
+        topics = [topic for topic in control if topic in missing] + [topic for topic in missing if topic not in control]
+        # Paced fleet-wide, so a broker restart is not met by every
+        # connection resubscribing at once
+        self.reconnect.schedule_subscribe(lambda batch: self.subscribe(client, userdata, batch),
+                                          topics, SUBSCRIBE_BATCH)
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        if rc == 0:
+            return  # our own disconnect()
+        print(f"[Fleet] Connection {userdata} lost with result code {rc}")
+        session = self.v5_sessions[userdata]
+        if session is not None:
+            session.disconnected(client)
+        self.lost(client, userdata)
+
+    def on_connect_fail(self, client, userdata):
+        self.lost(client, userdata)
+
+    def lost(self, client, slot):
+        # Stop paho's own retry loop (fixed exponential delays, no jitter) and
+        # let the reconnect manager pick the time of the next attempt
+        client.loop_stop()
+        health = self.health[slot // self.size]
+        if health.down():
+            self.epoch += 1
+            print(f"[Fleet] Broker {health.name} unavailable, its devices fail over")
+        due = self.reconnect.schedule_reconnect(slot, lambda: self.reopen(slot))
+        print(f"[Fleet] Connection {slot} retrying in {due - time.monotonic():.1f} s")
+
+    def reopen(self, slot):
+        client = self.clients[slot]
+        client.loop_stop()  # joins the finished network thread
+        self.connect(client, slot)
+
+    def on_message(self, client, userdata, msg):
+        if msg.topic == self.control_topic or self.is_config(msg.topic):
+            if self.on_control is not None:
+                self.on_control(client, msg.topic, msg.payload)
+            return
+        response = self.responses.get(msg.topic)
+        if response is not None:
+            if self.on_received is not None:
+                self.on_received(msg.topic, msg.payload)
+            # JSON objects are device commands; anything else is the plain
+            # request the devices have always answered with "ok"
+            if msg.payload[:1] == b"{" and self.on_request is not None:
+                self.on_request(client, msg.topic, response, msg.payload)
+            elif self.publishers[userdata] is not None:
+                self.publishers[userdata].reply(response, "ok")
+            else:
+                client.publish(response, "ok")
+
+    def is_config(self, topic):
+        return (self.config_topic is not None and topic.startswith(f"{self.config_topic}/")
+                and topic != f"{self.config_topic}/response")
+
+    def broker_stats(self):
+        stats = []
+        for broker, health in enumerate(self.health):
+            slots = range(broker * self.size, (broker + 1) * self.size)
+            publishers = [self.publishers[slot].stats() for slot in slots if self.publishers[slot] is not None]
+            stats.append({
+                "broker": health.name,
+                "available": health.available,
+                "connected": health.connected,
+                "failures": health.total_failures,
+                "devices": sum(len(self.subscriptions[slot]) for slot in slots),
+                "published": sum(p["published"] for p in publishers),
+                "acked": sum(p["acked"] for p in publishers),
+            })
+        return stats
+
+    def close(self):
+        for client in self.clients:
+            if client is not None:
+                # DISCONNECT first, while the network loop is still there to
+                # send it and then wind down; stopping the loop first leaves
+                # the broker with a dropped socket instead of a clean goodbye
+                client.disconnect()
+                client.loop_stop()
+
+
+class FleetDevice:
+    __slots__ = ("device_id", "type", "sensor", "topics", "rollups", "deadband", "sampler",
+                 "anomaly", "interval", "compact", "meta_sent", "last_sample", "slot", "brokers",
+                 "route_epoch", "published", "paused", "generation", "messages", "errors", "last_publish")
+
+    def __init__(self, sensor, deadband=None, sampler=None, anomaly=None, compact=False, site=None):
+        self.device_id = sensor.device_id
+        self.type = sensor.device_type
+        self.sensor = sensor
+        self.topics = device_topics(self.device_id, self.type, site)
+        self.rollups = RollupAggregator(self.device_id, self.type)
+        self.deadband = deadband
+        self.sampler = sampler
+        self.anomaly = anomaly
+        self.interval = sensor.update_interval
+        self.compact = compact    # readings without static metadata, which goes to the meta topic
+        self.meta_sent = False
+        self.last_sample = None
+        self.slot = 0
+        self.brokers = (0,)  # broker indices in ring order
+        self.route_epoch = 0  # pool epoch the slot was chosen in
+        self.published = False
+        self.paused = False
+        self.generation = 0  # bumped to invalidate the device's pending schedule entry
+        self.messages = 0
+        self.errors = 0        # readings the connection could not take right away
+        self.last_publish = 0.0  # epoch seconds
+
+
+class Fleet:
+    def __init__(self, manifest, specs, states, dry_run=False):
+        self.interval = manifest.get("updateInterval", UPDATE_INTERVAL)
+        self.snapshot_file = manifest.get("snapshot")
+        self.backpressure = manifest.get("backpressure", BACKPRESSURE_COALESCE)
+        # mqtts: {"enabled": true, "caFile": ..., "ciphers": ..., "maxVersion": "TLSv1_3"}
+        tls = manifest.get("tls") or {}
+        self.tls_context = create_tls_context(tls) if tls.get("enabled") else None
+        default_port = MQTTS_PORT if self.tls_context else MQTT_PORT
+        # Reconnects: {"persistentSession": true, "clientIdPrefix": ..., "backoffBase": 1,
+        # "backoffCap": 60, "rate": 50, "resubscribeRate": 2000}
+        reconnect = manifest.get("reconnect") or {}
+        self.reconnect = ReconnectManager(reconnect).start()
+        # MQTT 5: {"enabled": true, "messageExpiry": 900, "topicAliases": true, "stripMetadata": false}
+        mqtt5 = manifest.get("mqtt5") or {}
+        self.v5_options = V5Options(mqtt5) if mqtt5.get("enabled") else None
+        self.strip_metadata = self.v5_options is not None and self.v5_options.strip_metadata
+        # Sharding: "brokers": [{"host": ..., "port": ...}, ...]; "connections" is per broker
+        brokers = parse_brokers(manifest, MQTT_BROKER, default_port)
+        self.pool = ConnectionPool(brokers, manifest.get("connections", CONNECTIONS),
+                                   manifest.get("connectRate", CONNECT_RATE),
+                                   manifest.get("publishMode", QOS1_WINDOW),
+                                   manifest.get("inFlightWindow", IN_FLIGHT_WINDOW), dry_run,
+                                   self.tls_context, self.v5_options, self.reconnect,
+                                   reconnect.get("persistentSession", False),
+                                   reconnect.get("clientIdPrefix") or CLIENT_ID_PREFIX)
+        # Report-by-exception: {"enabled": true, "heartbeat": 300, "bands": {type: {field: band}}}
+        deadband = manifest.get("deadband") or {}
+        self.deadband_enabled = deadband.get("enabled", False)
+        self.heartbeat = deadband.get("heartbeat", HEARTBEAT)
+        self.bands = {}  # device type -> bands, shared by the type's devices
+        self.deadband_stats = DeadbandStats()
+        # Adaptive sampling: {"enabled": true, "intervals": {type: {"min": 5, "max": 300}}}
+        sampling = manifest.get("adaptiveSampling") or {}
+        self.sampling_enabled = sampling.get("enabled", False)
+        self.interval_limits = dict(INTERVAL_LIMITS)
+        for device_type, limits in sampling.get("intervals", {}).items():
+            self.interval_limits[device_type] = (limits["min"], limits["max"])
+        self.change_threshold = sampling.get("changeThreshold", CHANGE_THRESHOLD)
+        self.band_overrides = deadband.get("bands")
+        # Edge anomaly detection: {"enabled": true, "eventsOnly": false}; events go
+        # to <prefix>/<id>/events, eventsOnly drops the raw readings (rollups stay)
+        anomaly = manifest.get("anomaly") or {}
+        self.anomaly_enabled = anomaly.get("enabled", False)
+        self.events_only = self.anomaly_enabled and anomaly.get("eventsOnly", False)
+        self.anomaly_events = 0
+        # Live status table for status.py: {"enabled": true, "path": null, "capacity": null}
+        status = manifest.get("status") or {}
+        self.status = None
+        if status.get("enabled"):
+            self.status = StatusTable(status.get("path"), status.get("capacity") or max(2 * len(specs), 1024))
+
+        # Reading log: {"readingsEvery": 0, "sampleEvery": {type: n}, "rateLimit": 10,
+        # "summaryInterval": 30, "trace": [deviceId, ...]}; with readingsEvery 0 only
+        # the per-type summary lines and traced devices are written
+        log_config = manifest.get("logging") or {}
+        self.log = ReadingLog(sample_every=log_config.get("sampleEvery"),
+                              default_every=log_config.get("readingsEvery", 0),
+                              rate=log_config.get("rateLimit", RATE_LIMIT),
+                              summary_interval=log_config.get("summaryInterval", SUMMARY_INTERVAL),
+                              trace=log_config.get("trace", ())).start()
+
+        # Runtime membership: {"topic": "fleet/control", "httpHost": "127.0.0.1", "httpPort": 8765,
+        # "token": ..., "maxAdd": 1000}
+        self.control_config = manifest.get("control") or {}
+        self.control = ControlQueue()
+        self.control_token = os.environ.get(TOKEN_ENV) or self.control_config.get("token")
+        self.max_add = self.control_config.get("maxAdd", MAX_ADD)
+        mqtt_control = self.control_config.get("topic") or self.control_config.get("configTopic")
+        if mqtt_control and self.control_token is None:
+            # Anyone on the broker can publish to the control topics
+            print(f"[Fleet] Control topics ignored: set control.token or {TOKEN_ENV} to take MQTT commands")
+        else:
+            self.pool.control_topic = self.control_config.get("topic")
+            self.pool.config_topic = self.control_config.get("configTopic")
+        self.pool.on_control = self.on_control_message
+        self.pool.on_request = self.on_device_request
+        self.pool.on_received = self.on_device_message
+        # deviceId -> (site, type), for per-site configuration and topics
+        topology = manifest.get("topology", TOPOLOGY_FILE)
+        self.sites = device_sites(load_topology(topology)) if topology and Path(topology).exists() else {}
+        # "flat": <prefix>/<id>/... per device type, "site": site/<site>/<type>/<id>/...
+        # for devices of the topology (the others stay flat)
+        self.site_topics = manifest.get("topicLayout", TOPIC_LAYOUT_FLAT) == TOPIC_LAYOUT_SITE
+        self.profiler = Profiler(manifest.get("profileDir", PROFILE_DIR))
+        self.generate = generate_reading
+        self.serialize = json.dumps
+        self.send = send_reading
+
+        self.devices = []   # index -> FleetDevice, None for removed devices
+        self.index_of = {}  # deviceId -> index
+        self.free = []      # indices of removed devices, reused by later adds
+        self.heap = []      # (due, index, generation) schedule entries
+        self.generations = 0
+        for spec in specs:
+            self.insert(self.create_device(spec["deviceId"], spec["type"], states.get(spec["deviceId"], {})))
+        self.pending = [{} for _ in self.pool.clients]  # per connection: device index -> newest unsent reading
+        self.pending_count = 0
+        self.published_once = 0
+        self.messages = 0
+        self.coalesced = 0
+        self.deferred = 0
+        self.failovers = 0
+        self.broker_published = [0] * len(brokers)  # at the previous stats line, for rates
+        self.broker_stats_at = time.monotonic()
+
+    def create_device(self, device_id, device_type, state=None):
+        sensor = create_sensor(device_type, device_id, update_interval=self.interval, state=state or {})
+        sampler = None
+        if self.sampling_enabled:
+            sampler = AdaptiveSampler(device_type, self.interval_limits, self.change_threshold)
+        anomaly = AnomalyDetector(device_id, device_type) if self.anomaly_enabled else None
+        site = self.sites.get(device_id) if self.site_topics else None
+        return FleetDevice(sensor, self.deadband_filter(device_type, self.band_overrides), sampler, anomaly,
+                           self.strip_metadata, site_key(site[0]) if site else None)
+
+    def next_generation(self):
+        # Fleet-wide counter, so a stale entry never matches a device that
+        # later reuses the same index
+        self.generations += 1
+        return self.generations
+
+    def insert(self, device, index=None):
+        if index is None:
+            index = self.free.pop() if self.free else len(self.devices)
+        if index < len(self.devices):
+            device.generation = self.next_generation()
+        if index == len(self.devices):
+            self.devices.append(device)
+        else:
+            self.devices[index] = device
+        self.index_of[device.device_id] = index
+        self.pool.add(device, index)
+        return index
+
+    def schedule(self, index, due):
+        device = self.devices[index]
+        heapq.heappush(self.heap, (due, index, device.generation))
+
+    def on_control_message(self, client, topic, payload):
+        # Control and config topic commands; the result goes to <topic>/response.
+        # A config topic message is a configure command for the devices its
+        # topic selects.
+        if topic == self.pool.control_topic:
+            response_topic = f"{self.pool.control_topic}/response"
+        else:
+            response_topic = f"{self.pool.config_topic}/response"
+        try:
+            if topic == self.pool.control_topic:
+                command = parse_command(payload)
+            else:
+                command = json.loads(payload)
+                if not isinstance(command, dict):
+                    raise ValueError("Command must be a JSON object")
+                command.update(topic_selector(topic, self.pool.config_topic), action="configure")
+            if not self.mqtt_authorized(command):
+                raise ValueError("unauthorized")
+        except (ValueError, KeyError) as e:
+            client.publish(response_topic, json.dumps({"ok": False, "error": str(e)}))
+            return
+        self.control.submit(command, lambda result: client.publish(response_topic, json.dumps(result)))
+
+    def on_device_message(self, topic, payload):
+        # Network thread: index_of/devices are only read
+        index = self.index_of.get(topic_device_id(topic))
+        device = self.devices[index] if index is not None else None
+        if device is not None:
+            self.log.received(device.type, device.device_id, topic, payload)
+
+    def on_device_request(self, client, topic, response_topic, payload):
+        # A command on one device's request topic applies to that device only
+        try:
+            command = parse_command(payload)
+            if command["action"] != "configure":
+                raise ValueError(f"Unsupported device command: {command['action']}")
+            if not self.mqtt_authorized(command):
+                raise ValueError("unauthorized")
+        except (ValueError, KeyError) as e:
+            client.publish(response_topic, json.dumps({"ok": False, "error": str(e)}))
+            return
+        command.pop("site", None)
+        command.pop("type", None)
+        command["deviceId"] = topic_device_id(topic)
+        self.control.submit(command, lambda result: client.publish(response_topic, json.dumps(result)))
+
+    def mqtt_authorized(self, command):
+        # MQTT commands are never taken without a control token
+        return self.control_token is not None and authorized(command, self.control_token)
+
+    def apply_commands(self, command=None):
+        if command is not None:
+            self.apply(*command)
+        while self.control.pending():
+            self.apply(*self.control.get_nowait())
+
+    def apply(self, command, callback):
+        try:
+            result = getattr(self, f"command_{command['action']}")(command)
+            result["ok"] = True
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # A malformed command is answered, never allowed to stop the scheduler
+            result = {"ok": False, "error": str(e)}
+        result["action"] = command["action"]
+        callback(result)
+
+    def command_add(self, command):
+        device_type = command["type"]
+        if not isinstance(device_type, str) or device_type not in INTERVAL_LIMITS:
+            raise ValueError(f"Unknown device type: {device_type}")
+        if "count" in command:
+            count, first_id = command["count"], command.get("firstId", 0)
+            if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+                raise ValueError("count must be a positive integer")
+            if count > self.max_add:
+                raise ValueError(f"count must be at most {self.max_add}")
+            if not isinstance(first_id, int) or isinstance(first_id, bool) or first_id < 0:
+                raise ValueError("firstId must be a non-negative integer")
+            if not isinstance(command.get("prefix", ""), str):
+                raise ValueError("prefix must be a string")
+            ids = [spec["deviceId"] for spec in generate_specs(device_type, count, first_id,
+                                                                command.get("prefix", ""))]
+        else:
+            ids = command_ids(command)
+            if len(ids) > self.max_add:
+                raise ValueError(f"deviceIds must list at most {self.max_add} devices")
+        now = time.monotonic()
+        added = []
+        for device_id in ids:
+            if device_id in self.index_of:
+                continue
+            index = self.insert(self.create_device(device_id, device_type))
+            self.schedule(index, now)
+            added.append(device_id)
+        return {"added": added}
+
+    def command_remove(self, command):
+        removed = []
+        for device_id in command_ids(command):
+            index = self.index_of.pop(device_id, None)
+            if index is None:
+                continue
+            device = self.devices[index]
+            self.pool.remove(device)
+            if self.pending[device.slot].pop(index, None) is not None:
+                self.pending_count -= 1
+            # Its schedule entry is dropped when it comes up
+            self.devices[index] = None
+            if self.status is not None:
+                self.status.clear(index)
+            self.free.append(index)
+            removed.append(device_id)
+        return {"removed": removed}
+
+    def command_pause(self, command):
+        paused = []
+        for device_id in command_ids(command):
+            device = self.device(device_id)
+            if not device.paused:
+                device.paused = True
+                device.generation = self.next_generation()
+                if self.status is not None:
+                    self.status.update(self.index_of[device_id], device, 0.0)
+                paused.append(device_id)
+        return {"paused": paused}
+
+    def command_resume(self, command):
+        resumed = []
+        now = time.monotonic()
+        for device_id in command_ids(command):
+            device = self.device(device_id)
+            if device.paused:
+                device.paused = False
+                # Time spent paused is not integrated into the accumulators
+                device.last_sample = None
+                self.schedule(self.index_of[device_id], now)
+                resumed.append(device_id)
+        return {"resumed": resumed}
+
+    def command_retype(self, command):
+        device_id = str(command["deviceId"])
+        device_type = command["type"]
+        if not isinstance(device_type, str) or device_type not in INTERVAL_LIMITS:
+            raise ValueError(f"Unknown device type: {device_type}")
+        old = self.device(device_id)
+        index = self.index_of[device_id]
+        self.pool.remove(old)
+        if self.pending[old.slot].pop(index, None) is not None:
+            self.pending_count -= 1
+        device = self.create_device(device_id, device_type)
+        device.paused = old.paused
+        self.insert(device, index)
+        if not device.paused:
+            self.schedule(index, time.monotonic())
+        return {"deviceId": device_id, "type": device_type}
+
+    def command_list(self, command):
+        by_type = {}
+        paused = 0
+        for index in self.index_of.values():
+            device = self.devices[index]
+            by_type[device.type] = by_type.get(device.type, 0) + 1
+            paused += device.paused
+        return {"devices": len(self.index_of), "paused": paused, "byType": by_type}
+
+    def command_profile(self, command):
+        # {"target": "cpu" | "memory" | "stages", "op": "start" | "stop" | "snapshot"}
+        target, op = command["target"], command["op"]
+        operations = {
+            ("cpu", "start"): self.profiler.cpu_start,
+            ("cpu", "stop"): self.profiler.cpu_stop,
+            ("memory", "start"): self.profiler.memory_start,
+            ("memory", "snapshot"): self.profiler.memory_snapshot,
+            ("memory", "stop"): self.profiler.memory_stop,
+            ("stages", "start"): self.start_stage_timing,
+            ("stages", "stop"): self.stop_stage_timing,
+        }
+        if (target, op) not in operations:
+            raise ValueError(f"Unknown profile operation: {target} {op}")
+        try:
+            files = operations[(target, op)]()
+        except OSError as e:
+            # Left as it was, so the op can be retried once the output directory is writable
+            raise ValueError(f"Profile {target} {op} could not write its output: {e}")
+        print(f"[Fleet] Profile {target} {op}" + (f": {', '.join(files)}" if files else ""))
+        return {"target": target, "op": op, "files": files}
+
+    def command_configure(self, command):
+        # One pass over the fleet for a broadcast, one aggregate answer
+        settings = command.get("set", {})
+        check_settings(settings)
+        reset = bool(command.get("reset"))
+        started = time.perf_counter()
+        selected = self.select(command.get("site"), command.get("type"), command.get("deviceId"))
+        # Bands are built and checked per type before any device changes
+        bands = {}
+        deadband = settings.get("deadband")
+        if deadband is not None and deadband.get("enabled", True):
+            for device in selected:
+                if device.type not in bands:
+                    bands[device.type] = self.checked_bands(device, deadband.get("bands", {}))
+        for device in selected:
+            self.configure(device, settings, reset, bands.get(device.type))
+        return {"matched": len(selected), "set": settings, "reset": reset,
+                "elapsedMs": round((time.perf_counter() - started) * 1000, 2)}
+
+    def select(self, site=None, device_type=None, device_id=None):
+        if device_id is not None and not is_pattern(device_id):
+            index = self.index_of.get(str(device_id))
+            candidates = [] if index is None else [(str(device_id), index)]
+        else:
+            candidates = self.index_of.items()
+        selected = []
+        for candidate_id, index in candidates:
+            device = self.devices[index]
+            if not matches(device_type, device.type) or not matches(device_id, candidate_id):
+                continue
+            if site is not None:
+                site_name = self.sites.get(candidate_id, (None,))[0]
+                if site_name is None or not (matches(site, site_name) or matches(site, site_key(site_name))):
+                    continue
+            selected.append(device)
+        return selected
+
+    def checked_bands(self, device, overrides):
+        bands = build_bands(device.type, {device.type: overrides})
+        for path, _, _ in bands:
+            try:
+                value = lookup(device.sensor.data, path)
+            except (KeyError, TypeError):
+                value = None
+            if not isinstance(value, (int, float)):
+                raise ValueError(f"Unknown deadband field for {device.type}: {path[-1]}")
+        return bands
+
+    def configure(self, device, settings, reset, bands=None):
+        if "interval" in settings:
+            interval = settings["interval"]
+            device.interval = device.sensor.update_interval = interval
+            sampler = device.sampler
+            if sampler is not None:
+                # The fastest interval the sampler returns to; next_interval()
+                # overwrites sampler.interval on the next reading
+                sampler.min_interval = sampler.interval = interval
+                sampler.max_interval = max(sampler.max_interval, interval)
+        if "deadband" in settings:
+            deadband = settings["deadband"]
+            if deadband.get("enabled", True):
+                device.deadband = DeadbandFilter(bands, deadband.get("heartbeat", self.heartbeat))
+            else:
+                device.deadband = None
+        if "encoding" in settings:
+            device.compact = settings["encoding"] == "compact"
+            device.meta_sent = False
+        if reset:
+            # START_FROM_ZERO for a running device
+            device.sensor.reset()
+            device.rollups = RollupAggregator(device.device_id, device.type)
+            if device.deadband is not None:
+                device.deadband.last_values = None
+
+    def start_stage_timing(self):
+        timer = self.profiler.stages_start()
+        self.generate = timer.wrap("generate", generate_reading)
+        self.serialize = timer.wrap("serialize", json.dumps)
+        self.send = timer.wrap("publish", send_reading)
+        return []
+
+    def stop_stage_timing(self):
+        self.generate = generate_reading
+        self.serialize = json.dumps
+        self.send = send_reading
+        return self.profiler.stages_stop()
+
+    def device(self, device_id):
+        index = self.index_of.get(str(device_id))
+        if index is None:
+            raise ValueError(f"Unknown device: {device_id}")
+        return self.devices[index]
+
+    def deadband_filter(self, device_type, overrides):
+        if not self.deadband_enabled:
+            return None
+        if device_type not in self.bands:
+            self.bands[device_type] = build_bands(device_type, overrides)
+        return DeadbandFilter(self.bands[device_type], self.heartbeat)
+
+    def tick(self, publisher, index, now, lag=0.0):
+        # Generates and publishes one reading, returns the delay until the next.
+        # lag: how late the scheduler ran it, for the log summaries
+        device = self.devices[index]
+        # Integrate over the real time since the previous reading, which varies
+        # with adaptive sampling and backpressure
+        elapsed = None if device.last_sample is None else now - device.last_sample
+        device.last_sample = now
+        payload = self.generate(device.sensor, elapsed)
+        delay = device.sampler.next_interval(device.sensor.data) if device.sampler else device.interval
+        # Rollups see every sample, published or not
+        for rollup in device.rollups.update(device.sensor.data):
+            publisher.publish(f"{device.topics['rollup']}/{rollup['window']}", json.dumps(rollup), force=True)
+        if device.anomaly is not None:
+            for event in device.anomaly.update(device.sensor.data, now):
+                publisher.publish(device.topics["events"], json.dumps(event), force=True)
+                self.anomaly_events += 1
+            if self.events_only:
+                return delay
+
+        report = device.deadband is None or device.deadband.check(device.sensor.data, now)
+        self.deadband_stats.record(device.type, report)
+        if not report:
+            return delay
+
+        payload = device.sensor.stamp(payload)
+        if device.compact:
+            meta, payload = split_metadata(payload)
+            if not device.meta_sent:
+                # Retained, so subscribers get it once instead of in every reading
+                publisher.publish(device.topics["meta"], json.dumps(meta), retain=True, force=True)
+                device.meta_sent = True
+            message = self.serialize(payload, separators=COMPACT_SEPARATORS)
+        else:
+            message = self.serialize(payload)
+        pending = self.pending[device.slot]
+        if index in pending:
+            # The unsent reading is superseded: accumulators are cumulative, so
+            # the newer one carries everything the older one did
+            del pending[index]
+            self.pending_count -= 1
+            self.coalesced += 1
+        if self.send(publisher, device.topics["data"], message):
+            self.published(device)
+            self.log.reading(device.type, device.device_id, payload, lag)
+        else:
+            device.errors += 1
+            self.log.error(device.type, device.device_id, "publish window full, reading held for the next send")
+            pending[index] = message
+            self.pending_count += 1
+        return delay
+
+    def reroute(self, index, device):
+        # A broker was skipped or came back: the device follows its ring order,
+        # taking its unsent reading and request subscription along
+        slot = self.pool.route(device, index)
+        if slot == device.slot:
+            device.route_epoch = self.pool.epoch
+            return
+        message = self.pending[device.slot].pop(index, None)
+        self.pool.move(device, slot)
+        if message is not None:
+            self.pending[slot][index] = message
+        self.failovers += 1
+
+    def flush_pending(self):
+        for slot, pending in enumerate(self.pending):
+            publisher = self.pool.publishers[slot]
+            if publisher is None:
+                continue
+            while pending and publisher.can_publish():
+                index = next(iter(pending))
+                device = self.devices[index]
+                self.pending_count -= 1
+                # A reading the client refuses despite room in the window is
+                # dropped rather than retried; the device's next one supersedes it
+                if not self.send(publisher, device.topics["data"], pending.pop(index)):
+                    break
+                self.published(device)
+
+    def flush_rollups(self):
+        # On shutdown: the open buckets go out as partial rollups, and the
+        # connections get up to the ack timeout to deliver them
+        flushed = 0
+        for device in self.devices:
+            if device is None:
+                continue
+            publisher = self.pool.publishers[device.slot]
+            for rollup in device.rollups.flush():
+                if publisher is not None and publisher.client.is_connected():
+                    publisher.publish(f"{device.topics['rollup']}/{rollup['window']}", json.dumps(rollup), force=True)
+                    flushed += 1
+        deadline = time.monotonic() + ACK_TIMEOUT  # for all of them, not per connection
+        for publisher in self.pool.publishers:
+            if publisher is not None:
+                publisher.drain(max(0.0, deadline - time.monotonic()))
+        print(f"[Fleet] Flushed {flushed} partial rollups")
+
+    def published(self, device):
+        self.messages += 1
+        device.messages += 1
+        device.last_publish = time.time()
+        if not device.published:
+            device.published = True
+            self.published_once += 1
+
+    def stats(self):
+        publishers = [p.stats() for p in self.pool.publishers if p is not None]
+        return {
+            "queueDepth": sum(p["queueDepth"] for p in publishers),
+            "pending": self.pending_count,
+            "coalesced": self.coalesced,
+            "deferred": self.deferred,
+            "published": sum(p["published"] for p in publishers),
+            "acked": sum(p["acked"] for p in publishers),
+            "ackLatencyP99Ms": max((p["ackLatencyMs"]["p99"] or 0 for p in publishers), default=None),
+            "connections": publishers,
+            "deadband": self.deadband_stats.summary(),
+            "sampling": self.sampling_summary(),
+            "tls": self.tls_context.stats.summary() if self.tls_context else None,
+            "reconnect": self.reconnect.stats(),
+            "failovers": self.failovers,
+            "anomalyEvents": self.anomaly_events,
+            "brokers": self.pool.broker_stats(),
+        }
+
+    def sampling_summary(self):
+        # Mean current sampling interval per device type
+        if not self.sampling_enabled:
+            return {}
+        totals = {}
+        for device in self.devices:
+            if device is None:
+                continue
+            interval, count = totals.get(device.type, (0.0, 0))
+            totals[device.type] = (interval + device.sampler.interval, count + 1)
+        return {device_type: round(interval / count, 1) for device_type, (interval, count) in totals.items()}
+
+    def log_stats(self):
+        stats = self.stats()
+        print(f"[Fleet] queue depth {stats['queueDepth']} | pending {stats['pending']} | "
+              f"coalesced {stats['coalesced']} | deferred {stats['deferred']} | "
+              f"acked {stats['acked']}/{stats['published']} | ack p99 {stats['ackLatencyP99Ms']} ms")
+        if self.deadband_enabled:
+            for device_type, counts in sorted(stats["deadband"].items()):
+                print(f"[Fleet] {device_type}: {counts['published']}/{counts['sampled']} readings published, "
+                      f"{counts['reduction']:.1%} fewer messages")
+        if self.anomaly_enabled:
+            print(f"[Fleet] {stats['anomalyEvents']} anomaly events")
+        for device_type, interval in sorted(stats["sampling"].items()):
+            print(f"[Fleet] {device_type}: sampling every {interval} s on average")
+        if len(stats["brokers"]) > 1:
+            now = time.monotonic()
+            elapsed = max(now - self.broker_stats_at, 1e-3)
+            self.broker_stats_at = now
+            for i, broker in enumerate(stats["brokers"]):
+                rate = (broker["published"] - self.broker_published[i]) / elapsed
+                self.broker_published[i] = broker["published"]
+                state = "up" if broker["connected"] else ("down" if not broker["available"] else "idle")
+                print(f"[Fleet] broker {broker['broker']} {state} | {broker['devices']} devices | "
+                      f"{rate:.1f} msg/s | acked {broker['acked']}/{broker['published']} | "
+                      f"{broker['failures']} failures")
+            print(f"[Fleet] {stats['failovers']} device moves between brokers")
+        if stats["reconnect"]["attempts"]:
+            reconnect = stats["reconnect"]
+            print(f"[Fleet] reconnect attempts {reconnect['attempts']} | "
+                  f"topics resubscribed {reconnect['resubscribed']} | jobs scheduled {reconnect['scheduled']}")
+        if stats["tls"]:
+            tls = stats["tls"]
+            print(f"[Fleet] TLS handshakes {tls['handshakes']} ({tls['resumed']} resumed) | "
+                  f"mean {tls['meanMs']} ms | total {tls['totalS']} s")
+
+    def run(self, started, duration=None):
+        # First publishes are spread evenly over one interval, then every device
+        # keeps its own fixed cadence
+        now = time.monotonic()
+        count = len(self.devices)
+        self.heap = [(now + self.interval * i / count, i, 0) for i in range(count)]
+        heapq.heapify(self.heap)
+        heap = self.heap
+        if self.control_config.get("httpPort"):
+            start_http_control(self.control, self.control_config.get("httpHost", "127.0.0.1"),
+                               self.control_config["httpPort"], self.control_token)
+        if self.pool.control_topic or self.pool.config_topic:
+            # The control topics ride on connection 0, so open it up front
+            self.pool.publisher_for(0)
+        deadline = now + duration if duration else None
+        last_save = now
+        last_stats = now
+        first_publish = None
+        all_published = None
+
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline and now >= deadline:
+                    break
+                if self.control.pending():
+                    self.apply_commands()
+                if not heap:
+                    self.apply_commands(self.control.wait(1.0))
+                    continue
+                due, index, generation = heap[0]
+                if due > now:
+                    self.apply_commands(self.control.wait(min(due - now, 1.0)))
+                    continue
+
+                device = self.devices[index]
+                if device is None or device.generation != generation or device.paused:
+                    # Removed, paused or retyped since this entry was scheduled
+                    heapq.heappop(heap)
+                    continue
+
+                if device.route_epoch != self.pool.epoch:
+                    self.reroute(index, device)
+                if self.pending_count:
+                    self.flush_pending()
+
+                publisher = self.pool.publisher_for(device.slot)
+                if publisher is None:
+                    heapq.heapreplace(heap, (now + RETRY_DELAY, index, generation))
+                    continue
+                if self.backpressure == BACKPRESSURE_SLOW and not publisher.can_publish():
+                    self.deferred += 1
+                    heapq.heapreplace(heap, (now + RETRY_DELAY, index, generation))
+                    continue
+                delay = self.tick(publisher, index, now, now - due)
+                heapq.heapreplace(heap, (due + delay, index, generation))
+                if self.status is not None:
+                    self.status.update(index, device, now - due)
+
+                if first_publish is None:
+                    first_publish = time.perf_counter() - started
+                    print(f"[Fleet] First publish after {first_publish:.3f} s")
+                if all_published is None and self.published_once >= count:
+                    all_published = time.perf_counter() - started
+                    print(f"[Fleet] All {count} devices published after {all_published:.3f} s "
+                          f"({self.pool.connects} connections)")
+
+                if now - last_stats > STATS_INTERVAL:
+                    self.log_stats()
+                    last_stats = now
+                if self.snapshot_file and now - last_save > SAVE_INTERVAL:
+                    save_snapshot(self.devices, self.snapshot_file)
+                    last_save = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.snapshot_file:
+                save_snapshot(self.devices, self.snapshot_file)
+            self.flush_rollups()
+            self.pool.close()
+            if self.status is not None:
+                self.status.close()
+            self.log.close()
+            self.log_stats()
+            print(f"[Fleet] Stopped after {self.messages} readings.")
+
+
+def run_fleet(manifest_file, generate=(), dry_run=False, duration=None, workers=LOAD_WORKERS, trace=()):
+    started = time.perf_counter()
+    manifest, specs = load_manifest(manifest_file)
+    if trace:
+        log_config = manifest.setdefault("logging", {})
+        log_config["trace"] = list(log_config.get("trace", [])) + list(trace)
+    for device_type, count in generate:
+        specs.extend(generate_specs(device_type, count, prefix=f"{device_type}-"))
+    if manifest.get("snapshot"):
+        manifest["snapshot"] = Path(manifest_file).parent / manifest["snapshot"]
+
+    states = load_states(specs, manifest.get("snapshot"), workers)
+    loaded = time.perf_counter() - started
+    fleet = Fleet(manifest, specs, states, dry_run)
+    built = time.perf_counter() - started
+    print(f"[Fleet] {len(specs)} devices: states loaded in {loaded:.3f} s "
+          f"({len(states)} saved), sensors ready in {built:.3f} s")
+    fleet.run(started, duration)
+
+
+def parse_generate(value):
+    device_type, _, count = value.partition(":")
+    return device_type, int(count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fleet of simulated devices from a manifest")
+    parser.add_argument("--manifest", default=str(MANIFEST_FILE))
+    parser.add_argument("--generate", action="append", type=parse_generate, default=[],
+                        metavar="TYPE:COUNT", help="add COUNT generated devices of TYPE")
+    parser.add_argument("--dry-run", action="store_true", help="do not connect to a broker")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument("--trace", action="append", default=[], metavar="DEVICE_ID",
+                        help="log every reading and request of this device in full")
+    args = parser.parse_args()
+
+    print("Starting device fleet...")
+    run_fleet(args.manifest, args.generate, args.dry_run, args.duration, args.workers, args.trace)
@@ -0,0 +1,227 @@
+import json
+import time
+import argparse
+from pathlib import Path
+import paho.mqtt.client as mqtt
+
+from logpipe import ReadingLog
+from mqtt5 import split_metadata
+from publisher import Publisher
+from rollups import RollupAggregator
+from sensors import create_sensor, UPDATE_INTERVAL
+from topology import load_topology, site_key, TOPOLOGY_FILE
+
+# Site gateway: owns the meters of one site, reads them locally on a shared
+# clock and publishes one consolidated frame per interval over a single
+# connection, instead of one connection and one message per device.
+DEVICES_DIR = Path(__file__).parent.resolve()
+MQTT_BROKER = "broker.hivemq.com"
+MQTT_PORT = 1883
+FRAME_TOPIC = "site/{site}/frame"     # on shutdown, a last {"final": true, "rollups": [...]} frame
+META_TOPIC = "site/{site}/meta"        # retained static metadata of every device
+REQUEST_TOPIC = "site/{site}/request"
+RESPONSE_TOPIC = "site/{site}/respond"
+SAVE_INTERVAL = 300                    # seconds between state saves
+FRAME_SEPARATORS = (",", ":")
+PRODUCTION_TYPES = ("solar",)          # the rest are consumption meters
+LOG_EVERY = 1                          # log 1 frame in LOG_EVERY; all of them show in the periodic summary
+
+
+def state_file(device_type, device_id):
+    # Same state file as the device's standalone script, so either can take over
+    return DEVICES_DIR / f"devices {device_type}" / f"{device_id}.json"
+
+
+def aligned(timestamp, interval):
+    return timestamp - timestamp % interval
+
+
+class SiteGateway:
+    def __init__(self, site, interval=UPDATE_INTERVAL, persist=True, start_from_zero=False):
+        self.site = site["name"]
+        self.key = site_key(self.site)
+        self.interval = interval
+        self.now = 0.0  # time of the frame being read; every sensor's clock
+        self.devices = []
+        for device in site.get("devices", []):
+            device_id, device_type = str(device["deviceId"]), device["type"]
+            data_file = state_file(device_type, device_id) if persist else None
+            sensor = create_sensor(device_type, device_id, data_file=data_file, update_interval=interval,
+                                   start_from_zero=start_from_zero, state=None if persist else {})
+            sensor.clock = self.clock
+            self.devices.append((sensor, RollupAggregator(device_id, device_type)))
+        self.meta = {}      # deviceId -> static metadata, from the first frame
+        self.payloads = []  # the readings of the last frame as the devices would publish them
+        self.totals = {}    # (kind, type) -> meter total at the previous frame
+        self.last_frame = None
+        self.frames = 0
+        self.log = None  # ReadingLog while running
+
+    def clock(self):
+        return self.now
+
+    def frame(self, timestamp):
+        # Reads every device at `timestamp` (epoch seconds) -> the site frame
+        elapsed = None if self.last_frame is None else timestamp - self.last_frame
+        self.last_frame = self.now = timestamp
+        devices = {}
+        totals = {}
+        rollups = []
+        self.payloads = []
+        for sensor, aggregator in self.devices:
+            payload = sensor.stamp(sensor.generate_data(elapsed))
+            self.payloads.append(payload)
+            meta, reading = split_metadata(payload)
+            del reading["timestamp"]  # the frame's, for every device
+            if sensor.device_id not in self.meta:
+                self.meta[sensor.device_id] = meta
+            devices[sensor.device_id] = {"type": sensor.device_type, **reading}
+            kind = "production" if sensor.device_type in PRODUCTION_TYPES else "consumption"
+            totals[(kind, sensor.device_type)] = totals.get((kind, sensor.device_type), 0.0) + sensor.total
+            rollups.extend(aggregator.update(sensor.data))
+
+        # Per kind and type, since units differ (kWh, m³): the summed meter
+        # totals and what they grew by since the previous frame
+        summary = {"consumption": {}, "production": {}}
+        for (kind, device_type), total in totals.items():
+            previous = self.totals.get((kind, device_type))
+            summary[kind][device_type] = {
+                "total": round(total, 6),
+                "delta": round(total - previous, 6) if previous is not None else None,
+            }
+        self.totals = totals
+        self.frames += 1
+        frame = {
+            "site": self.site,
+            "timestamp": int(timestamp * 1000),
+            "interval": self.interval,
+            "totals": summary,
+            "devices": devices,
+        }
+        if rollups:
+            frame["rollups"] = rollups
+        return frame
+
+    def flush(self):
+        # Open rollup buckets of every device, closed as partial, e.g. on shutdown
+        return [bucket for _, aggregator in self.devices for bucket in aggregator.flush()]
+
+    def save(self):
+        for sensor, _ in self.devices:
+            if sensor.data_file is not None:
+                sensor.save_data()
+
+
+def measure(site, frames, interval):
+    # Messages, bytes and connections per interval: every device publishing
+    # its own reading vs one gateway frame
+    gateway = SiteGateway(site, interval, persist=False)
+    start = aligned(time.time(), interval)
+    device_bytes = 0
+    frame_bytes = 0
+    started = time.perf_counter()
+    for i in range(frames):
+        frame = json.dumps(gateway.frame(start + i * interval), separators=FRAME_SEPARATORS)
+        frame_bytes += len(frame)
+        device_bytes += sum(len(json.dumps(payload)) for payload in gateway.payloads)
+    elapsed = time.perf_counter() - started
+    devices = len(gateway.devices)
+    return {
+        "site": gateway.site,
+        "devices": devices,
+        "connections": {"perDevice": devices, "gateway": 1},
+        "messagesPerInterval": {"perDevice": devices, "gateway": 1},
+        "bytesPerInterval": {"perDevice": round(device_bytes / frames), "gateway": round(frame_bytes / frames)},
+        "metaBytes": len(json.dumps(gateway.meta, separators=FRAME_SEPARATORS)),
+        "frameBuildMs": round(elapsed / frames * 1000, 3),
+    }
+
+
+def on_connect(client, userdata, flags, rc):
+    userdata.log.info(f"[Gateway] Connected to broker with result code {rc}")
+    client.subscribe(REQUEST_TOPIC.format(site=userdata.key))
+
+
+def on_message(client, userdata, msg):
+    userdata.log.received("site", userdata.key, msg.topic, msg.payload)
+    client.publish(RESPONSE_TOPIC.format(site=userdata.key), "ok")
+
+
+def run_gateway(site, host, port, interval, start_from_zero=False, trace=False):
+    gateway = SiteGateway(site, interval, start_from_zero=start_from_zero)
+    print(f"[Gateway] {gateway.site}: {len(gateway.devices)} devices, one frame every {interval} s")
+    log = gateway.log = ReadingLog(default_every=LOG_EVERY, trace=[gateway.key] if trace else ()).start()
+
+    client = mqtt.Client(f"gateway-{gateway.key}", userdata=gateway)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(host, port, 60)
+    client.loop_start()
+    publisher = Publisher(client)
+    frame_topic = FRAME_TOPIC.format(site=gateway.key)
+    last_save_time = time.time()
+    next_frame = aligned(time.time(), interval) + interval
+
+    try:
+        while True:
+            time.sleep(max(0.0, next_frame - time.time()))
+            frame = gateway.frame(next_frame)
+            if gateway.frames == 1:
+                # Retained, so subscribers get it once instead of in every frame
+                publisher.publish(META_TOPIC.format(site=gateway.key),
+                                  json.dumps(gateway.meta, separators=FRAME_SEPARATORS), retain=True, force=True)
+            if not publisher.publish(frame_topic, json.dumps(frame, separators=FRAME_SEPARATORS)):
+                log.error("site", gateway.key, f"Publish window full ({publisher.window} awaiting ack), frame dropped")
+            log.reading("site", gateway.key, frame, max(0.0, time.time() - next_frame))
+
+            if time.time() - last_save_time > SAVE_INTERVAL:
+                gateway.save()
+                last_save_time = time.time()
+
+            # Stay on the interval grid; boundaries missed while busy are skipped
+            next_frame += interval
+            if next_frame <= time.time():
+                next_frame = aligned(time.time(), interval) + interval
+
+    except KeyboardInterrupt:
+        gateway.save()
+        # A last frame carrying only the partial rollups, before the loop stops
+        rollups = gateway.flush()
+        if rollups:
+            final = {"site": gateway.site, "timestamp": int(time.time() * 1000), "interval": interval,
+                     "final": True, "rollups": rollups}
+            publisher.publish(frame_topic, json.dumps(final, separators=FRAME_SEPARATORS), force=True)
+        publisher.drain()
+        client.loop_stop()
+        log.close()
+        print(f"[Gateway] Stopped after {gateway.frames} frames.")
+
+
+def find_site(sites, name):
+    if name is None:
+        return sites[0]
+    for site in sites:
+        if name in (site["name"], site_key(site["name"])):
+            return site
+    raise SystemExit(f"Unknown site: {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish consolidated site frames for a site's devices")
+    parser.add_argument("--topology", default=str(TOPOLOGY_FILE))
+    parser.add_argument("--site", help="site name (default: the first site)")
+    parser.add_argument("--host", default=MQTT_BROKER)
+    parser.add_argument("--port", type=int, default=MQTT_PORT)
+    parser.add_argument("--interval", type=float, default=UPDATE_INTERVAL)
+    parser.add_argument("--start-from-zero", action="store_true", help="reset the meter totals")
+    parser.add_argument("--measure", type=int, metavar="FRAMES",
+                        help="compare per-device publishing with frames offline and exit")
+    parser.add_argument("--trace", action="store_true", help="log every frame and request in full")
+    args = parser.parse_args()
+
+    site = find_site(load_topology(args.topology), args.site)
+    if args.measure:
+        print(f"[Gateway] {json.dumps(measure(site, args.measure, args.interval))}")
+    else:
+        print("Starting site gateway...")
+        run_gateway(site, args.host, args.port, args.interval, args.start_from_zero, args.trace)
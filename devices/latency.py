@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+from datetime import datetime, timezone
+
+from mock_mongo import MongoClient, ObjectId
+from mqtt5 import WireClient
+from mqtt_packets import MQTT_V311, encode_publish
+from sensors import create_sensor, device_topics, TOPIC_SCHEMES
+from storm import free_port
+
+# End-to-end latency of a reading through the data manager: publish -> stored
+# (its document is committed) -> queryable (POST /api/site/:siteId/:type/index
+# reflects it). Runs locally: the broker and database stand-ins each in their
+# own process, the real backend_data_manger (node servermqtt.js) against them,
+# and the harness publishing traced readings at each load level while polling
+# the backend's HTTP endpoint.
+
+DEVICES_DIR = Path(__file__).parent.resolve()
+REPORT_DIR = DEVICES_DIR / "reports"
+BROKER_SCRIPT = DEVICES_DIR / "mock_broker.py"
+MONGO_SCRIPT = DEVICES_DIR / "mock_mongo.py"
+BACKEND_DIR = DEVICES_DIR.parent / "backend_data_manger"
+MAIN_DB = "iot_dashboard"
+SITES = 4
+PROBE_ID = "latency-probe"  # alone in its site, so the site index is its last value
+POLL_INTERVAL = 0.005   # seconds between index polls
+STARTUP_TIMEOUT = 60.0  # seconds for the backend to load its device map
+QUERYABLE_TIMEOUT = 10.0  # seconds a probe reading may take to show in the index
+DRAIN_TIMEOUT = 30.0    # seconds a level may take to be fully stored after publishing stops
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# routes/mqttClient.js subscribes device/<id>/data for every active device
+# and looks the device up by data.deviceId, which energy, gas and solar
+# readings do not carry (they send sensorId).
+DEVICE_ID_FIELD = "deviceId"
+
+
+def site_name(index):
+    # The backend writes readings to the lowercased site name but the index
+    # endpoint reads the name as is: on MongoDB they only meet for names
+    # that are already lowercase
+    return f"latency_site_{index}"
+
+
+def seed(mongo_port, specs):
+    # Sites and active devices, as the main manager would have created them
+    client = MongoClient(mongo_port)
+    now = datetime.now(timezone.utc)
+    sites = {}
+    for spec in specs:
+        if spec["site"] not in sites:
+            sites[spec["site"]] = {"_id": ObjectId(), "name": spec["site"], "type": "building",
+                                   "status": "active", "devices": [], "createdAt": now, "updatedAt": now}
+    devices = [{"_id": ObjectId(), "deviceId": spec["deviceId"], "name": spec["deviceId"], "type": spec["type"],
+                "siteId": sites[spec["site"]]["_id"], "status": "active", "createdAt": now, "updatedAt": now}
+               for spec in specs]
+    client.insert(MAIN_DB, "sites", list(sites.values()))
+    client.insert(MAIN_DB, "devices", devices)
+    client.close()
+    return {name: str(site["_id"]) for name, site in sites.items()}
+
+
+def backend_revision(backend_dir):
+    # Last commit touching the backend, marked when its tree has local changes
+    def git(*args):
+        return subprocess.run(["git", "-C", str(backend_dir), *args, "--", "."],
+                              capture_output=True, text=True).stdout.strip()
+
+    revision = git("log", "-1", "--format=%h") or "unknown"
+    return f"{revision}-dirty" if git("status", "--porcelain") else revision
+
+
+def start_backend(backend_dir, mongo_port, broker_port, api_port, log_file, devices):
+    # Process environment wins over the backend's .env (dotenv does not
+    # override), so nothing reaches the deployed broker or databases
+    env = dict(os.environ, MONGO_URI=f"mongodb://127.0.0.1:{mongo_port}",
+               MONGO_URI_site1=f"mongodb://127.0.0.1:{mongo_port}",
+               MQTT_BROKER_URL=f"mqtt://127.0.0.1:{broker_port}", PORT_SERVER=str(api_port),
+               MAIN_MANAGER_URL="http://127.0.0.1:9")
+    backend = subprocess.Popen(["node", "servermqtt.js"], cwd=backend_dir, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if backend.poll() is not None:
+            raise RuntimeError(f"backend exited with {backend.returncode}, see {log_file.name}")
+        try:
+            api = http.client.HTTPConnection("127.0.0.1", api_port, timeout=1.0)
+            api.request("GET", "/api/mqtt/status")
+            status = json.loads(api.getresponse().read())
+            api.close()
+            if status.get("connected") and status.get("deviceCount") == devices:
+                time.sleep(0.5)  # its subscriptions
+                return backend
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+    backend.terminate()
+    raise RuntimeError(f"backend not ready after {STARTUP_TIMEOUT}s, see {log_file.name}")
+
+
+class Journal:
+    # Store times of traced readings, as written by the database stand-in
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.stored = {}  # traceId -> (publishedAt, storedAt)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                entry = json.loads(line)
+                self.stored[entry["traceId"]] = (entry["publishedAt"], entry["storedAt"])
+        return self.stored
+
+    def level(self, rate):
+        prefix = f"{rate}-"
+        return [stored - published for trace, (published, stored) in self.read().items()
+                if trace.startswith(prefix)]
+
+
+def consumed(device_type):
+    # Only the device/<id>/data scheme reaches the data manager
+    return TOPIC_SCHEMES[device_type][0] == "device"
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {f"p{round(p * 100)}": round(values[min(len(values) - 1, int(p * len(values)))], 2)
+              for p in PERCENTILES}
+    result["max"] = round(values[-1], 2)
+    return result
+
+
+class Poller:
+    # Publishes probe readings one at a time and polls the probe site's
+    # index until it shows each one; every round also times the index of
+    # one loaded site, until stopped
+    def __init__(self, broker_port, api_port, probe_site, index_keys, sequence):
+        self.client = WireClient(broker_port, "latency-probe", MQTT_V311)
+        self.api = http.client.HTTPConnection("127.0.0.1", api_port)
+        self.probe_site = probe_site
+        self.index_keys = index_keys  # [(siteId, type)], queried in turn
+        self.sequence = sequence      # probe values, unique across levels
+        self.queryable = []   # publish -> queryable, ms
+        self.index_ms = []
+        self.timeouts = 0
+        self.running = True
+
+    def index(self, site, device_type):
+        self.api.request("POST", f"/api/site/{site}/{device_type}/index", body=b"")
+        return json.loads(self.api.getresponse().read()).get("totalIndex")
+
+    def probe(self, round_number):
+        value = next(self.sequence)
+        published_at = time.time() * 1000
+        reading = {DEVICE_ID_FIELD: PROBE_ID, "type": "water", "value": value, "unit": "m³",
+                   "timestamp": int(published_at), "traceId": f"probe-{value}", "publishedAt": published_at}
+        self.client.send(encode_publish(device_topics(PROBE_ID, "water")["data"], json.dumps(reading).encode()))
+        deadline = time.monotonic() + QUERYABLE_TIMEOUT
+        while self.running and time.monotonic() < deadline:
+            shown = self.index(self.probe_site, "water") == value
+            if shown:
+                self.queryable.append(time.time() * 1000 - published_at)
+            site, device_type = self.index_keys[round_number % len(self.index_keys)]
+            started = time.perf_counter()
+            self.index(site, device_type)
+            self.index_ms.append((time.perf_counter() - started) * 1000)
+            round_number += 1
+            if shown:
+                return round_number
+            time.sleep(POLL_INTERVAL)
+        self.timeouts += 1
+        return round_number
+
+    def run(self):
+        round_number = 0
+        while self.running:
+            round_number = self.probe(round_number)
+
+    def close(self):
+        self.client.close()
+        self.api.close()
+
+
+def run_level(broker_port, api_port, journal, sites, sensors, specs, rate, duration, sequence):
+    client = WireClient(broker_port, f"latency-{rate}", MQTT_V311)
+    poller = Poller(broker_port, api_port, sites[site_name("probe")],
+                    sorted({(sites[spec["site"]], spec["type"]) for spec in specs}), sequence)
+    poll_thread = threading.Thread(target=poller.run, daemon=True)
+    poll_thread.start()
+
+    period = len(sensors) / rate  # seconds between two readings of one device
+    started = time.monotonic()
+    published = storable = 0
+    while time.monotonic() - started < duration:
+        due = started + published / rate
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sensor = sensors[published % len(sensors)]
+        payload = sensor.generate_data(period)
+        message = dict(payload, traceId=f"{rate}-{published}", publishedAt=time.time() * 1000)
+        client.send(encode_publish(device_topics(sensor.device_id, sensor.device_type)["data"],
+                                   json.dumps(message).encode()))
+        if consumed(sensor.device_type) and DEVICE_ID_FIELD in payload:
+            storable += 1
+        published += 1
+    elapsed = time.monotonic() - started
+    client.sync()
+
+    # Let the backend catch up before reading the stored latencies
+    drain_until = time.monotonic() + DRAIN_TIMEOUT
+    while len(journal.level(rate)) < storable and time.monotonic() < drain_until:
+        time.sleep(0.1)
+    poller.running = False
+    poll_thread.join()
+    poller.close()
+    client.close()
+
+    stored = journal.level(rate)
+    return {
+        "rate": rate,
+        "achievedRate": round(published / elapsed, 1),
+        "published": published,
+        "stored": len(stored),
+        "notStorable": published - storable,  # topics the backend does not subscribe, or no deviceId
+        "publishToStoredMs": percentiles(stored),
+        "publishToQueryableMs": percentiles(poller.queryable),
+        "queryableSamples": len(poller.queryable),
+        "queryableTimeouts": poller.timeouts,
+        "indexQueryMs": percentiles(poller.index_ms),
+        "storedTotal": len(journal.read()),
+    }
+
+
+def harness(backend_dir, devices, types, rates, duration, label):
+    workdir = Path(tempfile.mkdtemp(prefix="latency-"))
+    specs = []
+    for i in range(devices):
+        device_type = types[i % len(types)]
+        specs.append({"deviceId": f"{device_type}-{i}", "type": device_type, "site": site_name(i % SITES)})
+    probe = {"deviceId": PROBE_ID, "type": "water", "site": site_name("probe")}
+
+    sensors = [create_sensor(spec["type"], spec["deviceId"], state={}) for spec in specs]
+    sequence = iter(range(1, sys.maxsize))
+    journal = Journal(workdir / "stored.jsonl")
+    journal.path.touch()
+    backend_log = open(workdir / "backend.log", 'w')
+    processes = []
+    levels = []
+    try:
+        broker_port = free_port()
+        processes.append(subprocess.Popen([sys.executable, str(BROKER_SCRIPT), "--port", str(broker_port)],
+                                          stdout=subprocess.PIPE, text=True))
+        processes[-1].stdout.readline()  # listening
+        mongo_port = free_port()
+        processes.append(subprocess.Popen([sys.executable, str(MONGO_SCRIPT), "--port", str(mongo_port),
+                                           "--journal", str(journal.path)], stdout=subprocess.PIPE, text=True))
+        processes[-1].stdout.readline()  # listening
+        sites = seed(mongo_port, specs + [probe])
+        api_port = free_port()
+        processes.append(start_backend(backend_dir, mongo_port, broker_port, api_port, backend_log, devices + 1))
+        for rate in rates:
+            result = run_level(broker_port, api_port, journal, sites, sensors, specs, rate, duration, sequence)
+            levels.append(result)
+            print_level(result)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        backend_log.close()
+
+    with open(workdir / "backend.log", 'r') as f:
+        unknown = sum(1 for line in f if "Unknown deviceId" in line)
+    return {
+        "label": label or backend_revision(backend_dir),
+        "backendRevision": backend_revision(backend_dir),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "devices": devices,
+        "types": types,
+        "durationPerLevel": duration,
+        "unknownDevice": unknown,  # readings the backend dropped for lack of a known deviceId
+        "backendLog": str(workdir / "backend.log"),
+        "levels": levels,
+    }
+
+
+def print_level(result):
+    def p(key, name):
+        values = result[key]
+        return f"{name} p50 {values['p50']} / p99 {values['p99']} ms" if values else f"{name} -"
+
+    print(f"[Latency] {result['rate']:>7}/s (achieved {result['achievedRate']}) | "
+          f"stored {result['stored']}/{result['published']} | {p('publishToStoredMs', 'stored')} | "
+          f"{p('publishToQueryableMs', 'queryable')} | {p('indexQueryMs', 'index query')}")
+
+
+def compare(report, baseline):
+    # p99 changes per load level against an earlier report
+    before = {level["rate"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        old = before.get(level["rate"])
+        if old is None:
+            continue
+        changes = []
+        for key in ("publishToStoredMs", "publishToQueryableMs", "indexQueryMs"):
+            if level[key] and old[key]:
+                changes.append(f"{key} p99 {old[key]['p99']} -> {level[key]['p99']}")
+        print(f"[Latency] {level['rate']:>7}/s vs {baseline['label']}: {' | '.join(changes)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish -> stored -> queryable latency through a local data manager")
+    parser.add_argument("--backend", default=str(BACKEND_DIR), help="backend_data_manger checkout to run")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--types", default="water",
+                        help="comma-separated device types (the data manager only consumes device/<id>/data)")
+    parser.add_argument("--rates", default="10,100,1000", help="comma-separated readings per second, one level each")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per load level")
+    parser.add_argument("--label", help="backend release the report is for (default: its git revision)")
+    parser.add_argument("--compare", help="earlier report to compare with")
+    args = parser.parse_args()
+
+    report = harness(Path(args.backend), args.devices, args.types.split(","),
+                     [float(rate) for rate in args.rates.split(",")], args.duration, args.label)
+    REPORT_DIR.mkdir(exist_ok=True)
+    report_file = REPORT_DIR / f"latency-{report['label']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Latency] Report written to {report_file}")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report, json.load(f))
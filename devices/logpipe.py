@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+
+# Logging off the publish path. The publishing thread only counts readings
+# per device type; the few lines that survive per-type sampling and the
+# per-type rate limit are appended to a deque as tuples of raw values. A
+# background thread formats and writes them, and every summary interval
+# writes one line per type (rates, errors, lag) in place of per-message
+# lines. Devices listed for tracing get every payload in full.
+SUMMARY_INTERVAL = 30.0  # seconds between summary lines, 0 for none
+RATE_LIMIT = 10.0        # sampled lines per second per type, bursts up to as many
+QUEUE_LIMIT = 10000      # lines waiting for the writer; more are dropped, never waited for
+FLUSH_INTERVAL = 0.1     # seconds the writer sleeps on an empty queue
+WRITE_BATCH = 1000       # lines per write
+
+def frame_line(devices, totals):
+    # gateway.py site frame: device count and the per-type meter totals
+    return f"{len(devices)} devices | " + " | ".join(
+        f"{device_type} {values['total']:.2f}"
+        for kind in ("consumption", "production") for device_type, values in sorted(totals[kind].items()))
+
+
+# Sampled reading line per type: (tag, template or function of the fields, payload fields)
+READING_LINES = {
+    "energy": ("Energy", "{:.2f} kWh | {:.1f} W | {:.1f} A",
+               ("consumption", "totalActivePower", "totalCurrent")),
+    "gas": ("Gas", "{:.4f} m³ | {:.2f} m³/h | {:.2f} bar | {:.1f} °C",
+            ("consumption", "flowRate", "pressure", "temperature")),
+    "solar": ("Solar", "{} W | {} W/m² | {} °C | Total: {:.2f} kWh",
+              ("powerOutput", "irradiance", "panelTemperature", "production")),
+    "water": ("Water", "{:.6f} m³ | {:.2f} L/min | {:.2f} bar | {:.1f} °C",
+              ("value", "flowRate", "pressure", "temperature")),
+    "site": ("Gateway", frame_line, ("devices", "totals")),
+}
+
+# Queued line kinds
+READING, RECEIVED, ERROR, TRACE, INFO = range(5)
+
+
+class TypeCounts:
+    # Written by one thread each: readings/errors/lag by the publishing
+    # thread, received by the network thread. The writer only reads them,
+    # except lag_max, which it resets per summary (a reading racing the reset
+    # can go unseen in that summary's max).
+    __slots__ = ("tag", "template", "fields", "every", "readings", "errors", "received", "lag_total", "lag_max",
+                 "suppressed", "tokens", "refilled")
+
+    def __init__(self, device_type, every, rate):
+        self.tag, self.template, self.fields = READING_LINES.get(device_type, (device_type.capitalize(), "", ()))
+        self.every = every  # 1 line per `every` readings, 0 for none
+        self.readings = 0
+        self.errors = 0
+        self.received = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.suppressed = 0
+        self.tokens = rate
+        self.refilled = time.monotonic()
+
+
+class ReadingLog:
+    def __init__(self, stream=None, sample_every=None, default_every=0, rate=RATE_LIMIT,
+                 summary_interval=SUMMARY_INTERVAL, trace=(), limit=QUEUE_LIMIT):
+        self.stream = stream or sys.stdout
+        self.sample_every = sample_every or {}
+        self.default_every = default_every
+        self.rate = rate
+        self.summary_interval = summary_interval
+        self.traced = set(str(device_id) for device_id in trace)
+        self.limit = limit
+        self.counts = {}  # device type -> TypeCounts
+        self.queue = deque()
+        self.dropped = 0
+        self.written = 0
+        self.previous_dropped = 0
+        self.previous = {}  # device type -> counters at the previous summary
+        self.stopping = False
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def type_counts(self, device_type):
+        counts = self.counts.get(device_type)
+        if counts is None:
+            every = self.sample_every.get(device_type, self.default_every)
+            counts = self.counts[device_type] = TypeCounts(device_type, every, self.rate)
+        return counts
+
+    def put(self, item):
+        if len(self.queue) >= self.limit:
+            self.dropped += 1
+        else:
+            self.queue.append(item)
+
+    def allow(self, counts):
+        # Token bucket per type: RATE_LIMIT lines per second, bursts up to as many
+        now = time.monotonic()
+        counts.tokens = min(self.rate, counts.tokens + (now - counts.refilled) * self.rate)
+        counts.refilled = now
+        if counts.tokens < 1.0:
+            counts.suppressed += 1
+            return False
+        counts.tokens -= 1.0
+        return True
+
+    # Publishing thread
+
+    def reading(self, device_type, device_id, payload, lag=0.0):
+        counts = self.counts.get(device_type) or self.type_counts(device_type)
+        counts.readings += 1
+        counts.lag_total += lag
+        if lag > counts.lag_max:
+            counts.lag_max = lag
+        if self.traced and device_id in self.traced:
+            self.put((TRACE, counts, device_id, f"published {json.dumps(payload)}"))
+        elif counts.every and counts.readings % counts.every == 0 and self.allow(counts):
+            self.put((READING, counts, device_id, tuple(payload.get(field) for field in counts.fields)))
+
+    def error(self, device_type, device_id, text):
+        counts = self.counts.get(device_type) or self.type_counts(device_type)
+        counts.errors += 1
+        if (self.traced and device_id in self.traced) or self.allow(counts):
+            self.put((ERROR, counts, device_id, text))
+
+    # Network thread
+
+    def received(self, device_type, device_id, topic, payload):
+        # payload: bytes as received, decoded by the writer. Sampled but not
+        # rate-limited: the token buckets belong to the publishing thread.
+        counts = self.counts.get(device_type) or self.type_counts(device_type)
+        counts.received += 1
+        if self.traced and device_id in self.traced:
+            self.put((TRACE, counts, device_id, f"received on {topic}: {payload!r}"))
+        elif counts.every and counts.received % counts.every == 0:
+            self.put((RECEIVED, counts, device_id, (topic, payload)))
+
+    # Any thread
+
+    def info(self, text):
+        self.put((INFO, None, None, text))
+
+    # Writer thread
+
+    def format(self, item):
+        kind, counts, device_id, values = item
+        if kind == READING:
+            try:
+                template = counts.template
+                text = template(*values) if callable(template) else template.format(*values)
+            except (IndexError, KeyError, TypeError, ValueError):  # field missing from this payload
+                text = " | ".join(f"{field} {value}" for field, value in zip(counts.fields, values))
+            return f"[{counts.tag}] {device_id} published: {text}"
+        if kind == RECEIVED:
+            topic, payload = values
+            return f"[{counts.tag}] {device_id} received on {topic}: {payload.decode(errors='replace')}"
+        if kind == ERROR:
+            return f"[{counts.tag}] {device_id}: {values}"
+        if kind == TRACE:
+            return f"[Trace] {counts.tag} {device_id} {values}"
+        return values
+
+    def summary(self, elapsed):
+        lines = []
+        for device_type, counts in sorted(self.counts.items()):
+            now = (counts.readings, counts.errors, counts.received, counts.lag_total, counts.suppressed)
+            readings, errors, received, lag_total, suppressed = (
+                value - before for value, before in zip(now, self.previous.get(device_type, (0,) * len(now))))
+            self.previous[device_type] = now
+            lag_max, counts.lag_max = counts.lag_max, 0.0
+            if not (readings or errors or received):
+                continue
+            lag = f"lag mean {lag_total / readings * 1000:.1f} ms max {lag_max * 1000:.1f} ms" if readings else "lag -"
+            lines.append(f"[Log] {device_type}: {readings / elapsed:.1f} readings/s | {errors} errors | "
+                         f"{received} received | {lag} | {suppressed} lines rate-limited")
+        dropped, self.previous_dropped = self.dropped - self.previous_dropped, self.dropped
+        if dropped:
+            lines.append(f"[Log] {dropped} lines dropped with the writer behind")
+        return lines
+
+    def run(self):
+        last_summary = time.monotonic()
+        while True:
+            stopping = self.stopping  # before draining, so nothing queued ahead of close() is lost
+            lines = []
+            while self.queue and len(lines) < WRITE_BATCH:
+                lines.append(self.format(self.queue.popleft()))
+            done = stopping and not self.queue
+            now = time.monotonic()
+            if self.summary_interval and (now - last_summary >= self.summary_interval or done):
+                lines.extend(self.summary(max(now - last_summary, 1e-3)))
+                last_summary = now
+            if lines:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+                self.written += len(lines)
+            if done:
+                return
+            if not self.queue:
+                self.wake.wait(FLUSH_INTERVAL)
+
+    def close(self):
+        # Writes what is queued, then stops the writer
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def print_reading(device_type, device_id, payload, lag=0.0):
+    # What the device scripts did per reading, for the benchmark
+    tag, template, fields = READING_LINES[device_type]
+    print(f"[{tag}] {device_id} published: " + template.format(*(payload[field] for field in fields)))
+
+
+def benchmark(readings, devices):
+    # Publishing-thread cost per reading of each way of logging it, with the
+    # output going to /dev/null (a terminal is slower still)
+    from sensors import create_sensor, SENSOR_TYPES
+
+    types = list(SENSOR_TYPES)
+    sensors = [create_sensor(types[i % len(types)], str(i), state={}) for i in range(devices)]
+    stream = [(sensor.device_type, sensor.device_id, sensor.stamp(sensor.generate_data())) for sensor in sensors]
+    cases = [
+        ("none", None),
+        ("print", None),
+        ("count only", {"default_every": 0}),
+        ("sampled 1/100", {"default_every": 100}),
+        ("every, rate-limited", {"default_every": 1}),
+        ("every, unlimited", {"default_every": 1, "rate": float("inf"), "limit": readings}),
+        ("1 device traced", {"default_every": 0, "trace": ["0"]}),
+    ]
+    results = []
+    with open(os.devnull, 'w') as devnull:
+        for name, options in cases:
+            log = None
+            if name == "none":
+                def call(device_type, device_id, payload, lag=0.0):
+                    pass
+            elif name == "print":
+                stdout, sys.stdout = sys.stdout, devnull
+                call = print_reading
+            else:
+                log = ReadingLog(devnull, summary_interval=0, **options).start()
+                call = log.reading
+            started = time.perf_counter()
+            for i in range(readings):
+                device_type, device_id, payload = stream[i % devices]
+                call(device_type, device_id, payload, 0.001)
+            elapsed = time.perf_counter() - started
+            if name == "print":
+                sys.stdout = stdout
+            if log is not None:
+                log.close()
+            drained = time.perf_counter() - started
+            results.append({
+                "case": name,
+                "nsPerReading": round(elapsed / readings * 1e9),
+                "lines": log.written if log is not None else (readings if name == "print" else 0),
+                "drainedSeconds": round(drained, 3),
+            })
+    base = results[0]["nsPerReading"]
+    for result in results:
+        result["overheadNs"] = result["nsPerReading"] - base
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-reading cost of the logging pipeline")
+    parser.add_argument("--readings", type=int, default=1000000)
+    parser.add_argument("--devices", type=int, default=1000)
+    args = parser.parse_args()
+
+    for result in benchmark(args.readings, args.devices):
+        print(f"[Log] {result['case']:<20} {result['nsPerReading']:>6} ns/reading "
+              f"({result['overheadNs']:+} ns) | {result['lines']} lines | "
+              f"written out after {result['drainedSeconds']} s")
@@ -0,0 +1,306 @@
+import ssl
+import time
+import signal
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+from mqtt_packets import (
+    CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK,
+    PINGREQ, PINGRESP, DISCONNECT, MQTT_V5, MESSAGE_EXPIRY_INTERVAL, TOPIC_ALIAS,
+    TOPIC_ALIAS_MAXIMUM, packet, encode_properties, decode_properties, decode_string,
+    encode_publish,
+)
+
+# Minimal MQTT 3.1.1/5.0 broker stand-in for local tests of the simulators:
+# CONNECT, PUBLISH (QoS 0/1, retained, v5 topic aliases and message expiry),
+# SUBSCRIBE/UNSUBSCRIBE with +/# wildcards, persistent sessions
+# (clean session off) that queue messages while offline, PINGREQ and
+# DISCONNECT. Deliveries to subscribers are QoS 0. No auth, no QoS 2.
+
+TOPIC_ALIAS_LIMIT = 1024  # announced to v5 clients
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+async def read_packet(reader):
+    header = await reader.readexactly(1)
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b""
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+class WarpClock:
+    # Monotonic clock that tests can move forward, to age queued messages
+    # past their expiry without waiting
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self):
+        return time.monotonic() + self.offset
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+
+class Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = None
+        self.version = 4
+        self.clean = True
+        self.filters = set()
+        self.aliases = {}  # inbound topic alias -> topic (v5)
+
+
+class OfflineSession:
+    # Subscriptions and queued messages of a disconnected persistent session
+    def __init__(self, filters, version):
+        self.filters = filters
+        self.version = version
+        self.queue = deque()  # (expires at or None, topic, payload)
+
+
+class MockBroker:
+    def __init__(self, host="127.0.0.1", port=1883, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.server = None
+        self.loop = None
+        self.clock = time.monotonic  # replaceable for time-warp tests of message expiry
+        self.sessions = set()
+        self.offline = {}  # client id -> OfflineSession
+        self.retained = {}
+        self.connects = 0
+        self.publishes = 0
+        self.subscribes = 0
+        self.bytes_in = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, ssl=self.ssl_context)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for session in list(self.sessions):
+            session.writer.close()
+        await self.server.wait_closed()
+
+    async def restart(self, downtime=1.0, keep_sessions=True):
+        # Drops every connection and stops listening for `downtime` seconds.
+        # Persistent sessions survive unless keep_sessions is off, as with a
+        # broker running without persistence.
+        await self.stop()
+        await asyncio.sleep(downtime)
+        if not keep_sessions:
+            self.offline.clear()
+        await self.start()
+
+    async def handle(self, reader, writer):
+        session = Session(writer)
+        self.sessions.add(session)
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(reader)
+                self.bytes_in += len(body) + 2
+                if packet_type == DISCONNECT:
+                    break
+                self.dispatch(session, packet_type, flags, body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            if not session.clean and session.client_id is not None:
+                self.offline[session.client_id] = OfflineSession(session.filters, session.version)
+            writer.close()
+
+    def dispatch(self, session, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self.connect(session, body)
+        elif packet_type == PUBLISH:
+            self.publish(session, flags, body)
+        elif packet_type == SUBSCRIBE:
+            self.subscribe(session, body)
+        elif packet_type == UNSUBSCRIBE:
+            self.unsubscribe(session, body)
+        elif packet_type == PINGREQ:
+            session.writer.write(packet(PINGRESP))
+
+    def connect(self, session, body):
+        self.connects += 1
+        _, offset = decode_string(body, 0)
+        session.version = body[offset]
+        session.clean = bool(body[offset + 1] & 0x02)
+        offset += 4  # level, flags, keepalive
+        if session.version == MQTT_V5:
+            _, offset = decode_properties(body, offset)
+        client_id, _ = decode_string(body, offset)
+        session.client_id = client_id.decode()
+
+        stored = self.offline.pop(session.client_id, None)
+        if session.clean:
+            stored = None
+        present = b"\x01" if stored else b"\x00"
+        if session.version == MQTT_V5:
+            properties = encode_properties([(TOPIC_ALIAS_MAXIMUM, TOPIC_ALIAS_LIMIT)])
+            session.writer.write(packet(CONNACK, present + b"\x00" + properties))
+        else:
+            session.writer.write(packet(CONNACK, present + b"\x00"))
+
+        if stored:
+            session.filters = stored.filters
+            now = self.clock()
+            for expires, topic, payload in stored.queue:
+                if expires is None or expires > now:
+                    session.writer.write(encode_publish(topic, payload, version=session.version))
+
+    def publish(self, session, flags, body):
+        self.publishes += 1
+        qos = (flags >> 1) & 0x03
+        topic, offset = decode_string(body, 0)
+        topic = topic.decode()
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        expiry = None
+        if session.version == MQTT_V5:
+            properties, offset = decode_properties(body, offset)
+            alias = properties.get(TOPIC_ALIAS)
+            if alias is not None:
+                if topic:
+                    session.aliases[alias] = topic
+                else:
+                    topic = session.aliases[alias]
+            expiry = properties.get(MESSAGE_EXPIRY_INTERVAL)
+        if qos:
+            session.writer.write(packet(PUBACK, packet_id))
+
+        payload = body[offset:]
+        if flags & 0x01:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        self.route(topic, payload, expiry)
+
+    def subscribe(self, session, body):
+        packet_id, offset = body[0:2], 2
+        if session.version == MQTT_V5:
+            _, offset = decode_properties(body, offset)
+        self.subscribes += 1
+        filters, granted = [], bytearray()
+        while offset < len(body):
+            topic_filter, offset = decode_string(body, offset)
+            filters.append(topic_filter.decode())
+            granted.append(min(body[offset] & 0x03, 1))
+            offset += 1
+        session.filters.update(filters)
+        properties = encode_properties(None) if session.version == MQTT_V5 else b""
+        session.writer.write(packet(SUBACK, packet_id + properties + bytes(granted)))
+        for topic, payload in self.retained.items():
+            if any(topic_matches(f, topic) for f in filters):
+                session.writer.write(encode_publish(topic, payload, retain=True, version=session.version))
+
+    def unsubscribe(self, session, body):
+        packet_id, offset = body[0:2], 2
+        if session.version == MQTT_V5:
+            _, offset = decode_properties(body, offset)
+        count = 0
+        while offset < len(body):
+            topic_filter, offset = decode_string(body, offset)
+            session.filters.discard(topic_filter.decode())
+            count += 1
+        if session.version == MQTT_V5:
+            session.writer.write(packet(UNSUBACK, packet_id + encode_properties(None) + bytes(count)))
+        else:
+            session.writer.write(packet(UNSUBACK, packet_id))
+
+    def route(self, topic, payload, expiry=None):
+        for session in self.sessions:
+            if any(topic_matches(f, topic) for f in session.filters):
+                session.writer.write(encode_publish(topic, payload, version=session.version))
+        if self.offline:
+            now = self.clock()
+            expires = now + expiry if expiry is not None else None
+            for stored in self.offline.values():
+                if any(topic_matches(f, topic) for f in stored.filters):
+                    self.expire(stored, now)
+                    stored.queue.append((expires, topic, payload))
+
+    def expire(self, stored, now):
+        while stored.queue and stored.queue[0][0] is not None and stored.queue[0][0] <= now:
+            stored.queue.popleft()
+
+    def queued_bytes(self):
+        # Memory held for offline persistent sessions, after dropping expired messages
+        now = self.clock()
+        total = 0
+        for stored in self.offline.values():
+            self.expire(stored, now)
+            total += sum(len(topic) + len(payload) for _, topic, payload in stored.queue)
+        return total
+
+    def start_in_thread(self):
+        # Runs the broker on its own event loop thread, for use from sync code
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    def stop_in_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def server_ssl_context(cert_file, key_file):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local MQTT broker stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--tls-cert", help="serve mqtts with this certificate")
+    parser.add_argument("--tls-key")
+    parser.add_argument("--downtime", type=float, default=1.0, help="seconds down on SIGUSR1/SIGUSR2 restarts")
+    args = parser.parse_args()
+
+    context = server_ssl_context(args.tls_cert, args.tls_key) if args.tls_cert else None
+    broker = MockBroker(args.host, args.port, context)
+
+    async def serve():
+        await broker.start()
+        print(f"[Broker] Listening on {args.host}:{broker.port}{' (TLS)' if context else ''}", flush=True)
+        # SIGUSR1 restarts keeping persistent sessions, SIGUSR2 loses them
+        loop = asyncio.get_running_loop()
+        for signum, keep in ((signal.SIGUSR1, True), (signal.SIGUSR2, False)):
+            loop.add_signal_handler(signum, lambda keep=keep: asyncio.ensure_future(
+                broker.restart(args.downtime, keep)))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("[Broker] Stopped.")
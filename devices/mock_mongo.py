@@ -0,0 +1,763 @@
+import os
+import re
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import itertools
+from datetime import datetime, timedelta, timezone
+
+# Minimal MongoDB server stand-in, enough for the data manager's mongoose
+# connections in local runs: the OP_QUERY handshake, then OP_MSG commands
+# (hello, ping, buildInfo, create, createIndexes, listIndexes, insert, find,
+# update, findAndModify, delete, count, aggregate, endSessions). Databases
+# live in memory; every cursor comes back whole in its first batch.
+# Aggregation covers $match, $addFields/$set, $project, $sort, $group,
+# $limit, $skip and $count with the expression operators the backend uses.
+# No auth, no indexes, no transactions.
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+CHECKSUM_PRESENT = 1
+MORE_TO_COME = 2
+MAX_WIRE_VERSION = 17  # MongoDB 6.0
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class ObjectId:
+    counter = itertools.count(int.from_bytes(os.urandom(3), "big"))
+    process = os.urandom(5)
+
+    def __init__(self, raw=None):
+        if raw is None:
+            raw = (struct.pack(">I", int(time.time())) + self.process
+                   + (next(self.counter) % 0xFFFFFF).to_bytes(3, "big"))
+        elif isinstance(raw, str):
+            raw = bytes.fromhex(raw)
+        self.raw = raw
+
+    def __eq__(self, other):
+        return isinstance(other, ObjectId) and other.raw == self.raw
+
+    def __lt__(self, other):
+        return self.raw < other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __str__(self):
+        return self.raw.hex()
+
+    __repr__ = __str__
+
+
+class Int64(int):
+    pass
+
+
+class Binary:
+    def __init__(self, subtype, data):
+        self.subtype = subtype
+        self.data = data
+
+
+# --- BSON ---------------------------------------------------------------
+
+def decode_cstring(data, offset):
+    end = data.index(b"\x00", offset)
+    return data[offset:end].decode(), end + 1
+
+
+def decode_document(data, offset=0, as_array=False):
+    size = struct.unpack_from("<i", data, offset)[0]
+    end = offset + size - 1
+    offset += 4
+    result = {}
+    while offset < end:
+        kind = data[offset]
+        key, offset = decode_cstring(data, offset + 1)
+        result[key], offset = decode_value(kind, data, offset)
+    return (list(result.values()) if as_array else result), end + 1
+
+
+def decode_value(kind, data, offset):
+    if kind == 0x01:
+        return struct.unpack_from("<d", data, offset)[0], offset + 8
+    if kind in (0x02, 0x0D, 0x0E):  # string, code, symbol
+        size = struct.unpack_from("<i", data, offset)[0]
+        return data[offset + 4:offset + 3 + size].decode(), offset + 4 + size
+    if kind in (0x03, 0x04):
+        return decode_document(data, offset, as_array=kind == 0x04)
+    if kind == 0x05:
+        size = struct.unpack_from("<i", data, offset)[0]
+        return Binary(data[offset + 4], data[offset + 5:offset + 5 + size]), offset + 5 + size
+    if kind in (0x06, 0x0A, 0x7F, 0xFF):  # undefined, null, max/min key
+        return None, offset
+    if kind == 0x07:
+        return ObjectId(data[offset:offset + 12]), offset + 12
+    if kind == 0x08:
+        return data[offset] == 1, offset + 1
+    if kind == 0x09:
+        return EPOCH + timedelta(milliseconds=struct.unpack_from("<q", data, offset)[0]), offset + 8
+    if kind == 0x0B:
+        pattern, offset = decode_cstring(data, offset)
+        flags, offset = decode_cstring(data, offset)
+        return re.compile(pattern, re.I if "i" in flags else 0), offset
+    if kind == 0x10:
+        return struct.unpack_from("<i", data, offset)[0], offset + 4
+    if kind in (0x11, 0x12):  # timestamp, int64
+        return Int64(struct.unpack_from("<q", data, offset)[0]), offset + 8
+    if kind == 0x13:
+        return Binary(0x13, data[offset:offset + 16]), offset + 16
+    raise ValueError(f"Unsupported BSON type 0x{kind:02x}")
+
+
+def encode_document(document):
+    items = enumerate(document) if isinstance(document, list) else document.items()
+    body = b"".join(encode_element(str(key), value) for key, value in items)
+    return struct.pack("<i", len(body) + 5) + body + b"\x00"
+
+
+def encode_element(key, value):
+    name = key.encode() + b"\x00"
+    if value is None:
+        return b"\x0A" + name
+    if isinstance(value, bool):
+        return b"\x08" + name + (b"\x01" if value else b"\x00")
+    if isinstance(value, Int64):
+        return b"\x12" + name + struct.pack("<q", value)
+    if isinstance(value, int):
+        if -2**31 <= value < 2**31:
+            return b"\x10" + name + struct.pack("<i", value)
+        return b"\x12" + name + struct.pack("<q", value)
+    if isinstance(value, float):
+        return b"\x01" + name + struct.pack("<d", value)
+    if isinstance(value, str):
+        data = value.encode() + b"\x00"
+        return b"\x02" + name + struct.pack("<i", len(data)) + data
+    if isinstance(value, dict):
+        return b"\x03" + name + encode_document(value)
+    if isinstance(value, (list, tuple)):
+        return b"\x04" + name + encode_document(list(value))
+    if isinstance(value, ObjectId):
+        return b"\x07" + name + value.raw
+    if isinstance(value, datetime):
+        return b"\x09" + name + struct.pack("<q", (value - EPOCH) // timedelta(milliseconds=1))
+    if isinstance(value, Binary):
+        if value.subtype == 0x13:
+            return b"\x13" + name + value.data
+        return b"\x05" + name + struct.pack("<i", len(value.data)) + bytes([value.subtype]) + value.data
+    if isinstance(value, re.Pattern):
+        return b"\x0B" + name + value.pattern.encode() + b"\x00" + (b"i" if value.flags & re.I else b"") + b"\x00"
+    raise TypeError(f"Cannot encode {type(value).__name__} as BSON")
+
+
+# --- Queries and aggregation --------------------------------------------
+
+MISSING = object()
+TYPE_ORDER = {type(None): 1, int: 2, Int64: 2, float: 2, str: 3, dict: 4, list: 5, Binary: 6,
+              ObjectId: 7, bool: 8, datetime: 9}
+TYPE_NAMES = {type(None): "null", int: "int", Int64: "long", float: "double", str: "string",
+              dict: "object", list: "array", Binary: "binData", ObjectId: "objectId",
+              bool: "bool", datetime: "date"}
+
+
+def get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def sort_key(value):
+    if value is MISSING or value is None:
+        return (1, 0)
+    rank = TYPE_ORDER.get(type(value), 12)
+    if isinstance(value, dict):
+        return (rank, [(key, sort_key(item)) for key, item in value.items()])
+    if isinstance(value, list):
+        return (rank, [sort_key(item) for item in value])
+    if isinstance(value, Binary):
+        return (rank, value.data)
+    return (rank, value)
+
+
+def comparable(a, b):
+    # $gt and friends only compare values of the same BSON type bracket
+    return a is not MISSING and b is not MISSING and TYPE_ORDER.get(type(a)) == TYPE_ORDER.get(type(b))
+
+
+def compare(operator, value, operand):
+    if operator == "$eq":
+        return equal(value, operand)
+    if operator == "$ne":
+        return not equal(value, operand)
+    if operator == "$in":
+        return any(equal(value, item) for item in operand)
+    if operator == "$nin":
+        return not any(equal(value, item) for item in operand)
+    if operator == "$exists":
+        return (value is not MISSING) == bool(operand)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        candidates = value if isinstance(value, list) else [value]
+        for item in candidates:
+            if comparable(item, operand):
+                key, other = sort_key(item), sort_key(operand)
+                if {"$gt": key > other, "$gte": key >= other, "$lt": key < other, "$lte": key <= other}[operator]:
+                    return True
+        return False
+    if operator == "$regex":
+        return isinstance(value, str) and re.search(operand if isinstance(operand, str) else operand.pattern, value)
+    if operator == "$options":
+        return True
+    if operator == "$not":
+        return not matches_condition(value, operand)
+    if operator == "$size":
+        return isinstance(value, list) and len(value) == operand
+    raise ValueError(f"Unsupported query operator {operator}")
+
+
+def equal(value, operand):
+    if isinstance(operand, re.Pattern):
+        return isinstance(value, str) and operand.search(value) is not None
+    if value is MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return any(equal(item, operand) for item in value)
+    return sort_key(value) == sort_key(operand)
+
+
+def matches_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        return all(compare(operator, value, operand) for operator, operand in condition.items())
+    return equal(value, condition)
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, part) for part in condition):
+                return False
+        elif key == "$expr":
+            if not truthy(evaluate(condition, document)):
+                return False
+        elif not matches_condition(get_path(document, key), condition):
+            return False
+    return True
+
+
+def truthy(value):
+    return value not in (MISSING, None, False, 0)
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return EPOCH + timedelta(milliseconds=value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    if isinstance(value, ObjectId):
+        return EPOCH + timedelta(seconds=struct.unpack(">I", value.raw[:4])[0])
+    return None
+
+
+def evaluate(expression, document):
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            return document if expression in ("$$ROOT", "$$CURRENT") else MISSING
+        return get_path(document, expression[1:]) if expression.startswith("$") else expression
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    operator, operand = next(iter(expression.items()))
+    if operator == "$literal":
+        return operand
+    if operator == "$switch":
+        for branch in operand["branches"]:
+            if truthy(evaluate(branch["case"], document)):
+                return evaluate(branch["then"], document)
+        return evaluate(operand.get("default"), document)
+    if operator == "$cond":
+        if isinstance(operand, list):
+            operand = dict(zip(("if", "then", "else"), operand))
+        branch = "then" if truthy(evaluate(operand["if"], document)) else "else"
+        return evaluate(operand[branch], document)
+    if operator == "$dateFromString":
+        return to_date(evaluate(operand["dateString"], document))
+    args = evaluate(operand, document)
+    if operator == "$type":
+        value = args[0] if isinstance(operand, list) else args
+        return "missing" if value is MISSING else TYPE_NAMES.get(type(value), "unknown")
+    if operator == "$toDate":
+        return to_date(args)
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = (sort_key(None if arg is MISSING else arg) for arg in args)
+        return {"$eq": a == b, "$ne": a != b, "$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b}[operator]
+    if operator == "$and":
+        return all(truthy(arg) for arg in args)
+    if operator == "$or":
+        return any(truthy(arg) for arg in args)
+    if operator == "$not":
+        return not truthy(args[0] if isinstance(args, list) else args)
+    if operator == "$ifNull":
+        return next((arg for arg in args if arg not in (MISSING, None)), None)
+    if operator in ("$add", "$subtract", "$multiply", "$divide"):
+        if any(not isinstance(arg, (int, float, datetime)) or isinstance(arg, bool) for arg in args):
+            return None
+        result = args[0]
+        for arg in args[1:]:
+            if operator == "$add":
+                result = result + (timedelta(milliseconds=arg) if isinstance(result, datetime) else arg)
+            elif operator == "$subtract":
+                result = ((result - arg) / timedelta(milliseconds=1) if isinstance(arg, datetime)
+                          else result - (timedelta(milliseconds=arg) if isinstance(result, datetime) else arg))
+            elif operator == "$multiply":
+                result = result * arg
+            else:
+                result = result / arg
+        return result
+    raise ValueError(f"Unsupported expression operator {operator}")
+
+
+def accumulate(operator, values):
+    present = [value for value in values if value is not MISSING]
+    if operator == "$sum":
+        return sum(value for value in present if isinstance(value, (int, float)) and not isinstance(value, bool))
+    if operator == "$avg":
+        numbers = [value for value in present if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator == "$first":
+        return values[0] if values and values[0] is not MISSING else None
+    if operator == "$last":
+        return values[-1] if values and values[-1] is not MISSING else None
+    if operator in ("$max", "$min"):
+        present = [value for value in present if value is not None]
+        if not present:
+            return None
+        return (max if operator == "$max" else min)(present, key=sort_key)
+    if operator == "$push":
+        return present
+    if operator == "$addToSet":
+        unique = {}
+        for value in present:
+            unique.setdefault(repr(sort_key(value)), value)
+        return list(unique.values())
+    raise ValueError(f"Unsupported accumulator {operator}")
+
+
+def sort_documents(documents, order):
+    for field, direction in reversed(list(order.items())):
+        documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=direction < 0)
+    return documents
+
+
+def project(document, projection):
+    if not projection:
+        return document
+    included = {key: value for key, value in projection.items() if key != "_id"}
+    if included and all(not value for value in included.values()):
+        result = dict(document)
+        for key in included:
+            unset_path(result, key)
+        if not projection.get("_id", 1):
+            result.pop("_id", None)
+        return result
+    result = {}
+    if projection.get("_id", 1) and "_id" in document:
+        result["_id"] = document["_id"]
+    for key, value in included.items():
+        if value in (1, True):
+            found = get_path(document, key)
+            if found is not MISSING:
+                set_path(result, key, found)
+        elif value not in (0, False):
+            set_path(result, key, evaluate(value, document))
+    return result
+
+
+def run_pipeline(documents, pipeline):
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name == "$match":
+            documents = [document for document in documents if matches(document, spec)]
+        elif name in ("$addFields", "$set"):
+            updated = []
+            for document in documents:
+                document = dict(document)
+                for field, expression in spec.items():
+                    set_path(document, field, evaluate(expression, document))
+                updated.append(document)
+            documents = updated
+        elif name == "$project":
+            documents = [project(document, spec) for document in documents]
+        elif name == "$sort":
+            documents = sort_documents(list(documents), spec)
+        elif name == "$group":
+            groups = {}
+            for document in documents:
+                key = evaluate(spec["_id"], document)
+                key = None if key is MISSING else key
+                groups.setdefault(repr(sort_key(key)), (key, []))[1].append(document)
+            documents = []
+            for key, members in groups.values():
+                result = {"_id": key}
+                for field, accumulator in spec.items():
+                    if field != "_id":
+                        operator, expression = next(iter(accumulator.items()))
+                        result[field] = accumulate(operator, [evaluate(expression, member) for member in members])
+                documents.append(result)
+        elif name == "$limit":
+            documents = documents[:spec]
+        elif name == "$skip":
+            documents = documents[spec:]
+        elif name == "$count":
+            documents = [{spec: len(documents)}] if documents else []
+        else:
+            raise ValueError(f"Unsupported pipeline stage {name}")
+    return documents
+
+
+def apply_update(document, update, inserting=False):
+    if not any(key.startswith("$") for key in update):
+        replaced = dict(update)
+        replaced["_id"] = document.get("_id", replaced.get("_id"))
+        document.clear()
+        document.update(replaced)
+        return
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                set_path(document, path, value)
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$inc":
+                current = get_path(document, path)
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif operator == "$push":
+                current = get_path(document, path)
+                set_path(document, path, ([] if current is MISSING else current) + [value])
+            elif operator != "$setOnInsert":
+                raise ValueError(f"Unsupported update operator {operator}")
+
+
+def upserted(query, update):
+    document = {key: value for key, value in query.items()
+                if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))}
+    document.setdefault("_id", ObjectId())
+    apply_update(document, update, inserting=True)
+    return document
+
+
+# --- Server -------------------------------------------------------------
+
+class CommandError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class MockMongo:
+    def __init__(self, host, port, journal=None):
+        self.host = host
+        self.port = port
+        self.databases = {}  # name -> {collection -> [documents]}
+        self.connections = itertools.count(1)
+        self.journal = open(journal, 'a') if journal else None
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def collection(self, database, name):
+        return self.databases.setdefault(database, {}).setdefault(name, [])
+
+    async def handle(self, reader, writer):
+        connection_id = next(self.connections)
+        try:
+            while True:
+                header = await reader.readexactly(16)
+                length, request_id, _, opcode = struct.unpack("<iiii", header)
+                body = await reader.readexactly(length - 16)
+                if opcode == OP_QUERY:
+                    reply = self.op_query(body, connection_id)
+                    payload = struct.pack("<iqii", 0, 0, 0, 1) + encode_document(reply)
+                    self.send(writer, request_id, OP_REPLY, payload)
+                elif opcode == OP_MSG:
+                    flags = struct.unpack_from("<I", body)[0]
+                    reply = self.op_msg(body, flags, connection_id)
+                    if not flags & MORE_TO_COME:
+                        self.send(writer, request_id, OP_MSG, struct.pack("<I", 0) + b"\x00" + encode_document(reply))
+                else:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def send(self, writer, request_id, opcode, payload):
+        writer.write(struct.pack("<iiii", len(payload) + 16, 0, request_id, opcode) + payload)
+
+    def op_query(self, body, connection_id):
+        # Only the legacy handshake comes this way
+        collection, offset = decode_cstring(body, 4)
+        query, _ = decode_document(body, offset + 8)
+        query.setdefault("$db", collection.split(".")[0])
+        return self.command(query, connection_id)
+
+    def op_msg(self, body, flags, connection_id):
+        end = len(body) - (4 if flags & CHECKSUM_PRESENT else 0)
+        offset, command, sequences = 4, None, {}
+        while offset < end:
+            kind = body[offset]
+            offset += 1
+            if kind == 0:
+                command, offset = decode_document(body, offset)
+            else:
+                size = struct.unpack_from("<i", body, offset)[0]
+                section_end = offset + size
+                identifier, offset = decode_cstring(body, offset + 4)
+                documents = sequences.setdefault(identifier, [])
+                while offset < section_end:
+                    document, offset = decode_document(body, offset)
+                    documents.append(document)
+        command.update(sequences)
+        return self.command(command, connection_id)
+
+    def command(self, command, connection_id):
+        name = next(iter(command))
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        try:
+            if handler is None:
+                raise CommandError(59, f"no such command: '{name}'")
+            reply = handler(command, command.get("$db", "test"), connection_id)
+        except CommandError as error:
+            return {"ok": 0.0, "errmsg": str(error), "code": error.code}
+        except (ValueError, TypeError, KeyError) as error:
+            return {"ok": 0.0, "errmsg": f"{name}: {error}", "code": 2}
+        reply["ok"] = 1.0
+        return reply
+
+    def cmd_hello(self, command, db, connection_id):
+        return {"helloOk": True, "isWritablePrimary": True, "ismaster": True,
+                "maxBsonObjectSize": 16 * 1024 * 1024, "maxMessageSizeBytes": 48000000,
+                "maxWriteBatchSize": 100000, "localTime": datetime.now(timezone.utc),
+                "logicalSessionTimeoutMinutes": 30, "connectionId": connection_id,
+                "minWireVersion": 0, "maxWireVersion": MAX_WIRE_VERSION, "readOnly": False}
+
+    cmd_ismaster = cmd_hello
+
+    def cmd_ping(self, command, db, connection_id):
+        return {}
+
+    cmd_endsessions = cmd_ping
+    cmd_killcursors = cmd_ping
+
+    def cmd_buildinfo(self, command, db, connection_id):
+        return {"version": "6.0.0", "versionArray": [6, 0, 0, 0], "maxBsonObjectSize": 16 * 1024 * 1024}
+
+    def cmd_create(self, command, db, connection_id):
+        self.collection(db, command["create"])
+        return {}
+
+    def cmd_createindexes(self, command, db, connection_id):
+        self.collection(db, command["createIndexes"])
+        return {"numIndexesBefore": 1, "numIndexesAfter": 1, "createdCollectionAutomatically": False}
+
+    def cmd_listindexes(self, command, db, connection_id):
+        indexes = [{"v": 2, "key": {"_id": 1}, "name": "_id_"}]
+        return self.cursor(db, command["listIndexes"], indexes)
+
+    def cmd_listcollections(self, command, db, connection_id):
+        names = [{"name": name, "type": "collection"} for name in self.databases.get(db, {})]
+        return self.cursor(db, "$cmd.listCollections", names)
+
+    def cmd_drop(self, command, db, connection_id):
+        self.databases.get(db, {}).pop(command["drop"], None)
+        return {}
+
+    def cmd_insert(self, command, db, connection_id):
+        documents = self.collection(db, command["insert"])
+        stored_at = time.time() * 1000
+        for document in command["documents"]:
+            document.setdefault("_id", ObjectId())
+            documents.append(document)
+            self.record(db, command["insert"], document, stored_at)
+        return {"n": len(command["documents"])}
+
+    def record(self, db, collection, document, stored_at):
+        # Traced documents go to the journal, for latency runs
+        if self.journal and "traceId" in document:
+            self.journal.write(json.dumps({"ns": f"{db}.{collection}", "traceId": document["traceId"],
+                                           "publishedAt": document.get("publishedAt"),
+                                           "storedAt": stored_at}) + "\n")
+            self.journal.flush()
+
+    def cmd_find(self, command, db, connection_id):
+        documents = [document for document in self.databases.get(db, {}).get(command["find"], [])
+                     if matches(document, command.get("filter", {}))]
+        if command.get("sort"):
+            documents = sort_documents(documents, command["sort"])
+        documents = documents[command.get("skip", 0):]
+        if command.get("limit"):
+            documents = documents[:abs(command["limit"])]
+        documents = [project(document, command.get("projection")) for document in documents]
+        return self.cursor(db, command["find"], documents)
+
+    def cmd_count(self, command, db, connection_id):
+        documents = self.databases.get(db, {}).get(command["count"], [])
+        return {"n": sum(1 for document in documents if matches(document, command.get("query") or {}))}
+
+    def cmd_aggregate(self, command, db, connection_id):
+        documents = self.databases.get(db, {}).get(command["aggregate"], [])
+        return self.cursor(db, command["aggregate"], run_pipeline(list(documents), command["pipeline"]))
+
+    def cmd_update(self, command, db, connection_id):
+        documents = self.collection(db, command["update"])
+        matched = modified = 0
+        upserts = []
+        for index, statement in enumerate(command["updates"]):
+            hits = [document for document in documents if matches(document, statement["q"])]
+            if not statement.get("multi"):
+                hits = hits[:1]
+            for document in hits:
+                apply_update(document, statement["u"])
+            matched += len(hits)
+            modified += len(hits)
+            if not hits and statement.get("upsert"):
+                document = upserted(statement["q"], statement["u"])
+                documents.append(document)
+                upserts.append({"index": index, "_id": document["_id"]})
+        reply = {"n": matched + len(upserts), "nModified": modified}
+        if upserts:
+            reply["upserted"] = upserts
+        return reply
+
+    def cmd_delete(self, command, db, connection_id):
+        documents = self.collection(db, command["delete"])
+        removed = 0
+        for statement in command["deletes"]:
+            hits = [document for document in documents if matches(document, statement["q"])]
+            if statement.get("limit"):
+                hits = hits[:1]
+            for document in hits:
+                documents.remove(document)
+            removed += len(hits)
+        return {"n": removed}
+
+    def cmd_findandmodify(self, command, db, connection_id):
+        documents = self.collection(db, command["findAndModify"])
+        hits = [document for document in documents if matches(document, command.get("query", {}))]
+        if command.get("sort"):
+            hits = sort_documents(hits, command["sort"])
+        target = hits[0] if hits else None
+        before = dict(target) if target else None
+        if target is not None and command.get("remove"):
+            documents.remove(target)
+            return {"lastErrorObject": {"n": 1}, "value": before}
+        if target is not None:
+            apply_update(target, command["update"])
+            value = target if command.get("new") else before
+            return {"lastErrorObject": {"n": 1, "updatedExisting": True},
+                    "value": project(value, command.get("fields"))}
+        if command.get("upsert"):
+            target = upserted(command.get("query", {}), command["update"])
+            documents.append(target)
+            return {"lastErrorObject": {"n": 1, "updatedExisting": False, "upserted": target["_id"]},
+                    "value": project(target, command.get("fields")) if command.get("new") else None}
+        return {"lastErrorObject": {"n": 0, "updatedExisting": False}, "value": None}
+
+    def cursor(self, db, collection, documents):
+        return {"cursor": {"id": Int64(0), "ns": f"{db}.{collection}", "firstBatch": documents}}
+
+
+class MongoClient:
+    # Blocking OP_MSG client for the harnesses: seeding and reading back
+    def __init__(self, port, host="127.0.0.1"):
+        self.sock = socket.create_connection((host, port))
+        self.request_ids = itertools.count(1)
+
+    def command(self, db, command):
+        command = dict(command, **{"$db": db})
+        payload = struct.pack("<I", 0) + b"\x00" + encode_document(command)
+        self.sock.sendall(struct.pack("<iiii", len(payload) + 16, next(self.request_ids), 0, OP_MSG) + payload)
+        header = self.recv(16)
+        body = self.recv(struct.unpack("<i", header[:4])[0] - 16)
+        reply, _ = decode_document(body, 5)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("errmsg"))
+        return reply
+
+    def recv(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed")
+            data += chunk
+        return data
+
+    def insert(self, db, collection, documents):
+        return self.command(db, {"insert": collection, "documents": documents})
+
+    def find(self, db, collection, query=None):
+        return self.command(db, {"find": collection, "filter": query or {}})["cursor"]["firstBatch"]
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local MongoDB server stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--journal", help="append the store time of every traced document to this file")
+    args = parser.parse_args()
+
+    mongo = MockMongo(args.host, args.port, args.journal)
+
+    async def serve():
+        await mongo.start()
+        print(f"[Mongo] Listening on {args.host}:{mongo.port}", flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("[Mongo] Stopped.")
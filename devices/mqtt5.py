@@ -0,0 +1,271 @@
+import json
+import socket
+import argparse
+import itertools
+import threading
+
+from mqtt_packets import (
+    CONNACK, PINGREQ, PINGRESP, DISCONNECT, MQTT_V311, MQTT_V5, MESSAGE_EXPIRY_INTERVAL,
+    CONTENT_TYPE, TOPIC_ALIAS, TOPIC_ALIAS_MAXIMUM, USER_PROPERTY, packet, decode_properties,
+    encode_connect, encode_publish, encode_subscribe, recv_packet,
+)
+from sensors import create_sensor, device_topics, SENSOR_TYPES
+
+MESSAGE_EXPIRY = 900        # seconds a reading may wait in the broker for an offline subscriber
+CONTENT_TYPE_JSON = "application/json"
+SCHEMA_VERSION = 1
+SCHEMA_PROPERTY = "schema"  # user property carrying SCHEMA_VERSION
+
+# Payload keys that never change for a device; with stripMetadata they are
+# published once, retained, on <prefix>/<id>/meta instead of in every reading
+STATIC_FIELDS = ("sensorId", "deviceId", "type", "systemType", "unit", "hardwareVersion",
+                 "softwareVersion", "productNumber", "manufacturer")
+
+# paho attribute names of the properties the fleet sends
+PAHO_NAMES = {
+    MESSAGE_EXPIRY_INTERVAL: "MessageExpiryInterval",
+    CONTENT_TYPE: "ContentType",
+    TOPIC_ALIAS: "TopicAlias",
+    USER_PROPERTY: "UserProperty",
+}
+
+
+def split_metadata(payload):
+    # -> (static metadata, reading without it)
+    meta = {key: value for key, value in payload.items() if key in STATIC_FIELDS}
+    reading = {key: value for key, value in payload.items() if key not in STATIC_FIELDS}
+    return meta, reading
+
+
+def paho_properties(properties):
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    result = Properties(PacketTypes.PUBLISH)
+    for identifier, value in properties:
+        if identifier == USER_PROPERTY:
+            result.UserProperty = [value]
+        else:
+            setattr(result, PAHO_NAMES[identifier], value)
+    return result
+
+
+def connect_properties(session_expiry):
+    # CONNECT properties keeping a persistent session for session_expiry seconds
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    result = Properties(PacketTypes.CONNECT)
+    result.SessionExpiryInterval = session_expiry
+    return result
+
+
+class V5Options:
+    # Manifest "mqtt5" section: {"enabled": true, "messageExpiry": 900, "rollupExpiry": null,
+    # "topicAliases": true, "stripMetadata": false, "schemaVersion": 1}
+    def __init__(self, config):
+        self.message_expiry = config.get("messageExpiry", MESSAGE_EXPIRY)
+        self.rollup_expiry = config.get("rollupExpiry")  # rollups stay useful after an outage
+        self.topic_aliases = config.get("topicAliases", True)
+        self.strip_metadata = config.get("stripMetadata", False)
+        self.static = [
+            (CONTENT_TYPE, config.get("contentType", CONTENT_TYPE_JSON)),
+            (USER_PROPERTY, (SCHEMA_PROPERTY, str(config.get("schemaVersion", SCHEMA_VERSION)))),
+        ]
+
+    def properties(self, topic, retain=False, alias=None, static=True):
+        properties = list(self.static) if static else []
+        expiry = self.rollup_expiry if "/rollup/" in topic else self.message_expiry
+        if expiry and not retain:
+            properties.append((MESSAGE_EXPIRY_INTERVAL, expiry))
+        if alias is not None:
+            properties.append((TOPIC_ALIAS, alias))
+        return properties
+
+
+class TopicAliases:
+    # Per-connection alias table. The first publish on a topic carries the
+    # topic and its new alias, later ones only the alias. Once the broker's
+    # maximum is reached further topics go out in full: an alias is never
+    # reassigned, so it names one topic for the whole connection (and with
+    # more devices than aliases, publishing round robin, reassigning the
+    # least recently used one would miss every time).
+    def __init__(self, maximum=0):
+        self.maximum = maximum
+        self.aliases = {}  # topic -> alias
+        self.hits = 0
+
+    def assign(self, topic):
+        # -> (topic to send, alias or None)
+        if not self.maximum:
+            return topic, None
+        alias = self.aliases.get(topic)
+        if alias is not None:
+            self.hits += 1
+            return "", alias
+        if len(self.aliases) >= self.maximum:
+            return topic, None
+        alias = self.aliases[topic] = len(self.aliases) + 1
+        return topic, alias
+
+    def topics(self):
+        return {alias: topic for topic, alias in self.aliases.items()}
+
+
+class V5Session:
+    # MQTT 5 publish state of one connection. Aliases and the static
+    # properties (content type, schema) are per connection: a topic's first
+    # publish on it carries the topic, a new alias and the static properties,
+    # later ones neither. Retained messages always carry them in full, for
+    # subscribers that come later.
+    def __init__(self, options, build=paho_properties):
+        self.options = options
+        self.build = build
+        # Held from prepare() until the client has taken the message, and by
+        # reset() and disconnected(), so every message is addressed for the
+        # connection it goes out on
+        self.lock = threading.Lock()
+        self.aliases = TopicAliases()
+        self.described = set()  # topics whose static properties went out on this connection
+
+    def reset(self, alias_maximum):
+        # On CONNACK, with the broker's Topic Alias Maximum
+        with self.lock:
+            self.aliases = TopicAliases(alias_maximum if self.options.topic_aliases else 0)
+            self.described = set()
+
+    def prepare(self, topic, retain=False):
+        # Caller holds self.lock
+        if retain:
+            return topic, self.build(self.options.properties(topic, retain))
+        static = topic not in self.described
+        self.described.add(topic)
+        topic_name = topic
+        topic, alias = self.aliases.assign(topic_name)
+        return topic, self.build(self.options.properties(topic_name, retain, alias, static))
+
+    def disconnected(self, client):
+        # paho sends the QoS 1 messages it still holds (unacknowledged or
+        # queued) again after the next CONNACK, as they were handed to it,
+        # but the broker forgets aliases with the connection: those messages
+        # get their full topic and static properties back. Aliases stay off
+        # until reset() learns the new connection's maximum.
+        with self.lock:
+            topics = self.aliases.topics()
+            with client._out_message_mutex:
+                for message in client._out_messages.values():
+                    alias = getattr(message.properties, "TopicAlias", None)
+                    if alias is None:
+                        continue
+                    topic = message.topic or topics[alias]
+                    message._topic = topic.encode()
+                    message.properties = self.build(self.options.properties(topic, message.retain))
+            self.aliases = TopicAliases()
+            self.described = set()
+
+
+class WireClient:
+    # Plain-socket MQTT client for the comparison below; counts the bytes it sends
+    def __init__(self, port, client_id, version, clean=True):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.version = version
+        self.bytes_sent = 0
+        self.send(encode_connect(client_id, version, clean))
+        packet_type, _, body = recv_packet(self.sock)
+        if packet_type != CONNACK or body[1]:
+            raise ConnectionError(f"CONNACK refused: {body!r}")
+        properties = decode_properties(body, 2)[0] if version == MQTT_V5 else {}
+        self.alias_maximum = properties.get(TOPIC_ALIAS_MAXIMUM, 0)
+
+    def send(self, data):
+        self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def sync(self):
+        # The broker handles packets in order, so a PINGRESP means everything
+        # sent before the PINGREQ has been routed
+        self.sock.sendall(packet(PINGREQ))
+        while recv_packet(self.sock)[0] != PINGRESP:
+            pass
+
+    def close(self):
+        self.sock.sendall(packet(DISCONNECT))
+        self.sock.close()
+
+
+def measure(mode, devices, readings, expiry, qos=1):
+    # One broker per mode: an offline persistent subscriber, `devices` devices
+    # publishing `readings` readings each over one connection at `qos` (the
+    # fleet's default publish mode is QoS 1), then a time warp past the
+    # expiry interval
+    from mock_broker import MockBroker, WarpClock
+
+    version = MQTT_V311 if mode == "v3.1.1" else MQTT_V5
+    options = V5Options({"messageExpiry": expiry, "stripMetadata": mode == "v5-stripped"})
+    broker = MockBroker(port=0)
+    broker.clock = WarpClock()
+    broker.start_in_thread()
+    try:
+        dashboard = WireClient(broker.port, "dashboard", version, clean=False)
+        dashboard.send(encode_subscribe(1, ["sensor/+/data", "device/+/data"], version=version))
+        dashboard.sync()
+        dashboard.close()
+
+        client = WireClient(broker.port, f"compare-{mode}", version)
+        session = V5Session(options, build=list)
+        session.reset(client.alias_maximum)
+        types = sorted(SENSOR_TYPES)
+        sensors = [create_sensor(types[i % len(types)], str(i), state={}) for i in range(devices)]
+        described = set()  # devices whose metadata is published
+        packet_ids = itertools.cycle(range(1, 65536))
+        for _ in range(readings):
+            for sensor in sensors:
+                payload = sensor.generate_data()
+                topics = device_topics(sensor.device_id, sensor.device_type)
+                if options.strip_metadata:
+                    meta, payload = split_metadata(payload)
+                    if sensor.device_id not in described:
+                        client.send(encode_publish(topics["meta"], json.dumps(meta).encode(), retain=True,
+                                                   version=version,
+                                                   properties=options.properties(topics["meta"], True)))
+                        described.add(sensor.device_id)
+                message = json.dumps(payload).encode()
+                packet_id = next(packet_ids) if qos else None
+                if version == MQTT_V5:
+                    topic, properties = session.prepare(topics["data"])
+                    client.send(encode_publish(topic, message, qos, packet_id, version=version,
+                                               properties=properties))
+                else:
+                    client.send(encode_publish(topics["data"], message, qos, packet_id))
+        client.sync()
+        queued = broker.queued_bytes()
+        broker.clock.advance(expiry + 1)
+        expired = broker.queued_bytes()
+        client.close()
+    finally:
+        broker.stop_in_thread()
+
+    count = devices * readings
+    return {
+        "mode": mode,
+        "bytesPerReading": round(client.bytes_sent / count, 1),
+        "wireBytes": client.bytes_sent,
+        "aliasHits": session.aliases.hits,
+        "queuedBytes": queued,
+        "queuedAfterExpiry": expired,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare MQTT 3.1.1 and 5 publishing against a local broker stand-in")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--readings", type=int, default=20, help="readings per device")
+    parser.add_argument("--expiry", type=int, default=MESSAGE_EXPIRY)
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=1)
+    args = parser.parse_args()
+
+    for mode in ("v3.1.1", "v5", "v5-stripped"):
+        result = measure(mode, args.devices, args.readings, args.expiry, args.qos)
+        print(f"[MQTT5] {mode:12} {result['bytesPerReading']:7} bytes/reading on the wire | "
+              f"broker queue {result['queuedBytes']} bytes, {result['queuedAfterExpiry']} after "
+              f"{args.expiry} s | {result['aliasHits']} alias hits")
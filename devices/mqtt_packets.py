@@ -0,0 +1,164 @@
+# MQTT 3.1.1 / 5.0 packet encoding shared by the broker stand-in and the
+# protocol measurement tools. Only the parts those use are covered.
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+MQTT_V311 = 4
+MQTT_V5 = 5
+
+# MQTT 5 property identifiers used by the simulators
+MESSAGE_EXPIRY_INTERVAL = 0x02
+CONTENT_TYPE = 0x03
+SESSION_EXPIRY_INTERVAL = 0x11
+TOPIC_ALIAS_MAXIMUM = 0x22
+TOPIC_ALIAS = 0x23
+USER_PROPERTY = 0x26
+
+# Wire type of every MQTT 5 property, needed to skip unknown ones
+PROPERTY_TYPES = {
+    0x01: "byte", 0x02: "int4", 0x03: "string", 0x08: "string", 0x09: "binary",
+    0x0B: "varint", 0x11: "int4", 0x12: "string", 0x13: "int2", 0x15: "string",
+    0x16: "binary", 0x17: "byte", 0x18: "int4", 0x19: "byte", 0x1A: "string",
+    0x1C: "string", 0x1F: "string", 0x21: "int2", 0x22: "int2", 0x23: "int2",
+    0x24: "byte", 0x25: "byte", 0x26: "pair", 0x27: "int4", 0x28: "byte",
+    0x29: "byte", 0x2A: "byte",
+}
+INT_SIZES = {"byte": 1, "int2": 2, "int4": 4}
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def decode_length(data, offset):
+    # Variable byte integer at offset -> (value, offset after it)
+    value, multiplier = 0, 1
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, offset
+        multiplier *= 128
+
+
+def encode_string(value):
+    data = value.encode() if isinstance(value, str) else value
+    return len(data).to_bytes(2, "big") + data
+
+
+def decode_string(data, offset):
+    length = int.from_bytes(data[offset:offset + 2], "big")
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+def encode_properties(properties):
+    # properties: list of (identifier, value); strings/pairs as str
+    body = bytearray()
+    for identifier, value in properties or ():
+        kind = PROPERTY_TYPES[identifier]
+        body.append(identifier)
+        if kind in INT_SIZES:
+            body += value.to_bytes(INT_SIZES[kind], "big")
+        elif kind == "varint":
+            body += encode_length(value)
+        elif kind == "pair":
+            body += encode_string(value[0]) + encode_string(value[1])
+        else:
+            body += encode_string(value)
+    return encode_length(len(body)) + bytes(body)
+
+
+def decode_properties(data, offset):
+    # -> ({identifier: value}, offset after the properties); user properties
+    # are collected into a list
+    length, offset = decode_length(data, offset)
+    end = offset + length
+    properties = {}
+    while offset < end:
+        identifier = data[offset]
+        offset += 1
+        kind = PROPERTY_TYPES[identifier]
+        if kind in INT_SIZES:
+            size = INT_SIZES[kind]
+            value = int.from_bytes(data[offset:offset + size], "big")
+            offset += size
+        elif kind == "varint":
+            value, offset = decode_length(data, offset)
+        elif kind == "pair":
+            key, offset = decode_string(data, offset)
+            item, offset = decode_string(data, offset)
+            properties.setdefault(identifier, []).append((key.decode(), item.decode()))
+            continue
+        else:
+            value, offset = decode_string(data, offset)
+        properties[identifier] = value
+    return properties, end
+
+
+def packet(packet_type, body=b"", flags=0):
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+def encode_connect(client_id, version=MQTT_V311, clean=True, keepalive=60, properties=None):
+    body = encode_string("MQTT") + bytes([version, 0x02 if clean else 0x00]) + keepalive.to_bytes(2, "big")
+    if version == MQTT_V5:
+        body += encode_properties(properties)
+    return packet(CONNECT, body + encode_string(client_id))
+
+
+def encode_publish(topic, payload, qos=0, packet_id=None, retain=False, version=MQTT_V311, properties=None):
+    body = encode_string(topic)
+    if qos:
+        body += packet_id.to_bytes(2, "big")
+    if version == MQTT_V5:
+        body += encode_properties(properties)
+    return packet(PUBLISH, body + payload, flags=(qos << 1) | (0x01 if retain else 0))
+
+
+def encode_subscribe(packet_id, filters, qos=1, version=MQTT_V311):
+    body = packet_id.to_bytes(2, "big")
+    if version == MQTT_V5:
+        body += encode_properties(None)
+    for topic_filter in filters:
+        body += encode_string(topic_filter) + bytes([qos])
+    return packet(SUBSCRIBE, body, flags=0x02)
+
+
+def encode_unsubscribe(packet_id, filters, version=MQTT_V311):
+    body = packet_id.to_bytes(2, "big")
+    if version == MQTT_V5:
+        body += encode_properties(None)
+    for topic_filter in filters:
+        body += encode_string(topic_filter)
+    return packet(UNSUBSCRIBE, body, flags=0x02)
+
+
+def recv_packet(sock):
+    # Blocking read of one packet from a plain socket -> (type, flags, body)
+    def recv_exactly(size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed")
+            data += chunk
+        return data
+
+    header = recv_exactly(1)[0]
+    length, multiplier = 0, 1
+    while True:
+        byte = recv_exactly(1)[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    return header >> 4, header & 0x0F, recv_exactly(length) if length else b""
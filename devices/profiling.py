@@ -0,0 +1,144 @@
+import io
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+
+TOP_ENTRIES = 30        # lines kept in the text summaries
+TRACEMALLOC_FRAMES = 5
+
+
+def file_stamp():
+    # Microseconds, so snapshots taken within the same second keep their own files
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+class StageTimer:
+    # Per-stage count/total/max of the reading pipeline (generate -> serialize -> publish)
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def wrap(self, name, fn):
+        stats = self.stages[name] = [0, 0.0, 0.0]
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            result = fn(*args, **kwargs)
+            elapsed = clock() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+            return result
+        return timed
+
+    def summary(self):
+        return {
+            "seconds": round(time.perf_counter() - self.started, 3),
+            "stages": {
+                name: {
+                    "count": count,
+                    "meanUs": round(total / count * 1e6, 2) if count else None,
+                    "maxUs": round(longest * 1e6, 2),
+                    "totalS": round(total, 4),
+                }
+                for name, (count, total, longest) in self.stages.items()
+            },
+        }
+
+
+class Profiler:
+    # On-demand profiling of a live fleet. Nothing here runs until started:
+    # cProfile and tracemalloc are only enabled between start and stop, and
+    # stage timing swaps timed wrappers in for the pipeline functions.
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.cpu = None
+        self.last_snapshot = None
+        self.stage_timer = None
+
+    def path(self, name, suffix):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = file_stamp()
+        path = self.output_dir / f"{name}-{stamp}{suffix}"
+        count = 1
+        while path.exists():  # a clock step back can repeat a stamp
+            path = self.output_dir / f"{name}-{stamp}-{count}{suffix}"
+            count += 1
+        return path
+
+    def cpu_start(self):
+        # cProfile covers the calling thread, i.e. the fleet scheduler
+        if self.cpu is not None:
+            raise ValueError("CPU profile already running")
+        self.cpu = cProfile.Profile()
+        self.cpu.enable()
+        return []
+
+    def cpu_stop(self):
+        if self.cpu is None:
+            raise ValueError("CPU profile not running")
+        self.cpu.disable()
+        profile_file = self.path("cpu", ".prof")
+        self.cpu.dump_stats(profile_file)
+
+        text = io.StringIO()
+        pstats.Stats(self.cpu, stream=text).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+        summary_file = profile_file.with_suffix(".txt")
+        summary_file.write_text(text.getvalue())
+        self.cpu = None
+        return [str(profile_file), str(summary_file)]
+
+    def memory_start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.last_snapshot = None
+        return []
+
+    def memory_snapshot(self):
+        # Dumps a snapshot, plus the top differences against the previous one
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc not started")
+        snapshot = tracemalloc.take_snapshot()
+        snapshot_file = self.path("memory", ".tracemalloc")
+        snapshot.dump(str(snapshot_file))
+        files = [str(snapshot_file)]
+
+        if self.last_snapshot is not None:
+            diff = snapshot.compare_to(self.last_snapshot, "lineno")
+            diff_file = self.path("memory-diff", ".txt")
+            diff_file.write_text("\n".join(str(entry) for entry in diff[:TOP_ENTRIES]) + "\n")
+            files.append(str(diff_file))
+        else:
+            top_file = self.path("memory-top", ".txt")
+            top = snapshot.statistics("lineno")[:TOP_ENTRIES]
+            top_file.write_text("\n".join(str(entry) for entry in top) + "\n")
+            files.append(str(top_file))
+        self.last_snapshot = snapshot
+        return files
+
+    def memory_stop(self):
+        files = self.memory_snapshot() if tracemalloc.is_tracing() else []
+        tracemalloc.stop()
+        self.last_snapshot = None
+        return files
+
+    def stages_start(self):
+        if self.stage_timer is not None:
+            raise ValueError("Stage timing already running")
+        self.stage_timer = StageTimer()
+        return self.stage_timer
+
+    def stages_stop(self):
+        if self.stage_timer is None:
+            raise ValueError("Stage timing not running")
+        stages_file = self.path("stages", ".json")
+        with open(stages_file, 'w') as f:
+            json.dump(self.stage_timer.summary(), f, indent=2)
+        self.stage_timer = None
+        return [str(stages_file)]
@@ -0,0 +1,160 @@
+import time
+import threading
+from collections import deque
+import paho.mqtt.client as mqtt
+
+# Publish modes
+QOS0 = "qos0"                # fire-and-forget
+QOS1_WINDOW = "qos1-window"  # QoS 1, at most `window` messages awaiting PUBACK
+QOS1_WAIT = "qos1-wait"      # QoS 1, every publish waits for its PUBACK
+PUBLISH_MODES = (QOS0, QOS1_WINDOW, QOS1_WAIT)
+
+IN_FLIGHT_WINDOW = 100
+ACK_TIMEOUT = 5.0        # seconds, for QOS1_WAIT
+LATENCY_SAMPLES = 1024   # recent ack latencies kept for percentiles
+EARLY_ACK_TTL = 1.0      # seconds an ack for a mid not recorded yet is kept
+
+
+class Publisher:
+    # Wraps a paho client and tracks each MQTTMessageInfo until its PUBACK, so
+    # that the caller sees a full window instead of paho's queue growing silently
+    def __init__(self, client, mode=QOS1_WINDOW, window=IN_FLIGHT_WINDOW, ack_timeout=ACK_TIMEOUT, v5=None):
+        if mode not in PUBLISH_MODES:
+            raise ValueError(f"Unknown publish mode: {mode}")
+        self.client = client
+        self.v5 = v5  # mqtt5.V5Session when the client speaks MQTT 5
+        self.mode = mode
+        self.window = window
+        self.ack_timeout = ack_timeout
+        # Never held across client.publish(): paho calls on_publish with its
+        # own message lock held, so holding ours there would invert the order
+        self.lock = threading.Lock()
+        self.in_flight = {}   # mid -> monotonic send time
+        self.early_acks = {}  # mid -> ack time, for acks that beat publish() recording the mid
+        self.replies = set()  # mids of reply() messages not acknowledged yet
+        self.purged = time.monotonic()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self.errors = 0
+        self.max_latency = 0.0
+        client.on_publish = self.on_publish
+
+    def can_publish(self):
+        return self.mode == QOS0 or len(self.in_flight) < self.window
+
+    def publish(self, topic, payload, retain=False, force=False):
+        # Returns False when the reading was not handed to paho: the window is
+        # full (unless force) or the client refused it
+        if self.mode == QOS0:
+            info = self.send(topic, payload, 0, retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.errors += 1
+                return False
+            self.published += 1
+            return True
+
+        if not force and not self.can_publish():
+            self.rejected += 1
+            return False
+
+        sent = time.monotonic()
+        info = self.send(topic, payload, 1, retain)
+        # NO_CONN still queues QoS 1 messages for delivery after reconnect
+        if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            self.errors += 1
+            return False
+        with self.lock:
+            self.published += 1
+            acked = self.early_acks.pop(info.mid, None)
+            if acked is not None:
+                self.record_ack(acked - sent)
+            else:
+                self.in_flight[info.mid] = sent
+            if self.early_acks and sent - self.purged > EARLY_ACK_TTL:
+                self.purge(sent)
+
+        if self.mode == QOS1_WAIT:
+            try:
+                info.wait_for_publish(self.ack_timeout)
+            except RuntimeError:
+                # Not connected: paho keeps the message queued for after the
+                # reconnect, so it stays in flight without being waited for
+                pass
+        return True
+
+    def reply(self, topic, payload):
+        # QoS 0 answer sent on the same client, e.g. the "ok" to a device
+        # request; its mid is known, so its ack is not parked as an early one
+        info = self.client.publish(topic, payload)
+        if self.mode == QOS0:
+            return info
+        with self.lock:
+            if self.early_acks.pop(info.mid, None) is None:
+                self.replies.add(info.mid)
+        return info
+
+    def purge(self, now):
+        # Acks parked longer than EARLY_ACK_TTL belong to publishes made on the
+        # client directly; dropped before the mid counter can come round to them
+        self.early_acks = {mid: acked for mid, acked in self.early_acks.items() if now - acked <= EARLY_ACK_TTL}
+        self.purged = now
+
+    def drain(self, timeout=ACK_TIMEOUT):
+        # Waits up to `timeout` for the messages awaiting PUBACK, e.g. before
+        # stopping the network loop on shutdown; True when none are left
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.in_flight
+
+    def send(self, topic, payload, qos, retain):
+        if self.v5 is None:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)
+        with self.v5.lock:
+            topic, properties = self.v5.prepare(topic, retain)
+            return self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+
+    def on_publish(self, client, userdata, mid):
+        if self.mode == QOS0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            sent = self.in_flight.pop(mid, None)
+            if sent is not None:
+                self.record_ack(now - sent)
+            elif mid in self.replies:
+                self.replies.discard(mid)
+            else:
+                # Acked before publish() got to record the mid; reconciled there
+                self.early_acks[mid] = now
+
+    def record_ack(self, latency):
+        self.acked += 1
+        self.latencies.append(latency)
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        return {
+            "mode": self.mode,
+            "queueDepth": len(self.in_flight),
+            "window": self.window,
+            "published": self.published,
+            "acked": self.acked,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "ackLatencyMs": {
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": round(self.max_latency * 1000, 2),
+            },
+        }
@@ -0,0 +1,113 @@
+import time
+import heapq
+import random
+import threading
+
+# Defaults, overridable from the manifest "reconnect" section
+BACKOFF_BASE = 1.0         # seconds, shortest reconnect delay
+BACKOFF_CAP = 60.0         # seconds, longest reconnect delay
+RECONNECT_RATE = 50        # reconnect attempts per second, across the whole fleet
+RESUBSCRIBE_RATE = 2000    # topics resubscribed per second, across the whole fleet
+SESSION_EXPIRY = 3600      # seconds the broker keeps a persistent MQTT 5 session
+
+
+class DecorrelatedJitter:
+    # Exponential backoff with decorrelated jitter: each delay is drawn
+    # between the base and three times the previous one, so clients that
+    # lost the broker together drift apart instead of retrying in lockstep
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+        self.base = base
+        self.cap = cap
+        self.delay = base
+
+    def next_delay(self):
+        self.delay = min(self.cap, random.uniform(self.base, self.delay * 3))
+        return self.delay
+
+    def reset(self):
+        self.delay = self.base
+
+
+class RateLimiter:
+    # Hands out evenly spaced time slots; reserve() returns when the caller
+    # may go, which is never sooner than `earliest`. `count` reserves that
+    # many slots at once and returns the first.
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def reserve(self, earliest=None, count=1):
+        now = time.monotonic()
+        earliest = now if earliest is None else max(earliest, now)
+        with self.lock:
+            slot = max(earliest, self.next_slot)
+            self.next_slot = slot + self.interval * count
+        return slot
+
+
+class ReconnectManager:
+    # One thread that runs the fleet's reconnects and resubscribes at their
+    # scheduled times: reconnects after each connection's jittered backoff and
+    # no faster than the global reconnect rate, subscriptions in batches
+    # paced by the global resubscribe rate
+    def __init__(self, config=None):
+        config = config or {}
+        self.base = config.get("backoffBase", BACKOFF_BASE)
+        self.cap = config.get("backoffCap", BACKOFF_CAP)
+        self.reconnects = RateLimiter(config.get("rate", RECONNECT_RATE))
+        self.resubscribes = RateLimiter(config.get("resubscribeRate", RESUBSCRIBE_RATE))
+        self.backoff = {}  # key -> DecorrelatedJitter
+        self.jobs = []     # (due, sequence, fn)
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.attempts = 0
+        self.resubscribed = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def call_at(self, due, fn):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.jobs, (due, self.sequence, fn))
+            self.condition.notify()
+
+    def schedule_reconnect(self, key, reconnect):
+        backoff = self.backoff.setdefault(key, DecorrelatedJitter(self.base, self.cap))
+        due = self.reconnects.reserve(time.monotonic() + backoff.next_delay())
+        self.attempts += 1
+        self.call_at(due, reconnect)
+        return due
+
+    def connected(self, key):
+        backoff = self.backoff.get(key)
+        if backoff is not None:
+            backoff.reset()
+
+    def schedule_subscribe(self, subscribe, topics, batch):
+        # subscribe(list of topics) is called once per batch, each batch in
+        # its own slot of the global resubscribe rate
+        for i in range(0, len(topics), batch):
+            chunk = topics[i:i + batch]
+            due = self.resubscribes.reserve(count=len(chunk))
+            self.resubscribed += len(chunk)
+            self.call_at(due, lambda chunk=chunk: subscribe(chunk))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs or self.jobs[0][0] > time.monotonic():
+                    timeout = self.jobs[0][0] - time.monotonic() if self.jobs else None
+                    self.condition.wait(timeout)
+                _, _, fn = heapq.heappop(self.jobs)
+            try:
+                fn()
+            except Exception as e:
+                print(f"[Fleet] Reconnect job failed: {e}")
+
+    def stats(self):
+        return {"attempts": self.attempts, "resubscribed": self.resubscribed, "scheduled": len(self.jobs)}
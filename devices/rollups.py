@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+
+# Bucket widths in milliseconds. Buckets are aligned to the epoch, so "1d" is
+# the UTC calendar day (timestamps published by the sensors are UTC).
+ROLLUP_WINDOWS = {
+    "1m": 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+# Numeric fields aggregated when present in a reading
+ROLLUP_FIELDS = (
+    "consumption",
+    "production",
+    "flowRate",
+    "pressure",
+    "temperature",
+    "totalActivePower",
+)
+
+
+class FieldStats:
+    __slots__ = ("min", "max", "total", "count", "baseline", "last")
+
+    def __init__(self, baseline):
+        # baseline is the last value seen before the bucket opened, so that
+        # delta covers the full bucket for accumulators like consumption
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.count = 0
+        self.baseline = baseline
+        self.last = None
+
+    def add(self, value):
+        if self.count == 0:
+            self.min = self.max = value
+            if self.baseline is None:
+                self.baseline = value
+        else:
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+        self.total += value
+        self.count += 1
+        self.last = value
+
+    def to_dict(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 6),
+            "delta": round(self.last - self.baseline, 6),
+            "count": self.count,
+        }
+
+
+class RollingWindow:
+    def __init__(self, name, width_ms):
+        self.name = name
+        self.width_ms = width_ms
+        self.start = None
+        self.count = 0
+        self.fields = {}
+        self.last_values = {}
+
+    def add(self, timestamp, values):
+        # Returns the closed bucket when the reading falls into a new one
+        closed = None
+        start = timestamp - timestamp % self.width_ms
+        if start != self.start:
+            if self.start is not None:
+                closed = self.close()
+            self.start = start
+
+        for field, value in values.items():
+            stats = self.fields.get(field)
+            if stats is None:
+                stats = self.fields[field] = FieldStats(self.last_values.get(field))
+            stats.add(value)
+        self.count += 1
+        return closed
+
+    def close(self):
+        if self.count == 0:
+            return None
+        bucket = {
+            "window": self.name,
+            "start": self.start,
+            "end": self.start + self.width_ms,
+            "count": self.count,
+            "fields": {field: stats.to_dict() for field, stats in self.fields.items()},
+        }
+        self.last_values = {field: stats.last for field, stats in self.fields.items()}
+        self.fields = {}
+        self.count = 0
+        return bucket
+
+
+class RollupAggregator:
+    def __init__(self, device_id, device_type, windows=None, fields=ROLLUP_FIELDS):
+        self.device_id = device_id
+        self.device_type = device_type
+        self.fields = fields
+        self.windows = [
+            RollingWindow(name, width_ms)
+            for name, width_ms in (windows or ROLLUP_WINDOWS).items()
+        ]
+
+    def update(self, reading):
+        # Feed one reading, return the list of buckets it closed (usually empty)
+        timestamp = reading.get("timestamp")
+        if timestamp is None:
+            timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+        values = {}
+        for field in self.fields:
+            value = reading.get(field)
+            if isinstance(value, (int, float)):
+                values[field] = value
+
+        closed = []
+        for window in self.windows:
+            bucket = window.add(timestamp, values)
+            if bucket is not None:
+                closed.append(self.wrap(bucket))
+        return closed
+
+    def flush(self):
+        # Close the open buckets, e.g. on shutdown; they are marked partial
+        closed = []
+        for window in self.windows:
+            bucket = window.close()
+            if bucket is not None:
+                bucket["partial"] = True
+                closed.append(self.wrap(bucket))
+            window.start = None
+        return closed
+
+    def wrap(self, bucket):
+        bucket["deviceId"] = self.device_id
+        bucket["type"] = self.device_type
+        return bucket
@@ -0,0 +1,46 @@
+# Signal watched per device type to pick the next sampling interval
+SIGNALS = {
+    "energy": "totalActivePower",
+    "gas": "flowRate",
+    "solar": "powerOutput",
+    "water": "flowRate",
+}
+
+# (min, max) seconds between readings per device type
+INTERVAL_LIMITS = {
+    "energy": (5, 60),
+    "gas": (5, 60),
+    "solar": (5, 300),
+    "water": (5, 60),
+}
+
+CHANGE_THRESHOLD = 0.05  # relative change between readings that counts as "moving"
+BACKOFF = 2              # interval growth factor while the signal is flat
+
+
+class AdaptiveSampler:
+    # Picks the delay until a device's next reading: the minimum interval as
+    # soon as the signal moves, growing towards the maximum while it stays
+    # flat, and straight to the maximum while it is physically zero (solar at
+    # night, idle meters). Sensors integrate over the real elapsed time, so
+    # consumption stays correct whatever interval is chosen.
+    __slots__ = ("signal", "min_interval", "max_interval", "threshold", "interval", "last_value")
+
+    def __init__(self, device_type, limits=None, threshold=CHANGE_THRESHOLD):
+        self.signal = SIGNALS[device_type]
+        self.min_interval, self.max_interval = (limits or INTERVAL_LIMITS)[device_type]
+        self.threshold = threshold
+        self.interval = self.min_interval
+        self.last_value = None
+
+    def next_interval(self, data):
+        value = data.get(self.signal, 0.0)
+        last = self.last_value
+        if value == 0 and not last:
+            self.interval = self.max_interval
+        elif last is None or abs(value - last) > self.threshold * max(abs(last), abs(value)):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        self.last_value = value
+        return self.interval
@@ -0,0 +1,413 @@
+import json
+import math
+import time
+import random
+from pathlib import Path
+from datetime import datetime
+
+UPDATE_INTERVAL = 5  # seconds
+# Stamped on every published reading (see Sensor.stamp) and saved with the
+# state; not measurements
+SEQUENCE_FIELDS = ("seq", "bootId")
+
+# Topic layout per device type: water meters use the "device/" scheme with
+# cms/status request topics, the others use "sensor/" with request/respond.
+TOPIC_SCHEMES = {
+    "energy": ("sensor", "request", "respond"),
+    "gas": ("sensor", "request", "respond"),
+    "solar": ("sensor", "request", "respond"),
+    "water": ("device", "cms", "status"),
+}
+
+
+def device_topics(device_id, device_type, site=None):
+    # site: the device's site key. Its topics then sit under
+    # site/<site>/<type>/<deviceId>/, so a consumer covers a whole site
+    # (site/<site>/+/+/data) or type (site/+/<type>/+/data) with one wildcard.
+    if site is None:
+        prefix, request, response = TOPIC_SCHEMES[device_type]
+        base = f"{prefix}/{device_id}"
+    else:
+        request, response = "request", "response"
+        base = f"site/{site}/{device_type}/{device_id}"
+    return {
+        "data": f"{base}/data",
+        "request": f"{base}/{request}",
+        "response": f"{base}/{response}",
+        "rollup": f"{base}/rollup",
+        "meta": f"{base}/meta",
+        "events": f"{base}/events",
+    }
+
+
+def topic_device_id(topic):
+    # Device id of any topic built by device_topics
+    levels = topic.split("/")
+    return levels[3] if levels[0] == "site" else levels[1]
+
+
+def read_state(data_file):
+    # Saved sensor state, or None when missing or unreadable
+    if data_file is None or not Path(data_file).exists():
+        return None
+    try:
+        with open(data_file, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Error loading data file {data_file}: {e}")
+        return None
+
+
+class Sensor:
+    device_type = None
+    # Wall clock in epoch seconds; replaceable per sensor to generate history
+    # or run in time-warp
+    clock = staticmethod(time.time)
+
+    def __init__(self, device_id, data_file=None, update_interval=UPDATE_INTERVAL,
+                 start_from_zero=False, state=None):
+        # state is the already-parsed saved data; when omitted it is read from
+        # data_file, so a fleet can load every state up front without file I/O here
+        self.device_id = str(device_id)
+        self.data_file = Path(data_file) if data_file else None
+        self.update_interval = update_interval
+        self.data = self.initialize_data_structure()
+        if start_from_zero:
+            self.reset()
+            state = None
+        else:
+            if state is None:
+                state = read_state(self.data_file)
+            self.load_existing_data(state)
+        # The sequence continues from the saved state. A new bootId on every
+        # start keeps (bootId, seq) unique even when the state saved before a
+        # crash is behind what was published.
+        self.data["seq"] = state.get("seq", 0) if state else 0
+        self.data["bootId"] = self.now_ms()
+
+    def initialize_data_structure(self):
+        raise NotImplementedError
+
+    def now_ms(self):
+        return int(self.clock() * 1000)
+
+    def stamp(self, payload):
+        # Numbers a reading that is about to be published; readings held back
+        # by a deadband are not numbered, so consumers see gaps only for losses
+        self.data["seq"] += 1
+        payload["seq"] = self.data["seq"]
+        payload["bootId"] = self.data["bootId"]
+        return payload
+
+    def load_existing_data(self, existing_data):
+        if existing_data:
+            self.data["consumption"] = existing_data.get("consumption", 0.0)
+
+    def reset(self):
+        self.data["consumption"] = 0.0
+
+    @property
+    def total(self):
+        # Accumulated meter reading persisted across restarts
+        return self.data["consumption"]
+
+    def save_data(self):
+        try:
+            with open(self.data_file, 'w') as f:
+                json.dump(self.data, f, indent=2)
+        except IOError as e:
+            print(f"Error saving data: {e}")
+
+
+class TriphaseEnergySensor(Sensor):
+    device_type = "energy"
+
+    def __init__(self, device_id, **kwargs):
+        self.hardwareVersion = "1.5.0"
+        self.software_version = "1.0.0"
+        self.product_number = "ENERGY-SENSOR-0000"
+        self.manufacturer = "PowerTech Systems"
+        super().__init__(device_id, **kwargs)
+
+    def initialize_data_structure(self):
+        return {
+            "sensorId": self.device_id,
+            "type": "energy",
+            "systemType": "triphase",
+            "hardwareVersion": self.hardwareVersion,
+            "softwareVersion": self.software_version,
+            "productNumber": self.product_number,
+            "manufacturer": self.manufacturer,
+            "consumption": 0.0,
+            "totalActivePower": 0.0,
+            "totalReactivePower": 0.0,
+            "totalApparentPower": 0.0,
+            "totalCurrent": 0.0,
+            "phases": {
+                "L1": self.create_phase_template(),
+                "L2": self.create_phase_template(),
+                "L3": self.create_phase_template()
+            },
+            "frequency": 50.0,
+            "timestamp": self.now_ms()
+        }
+
+    def load_existing_data(self, existing_data):
+        if existing_data and 'consumption' in existing_data:
+            self.data['consumption'] = existing_data['consumption']
+        elif existing_data is None and self.data['consumption'] == 0.0:
+            # Default reading for a meter without saved data
+            self.data['consumption'] = 54.23
+
+    def create_phase_template(self):
+        return {
+            "voltage": 230.0,
+            "current": 5.0,
+            "powerFactor": 0.93,
+            "activePower": 0.0,
+            "reactivePower": 0.0,
+            "apparentPower": 0.0,
+        }
+
+    def generate_realistic_values(self, elapsed=None):
+        # elapsed: seconds since the previous reading, defaults to the update interval
+        dt = self.update_interval if elapsed is None else elapsed
+
+        total_active = 0.0
+        total_reactive = 0.0
+        total_apparent = 0.0
+        total_current = 0.0
+
+        for phase in ["L1", "L2", "L3"]:
+            p = self.data["phases"][phase]
+            p["voltage"] = round(230 + random.uniform(-2, 2), 1)
+            p["current"] = round(5 + random.uniform(-0.5, 0.5), 1)
+            p["powerFactor"] = round(0.92 + random.uniform(0, 0.05), 2)
+
+            p["activePower"] = round(p["voltage"] * p["current"] * p["powerFactor"], 1)
+            p["reactivePower"] = round(p["activePower"] * 0.33, 1)
+            p["apparentPower"] = round((p["activePower"] ** 2 + p["reactivePower"] ** 2) ** 0.5, 1)
+
+            total_active += p["activePower"]
+            total_reactive += p["reactivePower"]
+            total_apparent += p["apparentPower"]
+            total_current += p["current"]
+
+        # Consumption in kWh: total_active power (W) * seconds / 3600000 to convert Ws to kWh
+        self.data["consumption"] += round(total_active * dt / 3600000, 2)
+
+        self.data["totalActivePower"] = round(total_active, 1)
+        self.data["totalReactivePower"] = round(total_reactive, 1)
+        self.data["totalApparentPower"] = round(total_apparent, 1)
+        self.data["totalCurrent"] = round(total_current, 1)
+
+        # Update timestamp with 13-digit Unix timestamp (milliseconds)
+        self.data["timestamp"] = self.now_ms()
+
+        return self.data
+
+    generate_data = generate_realistic_values
+
+
+class GasUsageSensor(Sensor):
+    device_type = "gas"
+
+    def __init__(self, device_id, **kwargs):
+        self.hardwareVersion = "1.5.0"
+        self.software_version = "1.0.3"
+        self.product_number = "GAS-SENSOR-2222"
+        self.manufacturer = "GasTech Instruments"
+        super().__init__(device_id, **kwargs)
+
+    def initialize_data_structure(self):
+        return {
+            "sensorId": self.device_id,
+            "type": "gas",
+            "hardwareVersion": self.hardwareVersion,
+            "softwareVersion": self.software_version,
+            "productNumber": self.product_number,
+            "manufacturer": self.manufacturer,
+            "consumption": 0.0,
+            "flowRate": 0.0,       # m³/h
+            "pressure": 0.0,       # bar
+            "temperature": 0.0,    # °C
+            "timestamp": self.now_ms()
+        }
+
+    def generate_data(self, elapsed=None):
+        dt = self.update_interval if elapsed is None else elapsed
+
+        # Simulate temperature (°C)
+        self.data["temperature"] = round(random.uniform(18.0, 45.0), 1)
+
+        # Simulate flow rate (m³/h)
+        self.data["flowRate"] = round(random.uniform(0.15, 0.75), 2)
+
+        # Simulate pressure (bar), influenced by temperature
+        base_pressure = random.uniform(0.9, 1.7)
+        temp_adjustment = (self.data["temperature"] - 20) * 0.012
+        self.data["pressure"] = round(base_pressure + temp_adjustment, 2)
+
+        # Update consumption
+        self.data["consumption"] += round(self.data["flowRate"] * (dt / 3600), 4)
+
+        # Update timestamp to 13-digit Unix timestamp (ms)
+        self.data["timestamp"] = self.now_ms()
+        return self.data
+
+
+class SolarProductionSensor(Sensor):
+    device_type = "solar"
+
+    def __init__(self, device_id, **kwargs):
+        self.panel_area = 10.0  # m²
+        self.panel_efficiency = 0.18  # 18%
+        self.hardwareVersion = "1.5.0"
+        self.software_version = "1.2.0"
+        self.product_number = "SOL-PRO-1001"
+        self.manufacturer = "GreenTech Solar"
+        super().__init__(device_id, **kwargs)
+
+    def initialize_data_structure(self):
+        return {
+            "sensorId": self.device_id,
+            "type": "solar",
+            "hardwareVersion": self.hardwareVersion,
+            "softwareVersion": self.software_version,
+            "productNumber": self.product_number,
+            "manufacturer": self.manufacturer,
+            "production": 0.0,
+            "powerOutput": 0.0,
+            "irradiance": 0.0,
+            "panelTemperature": 0.0,
+            "timestamp": self.now_ms()
+        }
+
+    def load_existing_data(self, existing_data):
+        # Older saves only carried "totalProduction"
+        if existing_data:
+            self.data['production'] = existing_data.get(
+                'production', existing_data.get('totalProduction', 0.0))
+
+    def reset(self):
+        self.data['production'] = 0.0
+
+    @property
+    def total(self):
+        return self.data["production"]
+
+    def simulate_solar_irradiance(self, hour):
+        peak_irradiance = 1000  # W/m²
+        if 6 <= hour <= 18:
+            irradiance = peak_irradiance * math.exp(-0.5 * ((hour - 12) / 3.5) ** 2)
+            cloud_effect = random.uniform(0.7, 1.1)
+            irradiance *= cloud_effect
+        else:
+            irradiance = 0.0
+        return round(irradiance, 1)
+
+    def generate_data(self, elapsed=None):
+        dt = self.update_interval if elapsed is None else elapsed
+        now = datetime.fromtimestamp(self.clock())
+        current_hour = now.hour + now.minute / 60
+
+        # Irradiance simulation
+        irradiance = self.simulate_solar_irradiance(current_hour)
+        self.data["irradiance"] = irradiance
+
+        # Panel temperature
+        base_temp = 20 + (irradiance / 1000) * 25 + random.uniform(-2, 2)
+        self.data["panelTemperature"] = round(base_temp, 1)
+
+        # Efficiency loss
+        temp_loss = max(0, self.data["panelTemperature"] - 25) * 0.005
+        effective_efficiency = max(0.1, self.panel_efficiency * (1 - temp_loss))
+
+        # Power output
+        power = irradiance * self.panel_area * effective_efficiency
+        self.data["powerOutput"] = round(power, 1)
+
+        # Energy production in kWh
+        produced = round(power * dt / 3600000, 4)
+        self.data["production"] += produced
+
+        self.data["timestamp"] = self.now_ms()
+
+        return self.data
+
+
+class WaterUsageSensor(Sensor):
+    device_type = "water"
+
+    def __init__(self, device_id, **kwargs):
+        self.hardwareVersion = "1.5.0"
+        self.software_version = "1.0.0"
+        self.product_number = "WATER-SENSOR-1111"
+        self.manufacturer = "AquaTech Solutions"
+        super().__init__(device_id, **kwargs)
+
+    def initialize_data_structure(self):
+        return {
+            "deviceId": self.device_id,
+            "type": "water",
+            "hardwareVersion": self.hardwareVersion,
+            "softwareVersion": self.software_version,
+            "productNumber": self.product_number,
+            "manufacturer": self.manufacturer,
+            "consumption": 0.0,     # Total in cubic meters (m³)
+            "flowRate": 0.0,        # L/min
+            "pressure": 0.0,        # bar
+            "temperature": 0.0,     # °C
+            "timestamp": self.now_ms()   # 13-digit
+        }
+
+    def generate_data(self, elapsed=None):
+        dt = self.update_interval if elapsed is None else elapsed
+
+        # Simulate temperature (°C)
+        self.data["temperature"] = round(random.uniform(10.0, 35.0), 1)
+
+        # Simulate flow rate (L/min)
+        self.data["flowRate"] = round(random.uniform(1.5, 5.0), 2)
+
+        # Simulate pressure (bar)
+        base_pressure = random.uniform(2.0, 4.0)
+        temp_effect = (self.data["temperature"] - 20.0) * 0.015
+        self.data["pressure"] = round(base_pressure + temp_effect, 2)
+
+        # Update consumption (cubic meters) - convert from L/min to m³
+        consumption_increase = self.data["flowRate"] * (dt / 60) / 1000  # Convert L to m³
+        self.data["consumption"] += round(consumption_increase, 6)
+
+        # Update timestamp with 13-digit milliseconds
+        self.data["timestamp"] = self.now_ms()
+
+        # Return data in new MQTT format
+        return {
+            "deviceId": self.data["deviceId"],
+            "type": self.data["type"],
+            "value": self.data["consumption"],  # Main reading value
+            "unit": "m³",                       # Unit for the main value
+            "timestamp": self.data["timestamp"],  # 13-digit Unix timestamp
+
+            # Additional sensor data (optional)
+            "flowRate": self.data["flowRate"],
+            "pressure": self.data["pressure"],
+            "temperature": self.data["temperature"],
+            "hardwareVersion": self.data["hardwareVersion"],
+            "softwareVersion": self.data["softwareVersion"],
+            "productNumber": self.data["productNumber"],
+            "manufacturer": self.data["manufacturer"]
+        }
+
+
+SENSOR_TYPES = {
+    "energy": TriphaseEnergySensor,
+    "gas": GasUsageSensor,
+    "solar": SolarProductionSensor,
+    "water": WaterUsageSensor,
+}
+
+
+def create_sensor(device_type, device_id, **kwargs):
+    return SENSOR_TYPES[device_type](device_id, **kwargs)
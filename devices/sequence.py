@@ -0,0 +1,176 @@
+import time
+import random
+import argparse
+import tracemalloc
+
+from sensors import topic_device_id
+
+# Consumer side of the per-device sequence numbers (Sensor.stamp): a sliding
+# bitmap over the last WINDOW sequence numbers of each device tells a new
+# reading from a duplicate (QoS 1 redelivery) or a late one, and counts the
+# numbers that never arrived. A duplicate can be dropped before a bulk insert,
+# which makes the insert idempotent.
+WINDOW = 64  # readings behind a device's newest one that can still be placed
+
+# Verdicts
+NEW = "new"              # next in order, or ahead of it (the skipped ones count as missing)
+LATE = "late"            # arrived after a newer reading; fills a hole
+DUPLICATE = "duplicate"  # already seen
+STALE = "stale"          # too old for the window, or from an earlier boot
+UNSEQUENCED = "unsequenced"
+
+
+def payload_device_id(payload, topic=None):
+    device_id = payload.get("deviceId") or payload.get("sensorId")
+    if device_id is None:
+        if topic is None:
+            raise ValueError("Reading without deviceId/sensorId needs its topic")
+        device_id = topic_device_id(topic)
+    return str(device_id)
+
+
+class DeviceSequence:
+    __slots__ = ("boot", "top", "seen")
+
+    def __init__(self, boot, seq):
+        self.boot = boot
+        self.top = seq  # highest sequence number seen this boot
+        self.seen = 1   # bit i set: top - i was seen
+
+
+class SequenceTracker:
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.devices = {}  # deviceId -> DeviceSequence
+        self.counts = {NEW: 0, LATE: 0, DUPLICATE: 0, STALE: 0, UNSEQUENCED: 0}
+        self.missing = 0   # skipped numbers not (yet) filled by a late reading
+        self.restarts = 0
+        self.rewound = 0   # restarts that went back to a number already seen
+
+    def track(self, device_id, boot, seq):
+        verdict = self.place(device_id, boot, seq)
+        self.counts[verdict] += 1
+        return verdict
+
+    def place(self, device_id, boot, seq):
+        state = self.devices.get(device_id)
+        if state is None:
+            self.devices[device_id] = DeviceSequence(boot, seq)
+            return NEW
+        if boot != state.boot:
+            if boot < state.boot:
+                return STALE
+            # Restarted: the sequence went on from the last saved state, so it
+            # may skip ahead (readings lost with the old process) or go back
+            self.restarts += 1
+            if seq > state.top + 1:
+                self.missing += seq - state.top - 1
+            elif seq <= state.top:
+                self.rewound += 1
+            state.boot, state.top, state.seen = boot, seq, 1
+            return NEW
+        if seq > state.top:
+            shift = seq - state.top
+            self.missing += shift - 1
+            state.seen = (state.seen << shift | 1) & self.mask if shift < self.window else 1
+            state.top = seq
+            return NEW
+        offset = state.top - seq
+        if offset >= self.window:
+            return STALE
+        bit = 1 << offset
+        if state.seen & bit:
+            return DUPLICATE
+        state.seen |= bit
+        self.missing -= 1
+        return LATE
+
+    def track_payload(self, payload, device_id=None, topic=None):
+        # device_id or the topic it came in on: compact and stripped readings
+        # carry neither deviceId nor sensorId
+        seq = payload.get("seq")
+        if seq is None:
+            self.counts[UNSEQUENCED] += 1
+            return UNSEQUENCED
+        if device_id is None:
+            device_id = payload_device_id(payload, topic)
+        return self.track(str(device_id), payload.get("bootId", 0), seq)
+
+    def split(self, payloads, topics=None):
+        # -> (readings to insert, duplicates), for bulk inserts; topics: the
+        # topic of each payload, needed for compact readings
+        keep, duplicates = [], []
+        for i, payload in enumerate(payloads):
+            verdict = self.track_payload(payload, topic=topics[i] if topics is not None else None)
+            (duplicates if verdict == DUPLICATE else keep).append(payload)
+        return keep, duplicates
+
+    def stats(self):
+        received = sum(self.counts[verdict] for verdict in (NEW, LATE, DUPLICATE, STALE))
+        expected = received - self.counts[DUPLICATE] - self.counts[STALE] + self.missing
+        return {
+            "devices": len(self.devices),
+            **self.counts,
+            "missing": self.missing,
+            "lossRate": round(self.missing / expected, 6) if expected else 0.0,
+            "restarts": self.restarts,
+            "rewound": self.rewound,
+        }
+
+
+def benchmark(devices, readings, loss, duplicates, reorder):
+    # Every device sends `readings` numbered readings; the stream loses,
+    # repeats and swaps some of them, and the tracker has to find them again
+    random.seed(1)
+    stream = []
+    lost = repeated = swapped = 0
+    for seq in range(1, readings + 1):
+        for device in range(devices):
+            if random.random() < loss:
+                # A device's first and last readings can not be missed by a
+                # consumer that has seen nothing before or after them
+                lost += 1 < seq < readings
+                continue
+            stream.append((device, seq))
+            if random.random() < duplicates:
+                stream.append((device, seq))
+                repeated += 1
+    for i in range(len(stream) - 1):
+        # Swaps with a reading up to `devices` positions later, i.e. about one
+        # reading of the same device
+        if random.random() < reorder:
+            j = min(len(stream) - 1, i + random.randint(1, devices))
+            stream[i], stream[j] = stream[j], stream[i]
+            swapped += 1
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracker = SequenceTracker()
+    track = tracker.track
+    started = time.perf_counter()
+    for device, seq in stream:
+        track(device, 1, seq)
+    elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "injected": {"lostDetectable": lost, "duplicated": repeated, "swaps": swapped},
+        "found": tracker.stats(),
+        "readingsPerSecond": round(len(stream) / elapsed),
+        "bytesPerDevice": round(memory / devices),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-device gap/duplicate tracker")
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--readings", type=int, default=20, help="readings per device")
+    parser.add_argument("--loss", type=float, default=0.001)
+    parser.add_argument("--duplicates", type=float, default=0.01)
+    parser.add_argument("--reorder", type=float, default=0.01)
+    args = parser.parse_args()
+
+    result = benchmark(args.devices, args.readings, args.loss, args.duplicates, args.reorder)
+    for key, value in result.items():
+        print(f"[Sequence] {key}: {value}")
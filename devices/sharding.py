@@ -0,0 +1,162 @@
+import json
+import time
+import bisect
+import socket
+import hashlib
+import argparse
+
+VIRTUAL_NODES = 160     # ring points per broker; more points, more even spread
+FAILURE_THRESHOLD = 1   # consecutive connect failures/losses before a broker is skipped
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    # Consistent hashing of device ids onto brokers: adding or removing one of
+    # N brokers moves only about 1/N of the devices
+    def __init__(self, nodes, virtual_nodes=VIRTUAL_NODES):
+        self.nodes = list(nodes)
+        points = sorted((ring_hash(f"{node}#{i}"), index)
+                        for index, node in enumerate(self.nodes) for i in range(virtual_nodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [index for _, index in points]
+
+    def preference(self, key):
+        # Node indices in ring order from the key's position: the owner first,
+        # then the nodes its devices fail over to
+        start = bisect.bisect(self.hashes, ring_hash(key))
+        order = []
+        for i in range(len(self.owners)):
+            owner = self.owners[(start + i) % len(self.owners)]
+            if owner not in order:
+                order.append(owner)
+                if len(order) == len(self.nodes):
+                    break
+        return tuple(order)
+
+
+class BrokerHealth:
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0        # consecutive
+        self.total_failures = 0
+        self.connected = False
+
+    @property
+    def available(self):
+        return self.failures < FAILURE_THRESHOLD
+
+    def up(self):
+        # -> True when this brings a skipped broker back
+        recovered = not self.available
+        self.failures = 0
+        self.connected = True
+        return recovered
+
+    def down(self):
+        # -> True when this makes the broker skipped
+        was_available = self.available
+        self.failures += 1
+        self.total_failures += 1
+        self.connected = False
+        return was_available and not self.available
+
+
+def parse_brokers(manifest, default_host, default_port):
+    # "brokers": [{"host": ..., "port": ...}, ...], falling back to the single "broker"
+    brokers = manifest.get("brokers") or [manifest.get("broker", {})]
+    return [(broker.get("host", default_host), broker.get("port", default_port)) for broker in brokers]
+
+
+def moved_fraction(devices, brokers):
+    # Share of devices whose owner changes when one broker joins the ring
+    before = HashRing([f"broker-{i}" for i in range(brokers)])
+    after = HashRing([f"broker-{i}" for i in range(brokers + 1)])
+    moved = sum(before.preference(str(i))[0] != after.preference(str(i))[0] for i in range(devices))
+    return moved / devices
+
+
+def check_failover(devices, brokers, readings):
+    # Publishes through several local broker stand-ins, one QoS 0 connection
+    # each, and stops one broker halfway; its devices fail over to the next
+    # ring node
+    from mock_broker import MockBroker
+    from mqtt_packets import encode_connect, encode_publish
+
+    stand_ins = [MockBroker(port=0).start_in_thread() for _ in range(brokers)]
+    names = [f"127.0.0.1:{broker.port}" for broker in stand_ins]
+    ring = HashRing(names)
+    health = [BrokerHealth(name) for name in names]
+    preferences = [ring.preference(str(i)) for i in range(devices)]
+    sockets = [None] * brokers
+    failovers = 0
+
+    def connection(index):
+        if sockets[index] is None:
+            try:
+                sock = socket.create_connection(("127.0.0.1", stand_ins[index].port), timeout=1)
+                sock.sendall(encode_connect(f"shard-{index}"))
+                sock.recv(4)
+            except OSError:
+                health[index].down()
+                return None
+            health[index].up()
+            sockets[index] = sock
+        return sockets[index]
+
+    def publish(device):
+        nonlocal failovers
+        for position, index in enumerate(preferences[device]):
+            if not health[index].available and position + 1 < brokers:
+                continue
+            sock = connection(index)
+            if sock is None:
+                continue
+            try:
+                sock.sendall(encode_publish(f"sensor/{device}/data", b"{}"))
+            except OSError:
+                health[index].down()
+                sockets[index] = None
+                continue
+            failovers += position > 0
+            return True
+        return False
+
+    stopped = stand_ins[0]
+    lost = 0
+    try:
+        for reading in range(readings):
+            if reading == readings // 2:
+                stopped.stop_in_thread()
+                time.sleep(0.1)
+            for device in range(devices):
+                lost += not publish(device)
+        time.sleep(0.5)
+    finally:
+        for sock in sockets:
+            if sock is not None:
+                sock.close()
+        for broker in stand_ins[1:]:
+            broker.stop_in_thread()
+
+    return {
+        "published": {name: broker.publishes for name, broker in zip(names, stand_ins)},
+        "owned": {name: sum(p[0] == i for p in preferences) for i, name in enumerate(names)},
+        "failovers": failovers,
+        "lost": lost,
+        "failures": {h.name: h.total_failures for h in health},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consistent-hash sharding checks against local broker stand-ins")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--brokers", type=int, default=3)
+    parser.add_argument("--readings", type=int, default=4, help="readings per device, one broker stops halfway")
+    args = parser.parse_args()
+
+    print(f"[Shard] adding a broker to {args.brokers} moves {moved_fraction(args.devices, args.brokers):.1%} "
+          f"of devices (ideal {1 / (args.brokers + 1):.1%})")
+    print(f"[Shard] {json.dumps(check_failover(args.devices, args.brokers, args.readings))}")
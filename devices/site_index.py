@@ -0,0 +1,116 @@
+import json
+import argparse
+from datetime import datetime, timezone
+import paho.mqtt.client as mqtt
+
+from sequence import SequenceTracker, NEW, UNSEQUENCED, payload_device_id
+from topology import load_topology, device_sites, site_key, TOPOLOGY_FILE
+
+# Configuration
+MQTT_BROKER = "broker.hivemq.com"
+MQTT_PORT = 1883
+DATA_TOPICS = ["sensor/+/data", "device/+/data", "site/+/+/+/data"]
+INDEX_TOPIC = "site/{site}/{type}/index"
+
+# Meter reading used for the index, in order of preference. Water publishes
+# its consumption as "value".
+INDEX_FIELDS = ("consumption", "production", "value")
+
+
+def reading_value(payload):
+    for field in INDEX_FIELDS:
+        value = payload.get(field)
+        if isinstance(value, (int, float)):
+            return value
+    return None
+
+
+class SiteIndex:
+    def __init__(self, sites):
+        self.members = device_sites(sites)  # deviceId -> (site, type)
+        self.latest = {}                    # deviceId -> last meter reading
+        self.totals = {}                    # (site, type) -> sum of latest readings
+        self.counts = {}                    # (site, type) -> devices reporting
+        self.sequences = SequenceTracker()
+
+    def update(self, device_id, value):
+        # O(1): swap the device's previous reading for the new one in its total.
+        # Returns the (site, type) key when the total changed, else None.
+        member = self.members.get(device_id)
+        if member is None:
+            return None
+        previous = self.latest.get(device_id)
+        if previous == value:
+            return None
+
+        self.latest[device_id] = value
+        if previous is None:
+            self.counts[member] = self.counts.get(member, 0) + 1
+            previous = 0.0
+        self.totals[member] = self.totals.get(member, 0.0) + value - previous
+        return member
+
+    def snapshot(self, member):
+        site, device_type = member
+        return {
+            "site": site,
+            "type": device_type,
+            "totalIndex": round(self.totals[member], 6),
+            "devices": self.counts[member],
+            "timestamp": int(datetime.now(timezone.utc).timestamp() * 1000),
+        }
+
+
+def on_connect(client, userdata, flags, rc):
+    print(f"[Index] Connected with result code {rc}")
+    for topic in DATA_TOPICS:
+        client.subscribe(topic)
+
+
+def on_message(client, userdata, msg):
+    index = userdata
+    try:
+        payload = json.loads(msg.payload)
+    except ValueError:
+        return
+    if not isinstance(payload, dict):
+        return
+
+    device_id = payload_device_id(payload, msg.topic)
+    value = reading_value(payload)
+    if value is None:
+        return
+    if index.sequences.track_payload(payload, device_id) not in (NEW, UNSEQUENCED):
+        # A redelivery, or older than a reading already counted
+        return
+
+    member = index.update(device_id, value)
+    if member is not None:
+        site, device_type = member
+        topic = INDEX_TOPIC.format(site=site_key(site), type=device_type)
+        client.publish(topic, json.dumps(index.snapshot(member)), qos=1, retain=True)
+
+
+def run_site_index(topology_file):
+    index = SiteIndex(load_topology(topology_file))
+    print(f"[Index] Tracking {len(index.members)} devices from {topology_file}")
+
+    client = mqtt.Client(userdata=index)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        client.disconnect()
+        print("[Index] Stopped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish retained per-site index totals")
+    parser.add_argument("--topology", default=str(TOPOLOGY_FILE))
+    args = parser.parse_args()
+
+    print("Starting site index...")
+    run_site_index(args.topology)
@@ -0,0 +1,293 @@
+import gc
+import sys
+import json
+import time
+import heapq
+import argparse
+import resource
+import tracemalloc
+from datetime import datetime
+from fractions import Fraction
+from pathlib import Path
+
+from fleet import Fleet, MANIFEST_FILE, generate_specs, load_manifest, parse_generate
+from mock_broker import WarpClock
+from publisher import QOS1_WINDOW
+from rollups import ROLLUP_WINDOWS
+
+# Soak mode: the fleet's publish path (Fleet.tick, dry run) for weeks of
+# simulated time in minutes. Nothing sleeps: the clock jumps to the next
+# scheduled reading. Every sample interval (simulated time) it records RSS,
+# traced Python memory and its top allocators, GC counters, the wall time of
+# the ticks since the previous sample, and how far each meter total has
+# drifted from an exact sum of the same increments. At the end every series
+# is fitted with a line; a metric that grows beyond its threshold over the
+# run fails the soak with a trend report.
+DEVICES_DIR = Path(__file__).parent.resolve()
+REPORT_DIR = DEVICES_DIR / "reports"
+DAY = 86400
+SAMPLE_INTERVAL = 6 * 3600  # simulated seconds between samples
+# Samples left out of the trends: the first 20% of the run, and at least the
+# longest rollup window, whose open buckets fill up once per device
+WARMUP = 0.2
+WARMUP_MIN = max(ROLLUP_WINDOWS.values()) / 1000
+TOP_ALLOCATORS = 10
+# Decimals each sensor rounds its per-reading increment to (sensors.py); the
+# exact reference counts increments in these units as integers
+DECIMALS = {"energy": 2, "gas": 4, "solar": 4, "water": 6}
+# metric -> (kind, limit, floor). "growth": fitted growth over the run
+# relative to the fitted start value, tolerated while the fitted change is
+# below floor (noise on a small base); "max": largest value seen
+THRESHOLDS = {
+    "rssBytes": ("growth", 0.10, 4 * 2**20),
+    "tracedBytes": ("growth", 0.10, 2**20),
+    "gcObjects": ("growth", 0.10, 10000),
+    "tickP50Us": ("growth", 0.50, 20.0),
+    "tickP99Us": ("growth", 1.00, 200.0),
+    "driftUnits": ("max", 0.01, None),  # of the last published decimal
+}
+
+
+def rss_bytes():
+    # Current resident set size; ru_maxrss (a peak, in KiB) where there is no /proc
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+def fit(points):
+    # Least-squares line through [(x, y)] -> (intercept, slope)
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else 0.0
+    return mean_y - slope * mean_x, slope
+
+
+class Accumulators:
+    # Meter total of each device next to an exact integer count of the same
+    # increments. Wraps Fleet.generate, like the stage timers do.
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.reference = {}  # id(sensor) -> [units per 1, exact total in units]
+        for device in fleet.devices:
+            scale = 10 ** DECIMALS[device.type]
+            self.reference[id(device.sensor)] = [scale, round(device.sensor.total * scale)]
+        self.generate = fleet.generate
+        fleet.generate = self.wrap
+
+    def wrap(self, sensor, elapsed):
+        before = sensor.total
+        payload = self.generate(sensor, elapsed)
+        reference = self.reference[id(sensor)]
+        # The increment was rounded to 1/scale before it was added, so the
+        # float difference rounds back to the exact number of units
+        reference[1] += round((sensor.total - before) * reference[0])
+        return payload
+
+    def drift(self):
+        # Largest |total - exact total| in units of the last decimal
+        worst = 0.0
+        for device in self.fleet.devices:
+            scale, units = self.reference[id(device.sensor)]
+            worst = max(worst, abs(float(Fraction(device.sensor.total) * scale - units)))
+        return worst
+
+
+class Soak:
+    def __init__(self, fleet, days, sample_interval, trace=True):
+        self.fleet = fleet
+        self.duration = days * DAY
+        self.sample_interval = sample_interval
+        self.trace = trace
+        self.warmup = min(max(self.duration * WARMUP, WARMUP_MIN), self.duration / 2)
+        # Every sensor reads the same warped clock, as epoch seconds
+        self.clock = WarpClock()
+        wall = time.time() - time.monotonic()
+        for device in fleet.devices:
+            device.sensor.clock = lambda: wall + self.clock()
+        self.accumulators = Accumulators(fleet)
+        self.samples = []
+        self.first_snapshot = None
+        self.last_snapshot = None
+
+    def sample(self, simulated, ticks):
+        ticks.sort()
+        gc_stats = gc.get_stats()
+        sample = {
+            "day": round(simulated / DAY, 3),
+            "readings": self.fleet.messages,
+            "rssBytes": rss_bytes(),
+            "tracedBytes": tracemalloc.get_traced_memory()[0] if self.trace else None,
+            "gcObjects": len(gc.get_objects()),
+            "gcCollections": [generation["collections"] for generation in gc_stats],
+            "gcCollected": sum(generation["collected"] for generation in gc_stats),
+            "tickP50Us": round(percentile(ticks, 0.5) * 1e6, 2),
+            "tickP99Us": round(percentile(ticks, 0.99) * 1e6, 2),
+            "driftUnits": self.accumulators.drift(),
+        }
+        # One snapshot after warmup and one at the end; a snapshot is itself
+        # traced memory, so none is taken or kept between the two
+        if self.trace and self.first_snapshot is None and simulated >= self.warmup:
+            self.first_snapshot = self.snapshot()
+        self.samples.append(sample)
+        print(f"[Soak] day {sample['day']:7.2f} | {sample['readings']} readings | "
+              f"rss {sample['rssBytes'] / 1e6:.1f} MB | traced {(sample['tracedBytes'] or 0) / 1e6:.1f} MB | "
+              f"{sample['gcObjects']} objects | tick p50 {sample['tickP50Us']} us p99 {sample['tickP99Us']} us | "
+              f"drift {sample['driftUnits']:.2e} units")
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    def run(self):
+        fleet = self.fleet
+        if self.trace:
+            tracemalloc.start()
+        start = self.clock()
+        count = len(fleet.devices)
+        heap = [(start + fleet.interval * i / count, i, 0) for i in range(count)]
+        heapq.heapify(heap)
+        # Every (null) connection up front, past the connect rate limit
+        publishers = []
+        for slot in range(len(fleet.pool.clients)):
+            fleet.pool.next_connect = 0.0
+            publishers.append(fleet.pool.publisher_for(slot))
+        end = start + self.duration
+        next_sample = start
+        ticks = []
+        started = time.perf_counter()
+        while heap[0][0] < end:
+            due, index, generation = heap[0]
+            now = self.clock()
+            if due > now:
+                self.clock.advance(due - now)
+                now = due
+            if now >= next_sample:
+                self.sample(now - start, ticks)
+                ticks = []
+                next_sample += self.sample_interval
+                if next_sample >= end:
+                    next_sample = float("inf")  # the last sample is taken after the loop
+            tick_started = time.perf_counter()
+            delay = fleet.tick(publishers[fleet.devices[index].slot], index, now)
+            ticks.append(time.perf_counter() - tick_started)
+            heapq.heapreplace(heap, (due + delay, index, generation))
+        self.sample(self.duration, ticks)
+        elapsed = time.perf_counter() - started
+        if self.trace:
+            self.last_snapshot = self.snapshot()
+            tracemalloc.stop()
+        fleet.pool.close()
+        fleet.log.close()
+        return elapsed
+
+    def report(self, elapsed):
+        # -> (passed, report)
+        measured = [sample for sample in self.samples if sample["day"] * DAY >= self.warmup]
+        trends = {}
+        for metric, (kind, limit, floor) in THRESHOLDS.items():
+            points = [(sample["day"], sample[metric]) for sample in measured if sample[metric] is not None]
+            if len(points) < 2:
+                continue
+            intercept, slope = fit(points)
+            span = points[-1][0] - points[0][0]
+            start = intercept + slope * points[0][0]
+            if kind == "growth":
+                change = slope * span
+                value = change / abs(start) if start else 0.0
+                passed = value <= limit or change <= floor
+            else:
+                value = max(y for _, y in points)
+                passed = value <= limit
+            trends[metric] = {
+                "first": points[0][1],
+                "last": points[-1][1],
+                "slopePerDay": slope,
+                kind: value,
+                "limit": limit,
+                "passed": passed,
+            }
+        allocators = []
+        if self.first_snapshot is not None:
+            for stat in self.last_snapshot.compare_to(self.first_snapshot, "lineno")[:TOP_ALLOCATORS]:
+                frame = stat.traceback[0]
+                allocators.append({"where": f"{frame.filename}:{frame.lineno}", "sizeDiff": stat.size_diff,
+                                   "size": stat.size, "countDiff": stat.count_diff})
+        passed = all(trend["passed"] for trend in trends.values())
+        report = {
+            "devices": len(self.fleet.devices),
+            "simulatedDays": self.duration / DAY,
+            "wallSeconds": round(elapsed, 1),
+            "readings": self.fleet.messages,
+            "passed": passed,
+            "trends": trends,
+            "allocatorGrowth": allocators,
+            "samples": self.samples,
+        }
+        return passed, report
+
+
+def print_report(report):
+    print(f"[Soak] {report['devices']} devices, {report['simulatedDays']:g} simulated days in "
+          f"{report['wallSeconds']} s, {report['readings']} readings")
+    print(f"[Soak] {'METRIC':<12} {'FIRST':>14} {'LAST':>14} {'PER DAY':>12} {'TREND':>10} {'LIMIT':>8}")
+    for metric, trend in report["trends"].items():
+        kind = "growth" if "growth" in trend else "max"
+        value = f"{trend[kind]:+.1%}" if kind == "growth" else f"{trend[kind]:.2e}"
+        limit = f"{trend['limit']:.0%}" if kind == "growth" else f"{trend['limit']:g}"
+        print(f"[Soak] {metric:<12} {trend['first']:>14.6g} {trend['last']:>14.6g} {trend['slopePerDay']:>12.4g} "
+              f"{value:>10} {limit:>8}" + ("" if trend["passed"] else "  FAIL"))
+    if report["allocatorGrowth"]:
+        print("[Soak] Top allocator growth after warmup:")
+        for allocator in report["allocatorGrowth"]:
+            print(f"[Soak]   {allocator['sizeDiff']:+10d} B {allocator['countDiff']:+8d} blocks  {allocator['where']}")
+    print(f"[Soak] {'PASSED' if report['passed'] else 'FAILED: metrics trending beyond their thresholds'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the fleet for weeks of simulated time and check for drift")
+    parser.add_argument("--manifest", default=str(MANIFEST_FILE))
+    parser.add_argument("--generate", action="append", type=parse_generate, default=[],
+                        metavar="TYPE:COUNT", help="add COUNT generated devices of TYPE")
+    parser.add_argument("--days", type=float, default=28.0, help="simulated days")
+    parser.add_argument("--interval", type=float, help="seconds between a device's readings (default: the manifest's)")
+    parser.add_argument("--sample-every", type=float, default=SAMPLE_INTERVAL / 3600, metavar="HOURS",
+                        help="simulated hours between samples")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="skip traced memory and allocators (tracing slows every tick)")
+    parser.add_argument("--report", help="JSON report file (default: reports/soak-<time>.json)")
+    args = parser.parse_args()
+
+    manifest, specs = load_manifest(args.manifest)
+    for device_type, count in args.generate:
+        specs.extend(generate_specs(device_type, count, prefix=f"{device_type}-"))
+    # Dry run from fresh sensors; no snapshot, status table, broker or log summaries
+    manifest.update({"snapshot": None, "status": {"enabled": False}, "publishMode": QOS1_WINDOW,
+                     "logging": {**(manifest.get("logging") or {}), "summaryInterval": 0}})
+    if args.interval:
+        manifest["updateInterval"] = args.interval
+    fleet = Fleet(manifest, specs, {}, dry_run=True)
+    print(f"[Soak] {len(specs)} devices for {args.days:g} simulated days, "
+          f"a sample every {args.sample_every:g} simulated hours")
+
+    soak = Soak(fleet, args.days, args.sample_every * 3600, not args.no_tracemalloc)
+    passed, report = soak.report(soak.run())
+    print_report(report)
+
+    report_file = Path(args.report) if args.report else \
+        REPORT_DIR / f"soak-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    report_file.parent.mkdir(exist_ok=True)
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[Soak] Report written to {report_file}")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,217 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import fnmatch
+import argparse
+import tempfile
+from pathlib import Path
+
+# Live per-device status of a running fleet in a fixed-layout table in shared
+# memory: the fleet overwrites a device's row in place as it publishes, a
+# viewer maps the same file read-only. Nothing goes over a pipe or socket and
+# the fleet never waits for a reader.
+STATUS_DIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+STATUS_PATTERN = "iot-fleet-*.status"
+MAGIC = b"IOTSTAT1"
+HEADER = struct.Struct("<8sIIId")  # magic, capacity, record size, writer pid, start time
+HEADER_SIZE = 64
+# One row per fleet device index. begin/end are the same counter, written
+# before and after the fields; a reader that sees them differ caught the row
+# mid-update and reads it again.
+RECORD = struct.Struct("<IBB2x24sddQQddI4x")
+ID_SIZE = 24
+TYPES = ("energy", "gas", "solar", "water")
+TYPE_CODES = {device_type: code for code, device_type in enumerate(TYPES, 1)}
+ACTIVE, PAUSED = 1, 2
+SORT_KEYS = ("rate", "lag", "errors", "count", "age", "value", "id")
+REFRESH = 2.0  # seconds between viewer screens
+
+
+def default_path():
+    return STATUS_DIR / f"iot-fleet-{os.getpid()}.status"
+
+
+class StatusTable:
+    # Writer side. A row is written with one pack_into of a precompiled Struct
+    # straight into the mapping, which fills it front to back: begin first,
+    # end last. A row past the end doubles the table: the file is extended and
+    # remapped, and the header's capacity is only raised once the rows exist.
+    def __init__(self, path=None, capacity=1024):
+        self.path = Path(path) if path else default_path()
+        self.capacity = capacity
+        self.versions = [0] * capacity
+        size = HEADER_SIZE + capacity * RECORD.size
+        with open(self.path, 'w+b') as f:
+            f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, capacity, RECORD.size, os.getpid(), time.time())
+
+    def grow(self, row):
+        capacity = self.capacity
+        while capacity <= row:
+            capacity *= 2
+        size = HEADER_SIZE + capacity * RECORD.size
+        self.map.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size)
+        self.versions.extend([0] * (capacity - self.capacity))
+        self.capacity = capacity
+        struct.pack_into("<I", self.map, len(MAGIC), capacity)  # capacity follows the magic
+        print(f"[Fleet] Status table grown to {capacity} rows")
+
+    def update(self, row, device, lag):
+        if row >= self.capacity:
+            self.grow(row)
+        version = self.versions[row] + 1
+        self.versions[row] = version
+        offset = HEADER_SIZE + row * RECORD.size
+        RECORD.pack_into(self.map, offset, version, TYPE_CODES.get(device.type, 0),
+                         PAUSED if device.paused else ACTIVE, device.device_id.encode()[:ID_SIZE],
+                         device.sensor.total, device.last_publish, device.messages, device.errors,
+                         lag, device.interval, version)
+
+    def clear(self, row):
+        if row < self.capacity:
+            self.versions[row] += 1
+            offset = HEADER_SIZE + row * RECORD.size
+            self.map[offset:offset + RECORD.size] = bytes(RECORD.size)
+
+    def close(self):
+        self.map.close()
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+
+def read_table(path):
+    # -> (writer pid, [row dicts]) from a consistent copy of every live row
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, capacity, record_size, pid, started = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a status table of this version")
+        # The writer may have grown the table since this mapping was made
+        capacity = min(capacity, (len(mapped) - HEADER_SIZE) // RECORD.size)
+        data = mapped[HEADER_SIZE:HEADER_SIZE + capacity * RECORD.size]
+        rows = []
+        for row, fields in enumerate(RECORD.iter_unpack(data)):
+            for _ in range(10):
+                if fields[0] == fields[-1]:
+                    break
+                fields = RECORD.unpack_from(mapped, HEADER_SIZE + row * RECORD.size)
+            else:
+                continue  # busy row; shown on the next screen
+            begin, type_code, state, device_id, value, published, count, errors, lag, interval, _ = fields
+            if not state:
+                continue
+            rows.append({
+                "deviceId": device_id.rstrip(b"\0").decode(),
+                "type": TYPES[type_code - 1] if type_code else "?",
+                "paused": state == PAUSED,
+                "value": value,
+                "published": published,
+                "count": count,
+                "errors": errors,
+                "lag": lag,
+                "interval": interval,
+            })
+        return pid, rows
+    finally:
+        mapped.close()
+
+
+def read_tables(paths):
+    # Rows of every table whose writer is still alive, keyed by (pid, deviceId)
+    result = {}
+    for path in paths:
+        try:
+            pid, rows = read_table(path)
+            os.kill(pid, 0)  # left behind by a fleet that did not exit cleanly
+        except (OSError, ValueError):
+            continue
+        for row in rows:
+            result[(pid, row["deviceId"])] = row
+    return result
+
+
+def table_paths(paths):
+    return [Path(p) for p in paths] if paths else sorted(STATUS_DIR.glob(STATUS_PATTERN))
+
+
+def view(rows, previous, elapsed, sort, limit, device_type=None, pattern=None):
+    # -> screen lines; rates from the count change since the previous screen
+    now = time.time()
+    shown = []
+    for key, row in rows.items():
+        if device_type and row["type"] != device_type:
+            continue
+        if pattern and not fnmatch.fnmatchcase(row["deviceId"], pattern):
+            continue
+        before = previous.get(key)
+        row["rate"] = (row["count"] - before["count"]) / elapsed if before and elapsed else 0.0
+        row["age"] = now - row["published"] if row["published"] else float("inf")
+        shown.append(row)
+    if sort == "id":
+        shown.sort(key=lambda row: row["deviceId"])
+    else:
+        shown.sort(key=lambda row: row[sort], reverse=sort != "age")
+
+    rate = sum(row["rate"] for row in shown)
+    errors = sum(row["errors"] for row in shown)
+    lines = [
+        f"{time.strftime('%H:%M:%S')}  {len(shown)} devices ({sum(row['paused'] for row in shown)} paused) | "
+        f"{rate:.1f} msg/s | {errors} errors | "
+        f"max lag {max((row['lag'] for row in shown), default=0.0) * 1000:.1f} ms",
+        "",
+        f"{'DEVICE':<24} {'TYPE':<7} {'VALUE':>14} {'AGE s':>8} {'COUNT':>9} {'MSG/S':>7} "
+        f"{'ERR':>6} {'LAG ms':>8} {'EVERY s':>8}",
+    ]
+    for row in shown[:limit]:
+        age = f"{row['age']:.1f}" if row["age"] != float("inf") else "-"
+        lines.append(f"{row['deviceId']:<24} {row['type']:<7} {row['value']:>14.4f} {age:>8} "
+                     f"{row['count']:>9} {row['rate']:>7.2f} {row['errors']:>6} {row['lag'] * 1000:>8.1f} "
+                     f"{row['interval']:>8.1f}" + (" paused" if row["paused"] else ""))
+    return lines
+
+
+def run_viewer(paths, sort, limit, device_type, pattern, refresh, once):
+    previous = {}
+    previous_at = None
+    try:
+        while True:
+            paths_now = table_paths(paths)
+            rows = read_tables(paths_now)
+            now = time.monotonic()
+            lines = view(rows, previous, now - previous_at if previous_at else 0.0, sort, limit,
+                         device_type, pattern)
+            if not paths_now:
+                lines.insert(0, f"No status tables in {STATUS_DIR} ({STATUS_PATTERN})")
+            if once and previous_at is not None:
+                print("\n".join(lines))
+                return
+            if not once:  # --once waits one refresh for the rates
+                sys.stdout.write("\x1b[H\x1b[2J" + "\n".join(lines) + "\n")
+                sys.stdout.flush()
+            previous, previous_at = rows, now
+            time.sleep(refresh)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live view of running fleets from their shared-memory status tables")
+    parser.add_argument("tables", nargs="*", help=f"status table files (default: {STATUS_DIR}/{STATUS_PATTERN})")
+    parser.add_argument("--sort", choices=SORT_KEYS, default="rate")
+    parser.add_argument("--type", choices=TYPES)
+    parser.add_argument("--filter", help="glob on the device id")
+    parser.add_argument("--limit", type=int, default=40, help="rows shown")
+    parser.add_argument("--refresh", type=float, default=REFRESH)
+    parser.add_argument("--once", action="store_true", help="print one screen (after one refresh, for the rates) and exit")
+    args = parser.parse_args()
+
+    run_viewer(args.tables, args.sort, args.limit, args.type, args.filter, args.refresh, args.once)
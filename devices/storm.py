@@ -0,0 +1,301 @@
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import resource
+import subprocess
+from pathlib import Path
+from types import SimpleNamespace
+
+from fleet import ConnectionPool, CONNECTIONS
+from mock_broker import read_packet
+from mqtt_packets import CONNACK, SUBACK, encode_connect, encode_subscribe
+from reconnect import (DecorrelatedJitter, RateLimiter, ReconnectManager, BACKOFF_BASE, BACKOFF_CAP,
+                       RECONNECT_RATE, RESUBSCRIBE_RATE)
+from sensors import device_topics
+
+# Broker restart under a fleet: the broker stand-in restarts, and the tool
+# reports how long the fleet takes to be fully back and the peak
+# connect/subscribe rates the broker sees.
+#
+# "naive" and "managed" are per-device connections, each holding its own
+# request-topic subscription as the standalone scripts do: lightweight
+# asyncio clients speaking raw MQTT. "naive" mimics paho's defaults (clean
+# session, 1 s delay doubling to 120 s, no jitter, immediate resubscribe),
+# "managed" applies reconnect.py's backoff and rate limiters.
+#
+# "pool" runs fleet.py's own ConnectionPool and ReconnectManager over paho:
+# the devices share the pool's connections, and recovery covers its session
+# handling, reconnect scheduling and paced resubscribes.
+
+BROKER_SCRIPT = Path(__file__).parent / "mock_broker.py"
+INITIAL_RATE = 1000       # connects per second while the fleet starts up
+PAHO_MIN_DELAY = 1.0
+PAHO_MAX_DELAY = 120.0
+RECOVERY_TIMEOUT = 300.0  # seconds
+
+
+class DoublingBackoff:
+    # paho's reconnect_delay_set() behaviour
+    def __init__(self):
+        self.delay = None
+
+    def next_delay(self):
+        self.delay = PAHO_MIN_DELAY if self.delay is None else min(self.delay * 2, PAHO_MAX_DELAY)
+        return self.delay
+
+    def reset(self):
+        self.delay = None
+
+
+class StormFleet:
+    def __init__(self, port, devices, managed, rate, resubscribe_rate):
+        self.port = port
+        self.devices = devices
+        self.managed = managed
+        self.initial = RateLimiter(INITIAL_RATE)
+        self.reconnects = RateLimiter(rate) if managed else None
+        self.resubscribes = RateLimiter(resubscribe_rate) if managed else None
+        self.connects = []    # monotonic times of connect attempts
+        self.subscribes = []  # monotonic times of SUBSCRIBE packets
+        self.up = 0
+        self.all_up = asyncio.Event()
+        self.last_up = 0.0
+        self.resumed = 0      # reconnects that found their session on the broker
+
+    async def wait_until(self, due):
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def device(self, index):
+        backoff = DecorrelatedJitter(BACKOFF_BASE, BACKOFF_CAP) if self.managed else DoublingBackoff()
+        due = self.initial.reserve()
+        while True:
+            await self.wait_until(due)
+            try:
+                reader, writer = await self.session(index)
+            except (OSError, asyncio.IncompleteReadError):
+                due = self.retry_at(backoff)
+                continue
+            backoff.reset()
+            self.up += 1
+            self.last_up = time.monotonic()
+            if self.up == self.devices:
+                self.all_up.set()
+            try:
+                await reader.read()  # until the broker drops the connection
+            except OSError:
+                pass
+            writer.close()
+            self.up -= 1
+            self.all_up.clear()
+            due = self.retry_at(backoff)
+
+    def retry_at(self, backoff):
+        due = time.monotonic() + backoff.next_delay()
+        return self.reconnects.reserve(due) if self.managed else due
+
+    async def session(self, index):
+        self.connects.append(time.monotonic())
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        try:
+            writer.write(encode_connect(f"storm-{index}", clean=not self.managed))
+            packet_type, _, body = await read_packet(reader)
+            if packet_type != CONNACK or body[1]:
+                raise ConnectionError("connection refused")
+            if body[0] & 0x01:
+                self.resumed += 1
+            else:
+                if self.managed:
+                    await self.wait_until(self.resubscribes.reserve())
+                self.subscribes.append(time.monotonic())
+                writer.write(encode_subscribe(1, [f"sensor/{index}/request"]))
+                while (await read_packet(reader))[0] != SUBACK:
+                    pass
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+def peak_rate(times, since):
+    # Highest count over any one-second window after `since`
+    times = sorted(t for t in times if t >= since)
+    peak, start = 0, 0
+    for end, t in enumerate(times):
+        while t - times[start] > 1.0:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+class StormPool(ConnectionPool):
+    # The fleet's pool, recording the connect attempts and SUBSCRIBE packets
+    # it makes, which of its connections are up, and the sessions the broker
+    # resumed
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attempts = []    # monotonic times of connect attempts
+        self.subscribes = []  # monotonic times, one per topic subscribed
+        self.up = set()       # slots; paho's is_connected() stays True after a drop
+        self.resumed = 0
+
+    def connect(self, client, slot):
+        self.attempts.append(time.monotonic())
+        super().connect(client, slot)
+
+    def subscribe(self, client, slot, topics):
+        self.subscribes.extend([time.monotonic()] * len(topics))
+        super().subscribe(client, slot, topics)
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self.up.add(userdata)
+            if flags.get("session present"):
+                self.resumed += 1
+        super().on_connect(client, userdata, flags, rc, properties)
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        self.up.discard(userdata)
+        super().on_disconnect(client, userdata, rc, properties)
+
+    def recovered(self):
+        # Every connection up and holding all of its devices' subscriptions
+        for slot in range(len(self.clients)):
+            if slot not in self.up:
+                return False
+            with self.lock:
+                if not self.subscriptions[slot] <= self.subscribed[slot]:
+                    return False
+        return True
+
+
+def pool_storm(port, devices, connections, rate, resubscribe_rate, keep_sessions, restart):
+    reconnect = ReconnectManager({"rate": rate, "resubscribeRate": resubscribe_rate}).start()
+    pool = StormPool([("127.0.0.1", port)], connections, INITIAL_RATE, reconnect=reconnect,
+                     persistent=keep_sessions, client_id_prefix=f"storm-{os.getpid()}")
+    for i in range(devices):
+        device_id = f"{i:05d}"
+        pool.add(SimpleNamespace(device_id=device_id, topics=device_topics(device_id, "energy")), i)
+    try:
+        wait_for(pool, lambda: [pool.publisher_for(slot) for slot in range(connections)])
+        restarted = time.monotonic()
+        resumed_before = pool.resumed
+        restart()
+        time.sleep(0.5)  # let the drops arrive
+        recovered = wait_for(pool) - restarted
+    finally:
+        pool.close()
+
+    return {
+        "mode": "pool",
+        "devices": devices,
+        "connections": connections,
+        "recoverySeconds": round(recovered, 2),
+        "connectAttempts": sum(1 for t in pool.attempts if t >= restarted),
+        "peakConnectsPerSecond": peak_rate(pool.attempts, restarted),
+        "resubscribes": sum(1 for t in pool.subscribes if t >= restarted),
+        "peakSubscribesPerSecond": peak_rate(pool.subscribes, restarted),
+        "sessionsResumed": pool.resumed - resumed_before,
+    }
+
+
+def wait_for(pool, step=None):
+    # Until the pool has recovered; -> monotonic time it did
+    deadline = time.monotonic() + RECOVERY_TIMEOUT
+    while not pool.recovered():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"pool not back after {RECOVERY_TIMEOUT} s")
+        if step is not None:
+            step()
+        time.sleep(0.01)
+    return time.monotonic()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_broker(downtime):
+    port = free_port()
+    broker = subprocess.Popen([sys.executable, str(BROKER_SCRIPT), "--port", str(port), "--downtime", str(downtime)],
+                              stdout=subprocess.PIPE, text=True)
+    broker.stdout.readline()  # listening
+    return port, broker
+
+
+async def storm(devices, managed, rate, resubscribe_rate, downtime, keep_sessions):
+    port, broker = start_broker(downtime)
+    fleet = StormFleet(port, devices, managed, rate, resubscribe_rate)
+    tasks = []
+    try:
+        tasks = [asyncio.ensure_future(fleet.device(i)) for i in range(devices)]
+        await asyncio.wait_for(fleet.all_up.wait(), RECOVERY_TIMEOUT)
+
+        restarted = time.monotonic()
+        resumed_before = fleet.resumed
+        broker.send_signal(signal.SIGUSR1 if keep_sessions else signal.SIGUSR2)
+        await asyncio.sleep(0.5)  # let the drops arrive
+        await asyncio.wait_for(fleet.all_up.wait(), RECOVERY_TIMEOUT)
+        recovered = fleet.last_up - restarted
+    finally:
+        for task in tasks:
+            task.cancel()
+        broker.terminate()
+        broker.wait()
+
+    return {
+        "mode": "managed" if managed else "naive",
+        "devices": devices,
+        "recoverySeconds": round(recovered, 2),
+        "connectAttempts": sum(1 for t in fleet.connects if t >= restarted),
+        "peakConnectsPerSecond": peak_rate(fleet.connects, restarted),
+        "resubscribes": sum(1 for t in fleet.subscribes if t >= restarted),
+        "peakSubscribesPerSecond": peak_rate(fleet.subscribes, restarted),
+        "sessionsResumed": fleet.resumed - resumed_before,
+    }
+
+
+def run_pool(devices, connections, rate, resubscribe_rate, downtime, keep_sessions):
+    port, broker = start_broker(downtime)
+    try:
+        return pool_storm(port, devices, connections, rate, resubscribe_rate, keep_sessions,
+                          lambda: broker.send_signal(signal.SIGUSR1 if keep_sessions else signal.SIGUSR2))
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restart a local broker stand-in under a fleet of device connections")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--mode", choices=["naive", "managed", "pool", "all"], default="all")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS, help="pool connections, for --mode pool")
+    parser.add_argument("--rate", type=float, default=RECONNECT_RATE * 10, help="managed reconnects per second")
+    parser.add_argument("--resubscribe-rate", type=float, default=RESUBSCRIBE_RATE)
+    parser.add_argument("--downtime", type=float, default=2.0, help="seconds the broker stays down")
+    parser.add_argument("--lose-sessions", action="store_true", help="broker restarts without persistence")
+    args = parser.parse_args()
+
+    # Each device holds a socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    modes = ["naive", "managed", "pool"] if args.mode == "all" else [args.mode]
+    for mode in modes:
+        if mode == "pool":
+            result = run_pool(args.devices, args.connections, args.rate, args.resubscribe_rate,
+                              args.downtime, not args.lose_sessions)
+        else:
+            result = asyncio.run(storm(args.devices, mode == "managed", args.rate, args.resubscribe_rate,
+                                       args.downtime, not args.lose_sessions))
+        print(f"[Storm] {result['mode']:8} {result['devices']} devices back in {result['recoverySeconds']} s | "
+              f"{result['connectAttempts']} connects, peak {result['peakConnectsPerSecond']}/s | "
+              f"{result['resubscribes']} resubscribes, peak {result['peakSubscribesPerSecond']}/s | "
+              f"{result['sessionsResumed']} sessions resumed")
@@ -0,0 +1,122 @@
+import sys
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+from mock_broker import topic_matches
+from mqtt5 import WireClient
+from mqtt_packets import MQTT_V311, SUBACK, UNSUBACK, encode_subscribe, encode_unsubscribe, recv_packet
+from sensors import device_topics
+from storm import free_port
+from topology import DEVICE_TYPES, generate_topology, site_key
+
+# What a consumer (the data manager's mqttClient.js) pays to follow a fleet:
+# today one subscription per device on the flat per-type topics, sent one
+# SUBSCRIBE each and all redone when the device list changes, against one
+# wildcard per site (site/<site>/+/+/data) or per device type
+# (site/+/<type>/+/data) on the site-hierarchical layout.
+BROKER_SCRIPT = Path(__file__).parent / "mock_broker.py"
+APPROACHES = ("flat", "site", "type")
+
+
+def subscription_filters(approach, sites):
+    if approach == "flat":
+        return [device_topics(str(device["deviceId"]), device["type"])["data"]
+                for site in sites for device in site["devices"]]
+    if approach == "site":
+        return [f"site/{site_key(site['name'])}/+/+/data" for site in sites]
+    types = sorted({device["type"] for site in sites for device in site["devices"]})
+    return [f"site/+/{device_type}/+/data" for device_type in types]
+
+
+def data_topics(approach, sites):
+    # What the fleet publishes to under the layout the approach expects
+    return [device_topics(str(device["deviceId"]), device["type"],
+                          None if approach == "flat" else site_key(site["name"]))["data"]
+            for site in sites for device in site["devices"]]
+
+
+def covers(filters, topics, sample=200):
+    # Every sampled device's data topic matches one of the filters
+    step = max(1, len(topics) // sample)
+    return all(any(topic_matches(f, topic) for f in filters) for topic in topics[::step])
+
+
+def request_all(client, encode, filters, ack):
+    # One packet per filter, pipelined as mqtt.js does -> seconds to the last ack
+    started = time.perf_counter()
+    for packet_id, topic_filter in enumerate(filters):
+        client.send(encode(packet_id % 65535 + 1, [topic_filter]))
+    for _ in filters:
+        packet_type, _, _ = recv_packet(client.sock)
+        if packet_type != ack:
+            raise ConnectionError(f"unexpected packet type {packet_type}")
+    return time.perf_counter() - started
+
+
+def run_approach(approach, sites):
+    filters = subscription_filters(approach, sites)
+    port = free_port()
+    broker = subprocess.Popen([sys.executable, str(BROKER_SCRIPT), "--port", str(port)],
+                              stdout=subprocess.PIPE, text=True)
+    broker.stdout.readline()  # listening
+    try:
+        client = WireClient(port, f"data-manager-{approach}", MQTT_V311)
+        sent = client.bytes_sent
+        subscribed = request_all(client, encode_subscribe, filters, SUBACK)
+        subscribe_bytes = client.bytes_sent - sent
+        client.sock.close()
+
+        # Reconnect with a clean session and subscribe again, as on every
+        # broker restart or network drop
+        started = time.perf_counter()
+        client = WireClient(port, f"data-manager-{approach}", MQTT_V311)
+        request_all(client, encode_subscribe, filters, SUBACK)
+        resubscribed = time.perf_counter() - started
+
+        # A device added or removed: mqttClient.js unsubscribes every old topic
+        # and subscribes the new list; a wildcard already covers it
+        changed = 0.0
+        change_messages = change_bytes = 0
+        if approach == "flat":
+            sent = client.bytes_sent
+            changed = request_all(client, encode_unsubscribe, filters, UNSUBACK)
+            changed += request_all(client, encode_subscribe, filters, SUBACK)
+            change_messages = 2 * len(filters)
+            change_bytes = client.bytes_sent - sent
+        client.close()
+    finally:
+        broker.terminate()
+        broker.wait()
+
+    return {
+        "approach": approach,
+        "devices": sum(len(site["devices"]) for site in sites),
+        "subscribes": len(filters),
+        "subscribeBytes": subscribe_bytes,
+        "lastSubackMs": round(subscribed * 1000, 1),
+        "reconnectResubscribeMs": round(resubscribed * 1000, 1),
+        "deviceChangeMessages": change_messages,
+        "deviceChangeBytes": change_bytes,
+        "deviceChangeMs": round(changed * 1000, 1),
+        "coversEveryDevice": covers(filters, data_topics(approach, sites)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-device and wildcard consumer subscriptions")
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--devices-per-site", type=int, default=100)
+    parser.add_argument("--types", nargs="+", choices=DEVICE_TYPES, default=list(DEVICE_TYPES))
+    parser.add_argument("--approach", choices=APPROACHES + ("all",), default="all")
+    args = parser.parse_args()
+
+    sites = generate_topology(args.sites, args.devices_per_site, args.types)
+    for approach in APPROACHES if args.approach == "all" else [args.approach]:
+        result = run_approach(approach, sites)
+        print(f"[Subscriptions] {result['approach']:4} {result['devices']} devices | "
+              f"{result['subscribes']} SUBSCRIBEs, {result['subscribeBytes']} B, "
+              f"last SUBACK {result['lastSubackMs']} ms | reconnect + resubscribe {result['reconnectResubscribeMs']} ms | "
+              f"device change: {result['deviceChangeMessages']} messages, {result['deviceChangeBytes']} B, "
+              f"{result['deviceChangeMs']} ms | covers every device: {result['coversEveryDevice']}")
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The device modules import each other as top-level modules, the way the
+# scripts run them from devices/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
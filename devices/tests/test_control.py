@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from fleet import Fleet, generate_specs
+
+
+@pytest.fixture
+def fleet():
+    specs = generate_specs("gas", 3, first_id=2220) + generate_specs("water", 2, first_id=1110)
+    manifest = {"logging": {"summaryInterval": 0}, "adaptiveSampling": {"enabled": True}}
+    fleet = Fleet(manifest, specs, {}, dry_run=True)
+    yield fleet
+    fleet.log.close()
+    fleet.pool.close()
+
+
+def apply(fleet, command):
+    results = []
+    fleet.apply(command, results.append)
+    return results[0]
+
+
+def test_configure_sets_deadband_for_the_selected_type(fleet):
+    result = apply(fleet, {"action": "configure", "type": "gas",
+                           "set": {"deadband": {"heartbeat": 60, "bands": {"flowRate": {"abs": 0.5}}}}})
+    assert result["ok"] and result["matched"] == 3
+    gas = fleet.device("2220").deadband
+    assert gas.heartbeat == 60 and ((("flowRate",), "abs", 0.5) in gas.bands)
+    assert fleet.device("1110").deadband is None
+
+
+def test_configure_interval_sets_the_sampler_floor(fleet):
+    result = apply(fleet, {"action": "configure", "deviceId": "2221", "set": {"interval": 20}})
+    assert result["ok"]
+    device = fleet.device("2221")
+    device.sampler.next_interval({"flowRate": 1.0})  # moving: back to the fastest interval
+    assert device.sampler.interval == 20
+    device.sampler.next_interval({"flowRate": 5.0})
+    assert device.sampler.interval == 20
+
+
+@pytest.mark.parametrize("settings", [
+    {"deadband": True},
+    {"deadband": {"bands": {"flowRate": 5}}},
+    {"deadband": {"bands": {"flowRate": {"abs": "5"}}}},
+    {"deadband": {"bands": {"flowRate": {"rel": 5}}}},
+    {"deadband": {"bands": ["flowRate"]}},
+    {"deadband": {"heartbeat": 0}},
+    {"deadband": {"enabled": "yes"}},
+    {"deadband": {"bands": {"noSuchField": {"abs": 1}}}},
+    {"interval": True},
+    {"interval": -1},
+    {"encoding": "xml"},
+])
+def test_configure_rejects_malformed_settings(fleet, settings):
+    before = [device.deadband for device in fleet.devices]
+    result = apply(fleet, {"action": "configure", "set": settings})
+    assert not result["ok"] and result["error"]
+    assert [device.deadband for device in fleet.devices] == before
+
+
+@pytest.mark.parametrize("command", [
+    {"action": "configure", "set": "interval"},
+    {"action": "retype", "deviceId": "2220", "type": ["gas"]},
+    {"action": "pause", "deviceIds": 5},
+    {"action": "profile"},
+])
+def test_malformed_commands_are_answered(fleet, command):
+    result = apply(fleet, command)
+    assert result == {"ok": False, "error": result["error"], "action": command["action"]}
+
+
+def test_add_generated_devices(fleet):
+    result = apply(fleet, {"action": "add", "type": "solar", "count": 3, "firstId": 5000, "prefix": "pv-"})
+    assert result["ok"] and result["added"] == ["pv-5000", "pv-5001", "pv-5002"]
+    assert apply(fleet, {"action": "list"})["byType"]["solar"] == 3
+
+
+def test_add_listed_devices(fleet):
+    result = apply(fleet, {"action": "add", "type": "water", "deviceIds": ["4000", 4001, "1110"]})
+    assert result["ok"] and result["added"] == ["4000", "4001"]
+
+
+@pytest.mark.parametrize("command", [
+    {"action": "add", "type": ["water"], "deviceId": "4000"},
+    {"action": "add", "type": "steam", "deviceId": "4000"},
+    {"action": "add", "type": "water", "count": "5"},
+    {"action": "add", "type": "water", "count": 0},
+    {"action": "add", "type": "water", "count": 2.5},
+    {"action": "add", "type": "water", "count": True},
+    {"action": "add", "type": "water", "count": 2, "firstId": "x"},
+    {"action": "add", "type": "water", "count": 2, "prefix": 7},
+    {"action": "add", "type": "water", "deviceIds": "4000"},
+    {"action": "add", "type": "water", "deviceIds": [{"id": 1}]},
+    {"action": "add", "deviceId": "4000"},
+])
+def test_add_rejects_malformed_ops(fleet, command):
+    before = apply(fleet, {"action": "list"})["devices"]
+    result = apply(fleet, command)
+    assert not result["ok"] and result["error"]
+    assert apply(fleet, {"action": "list"})["devices"] == before
+
+
+def test_add_refuses_more_devices_than_the_cap(fleet):
+    fleet.max_add = 4
+    result = apply(fleet, {"action": "add", "type": "gas", "count": 5, "firstId": 3000})
+    assert not result["ok"] and "at most 4" in result["error"]
+    assert apply(fleet, {"action": "add", "type": "gas", "count": 4, "firstId": 3000})["ok"]
+
+
+class Client:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload):
+        self.published.append((topic, json.loads(payload)))
+
+
+def test_mqtt_commands_need_the_control_token():
+    specs = generate_specs("gas", 1, first_id=2220)
+    manifest = {"logging": {"summaryInterval": 0}, "control": {"topic": "fleet/control", "token": "s3cret"}}
+    fleet = Fleet(manifest, specs, {}, dry_run=True)
+    try:
+        client = Client()
+        fleet.on_control_message(client, "fleet/control", json.dumps({"action": "list"}))
+        assert client.published == [("fleet/control/response", {"ok": False, "error": "unauthorized"})]
+        fleet.on_control_message(client, "fleet/control", json.dumps({"action": "list", "token": "s3cret"}))
+        fleet.apply_commands()
+        assert client.published[-1][1]["ok"]
+    finally:
+        fleet.log.close()
+        fleet.pool.close()
+
+
+def test_control_topics_are_not_subscribed_without_a_token():
+    manifest = {"logging": {"summaryInterval": 0}, "control": {"topic": "fleet/control"}}
+    unguarded = Fleet(manifest, generate_specs("gas", 1), {}, dry_run=True)
+    try:
+        assert unguarded.pool.control_topic is None
+    finally:
+        unguarded.log.close()
+        unguarded.pool.close()
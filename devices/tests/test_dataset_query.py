@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from dataset import generate_dataset, parse_date
+from dataset_query import Dataset
+
+
+def test_site_totals_never_add_types_together(tmp_path):
+    specs = [{"deviceId": "w1", "type": "water", "site": "A"},
+             {"deviceId": "w2", "type": "water", "site": "A"},
+             {"deviceId": "g1", "type": "gas", "site": "A"},
+             {"deviceId": "e1", "type": "energy", "site": "B"}]
+    start = parse_date("2024-01-01")
+    generate_dataset(tmp_path, specs, start, start + 3600 * 1000, interval=60)
+    dataset = Dataset(tmp_path)
+
+    totals = dataset.site_totals("consumption")
+    assert set(totals) == {("A", "water"), ("A", "gas"), ("B", "energy")}
+    assert totals[("A", "water")] == pytest.approx(
+        dataset.latest("w1", "consumption") + dataset.latest("w2", "consumption"))
+    assert totals[("A", "gas")] == pytest.approx(dataset.latest("g1", "consumption"))
+    assert set(dataset.site_totals("consumption", device_type="gas")) == {("A", "gas")}
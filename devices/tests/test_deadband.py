@@ -0,0 +1,30 @@
+import pytest
+
+from deadband import DeadbandFilter, build_bands
+
+
+def water(flow, pressure=3.0, temperature=20.0):
+    return {"flowRate": flow, "pressure": pressure, "temperature": temperature}
+
+
+@pytest.mark.parametrize("device_type, reading, idle", [
+    ("water", water(1.5), water(0.0)),
+    ("water", water(3.0), water(0.0)),
+    ("gas", {"flowRate": 0.15, "pressure": 1.3, "temperature": 30.0},
+     {"flowRate": 0.0, "pressure": 1.3, "temperature": 30.0}),
+])
+def test_flow_dropping_to_zero_is_published_before_the_heartbeat(device_type, reading, idle):
+    deadband = DeadbandFilter(build_bands(device_type), heartbeat=300)
+    assert deadband.check(reading, 0)
+    assert not deadband.check(dict(reading), 5)  # unchanged
+    assert deadband.check(idle, 10)
+    assert not deadband.check(dict(idle), 15)
+    assert deadband.check(reading, 20)           # and starting again
+
+
+def test_noise_stays_in_band_and_steps_go_out():
+    deadband = DeadbandFilter(build_bands("water"), heartbeat=300)
+    assert deadband.check(water(3.0), 0)
+    assert not deadband.check(water(3.9, 3.4, 25.0), 5)  # within about one deviation
+    assert deadband.check(water(3.0, 3.0, 38.0), 10)     # temperature step
+    assert deadband.check(water(3.0, 3.0, 38.0), 310)    # heartbeat
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+from mock_mongo import Int64, ObjectId, apply_update, decode_document, encode_document, matches, run_pipeline
+
+# The pipeline behind POST /api/site/:siteId/:type/index
+INDEX_PIPELINE = [
+    {"$match": {"value": {"$exists": True}, "deviceId": {"$exists": True}}},
+    {"$addFields": {"timestamp": {"$switch": {"branches": [
+        {"case": {"$eq": [{"$type": "$timestamp"}, "string"]},
+         "then": {"$dateFromString": {"dateString": "$timestamp"}}},
+        {"case": {"$eq": [{"$type": "$timestamp"}, "double"]}, "then": {"$toDate": "$timestamp"}},
+        {"case": {"$eq": [{"$type": "$timestamp"}, "long"]}, "then": {"$toDate": "$timestamp"}},
+        {"case": {"$eq": [{"$type": "$timestamp"}, "date"]}, "then": "$timestamp"},
+    ], "default": datetime.now(timezone.utc)}}}},
+    {"$sort": {"deviceId": 1, "timestamp": -1}},
+    {"$group": {"_id": "$deviceId", "lastReading": {"$first": "$value"}}},
+    {"$group": {"_id": None, "totalIndex": {"$sum": "$lastReading"}}},
+]
+
+
+def test_bson_round_trip():
+    document = {"_id": ObjectId(), "n": 1, "big": 2**40, "long": Int64(5), "x": 1.5, "s": "é",
+                "ok": True, "none": None, "at": datetime(2026, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc),
+                "nested": {"list": [1, "two", {"three": 3.0}]}}
+    decoded, end = decode_document(encode_document(document))
+    assert decoded == document
+    assert end == len(encode_document(document))
+    assert type(decoded["long"]) is Int64
+
+
+def test_index_pipeline_sums_each_devices_newest_value():
+    documents = [
+        {"deviceId": "a", "value": 1.0, "timestamp": 1000.0},
+        {"deviceId": "a", "value": 4.0, "timestamp": Int64(3000)},
+        {"deviceId": "a", "value": 2.0, "timestamp": "1970-01-01T00:00:02Z"},
+        {"deviceId": "b", "value": 0.5, "timestamp": datetime(1970, 1, 1, tzinfo=timezone.utc)},
+        {"deviceId": "c", "flowRate": 9.0, "timestamp": 5000.0},  # no value
+    ]
+    assert run_pipeline(documents, INDEX_PIPELINE) == [{"_id": None, "totalIndex": 4.5}]
+    assert run_pipeline([], INDEX_PIPELINE) == []
+
+
+def test_queries_and_updates():
+    device = {"deviceId": "a", "status": "active", "lastReading": {"value": 1}}
+    assert matches(device, {"status": "active", "lastReading.value": {"$gte": 1}})
+    assert not matches(device, {"$or": [{"status": "inactive"}, {"lastReading.value": {"$gt": "0"}}]})
+    apply_update(device, {"$set": {"lastReading.value": 2, "lastReading.unit": "m³"}})
+    assert device["lastReading"] == {"value": 2, "unit": "m³"}
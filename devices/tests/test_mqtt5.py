@@ -0,0 +1,70 @@
+import threading
+from types import SimpleNamespace
+
+from mqtt5 import PAHO_NAMES, TopicAliases, V5Options, V5Session
+
+
+def build(properties):
+    # Stand-in for paho's Properties: one attribute per property
+    return SimpleNamespace(**{PAHO_NAMES[identifier]: value for identifier, value in properties})
+
+
+class Message:
+    # The parts of paho's MQTTMessage a session touches
+    def __init__(self, topic, properties, retain=False):
+        self._topic = topic.encode()
+        self.properties = properties
+        self.retain = retain
+
+    @property
+    def topic(self):
+        return self._topic.decode()
+
+
+def session(maximum=10):
+    result = V5Session(V5Options({}), build=build)
+    result.reset(maximum)
+    return result
+
+
+def test_static_properties_go_with_the_first_publish_of_a_topic():
+    s = session()
+    topic, first = s.prepare("device/1/data")
+    assert topic == "device/1/data"
+    assert first.TopicAlias == 1 and first.ContentType == "application/json"
+    topic, later = s.prepare("device/1/data")
+    assert topic == ""
+    assert later.TopicAlias == 1 and not hasattr(later, "ContentType")
+    assert later.MessageExpiryInterval == first.MessageExpiryInterval
+    topic, retained = s.prepare("device/1/meta", retain=True)
+    assert topic == "device/1/meta" and retained.ContentType == "application/json"
+    assert not hasattr(retained, "TopicAlias")
+
+
+def test_aliases_are_not_reassigned_once_the_table_is_full():
+    aliases = TopicAliases(2)
+    assert aliases.assign("a") == ("a", 1)
+    assert aliases.assign("b") == ("b", 2)
+    assert aliases.assign("c") == ("c", None)
+    assert aliases.assign("c") == ("c", None)
+    assert aliases.assign("a") == ("", 1)
+
+
+def test_messages_paho_still_holds_get_their_topic_back_on_disconnect():
+    s = session()
+    first = Message(*s.prepare("device/1/data"))
+    aliased = Message(*s.prepare("device/1/data"))
+    plain = Message("device/2/reply", None)
+    client = SimpleNamespace(_out_message_mutex=threading.RLock(),
+                             _out_messages={1: first, 2: aliased, 3: plain})
+    s.disconnected(client)
+
+    for message in (first, aliased):
+        assert message.topic == "device/1/data"
+        assert not hasattr(message.properties, "TopicAlias")
+        assert message.properties.ContentType == "application/json"
+    assert plain.topic == "device/2/reply" and plain.properties is None
+    # No aliases until the next CONNACK gives the broker's maximum
+    assert s.prepare("device/1/data")[0] == "device/1/data"
+    s.reset(10)
+    assert s.prepare("device/1/data")[1].TopicAlias == 1
@@ -0,0 +1,46 @@
+import pytest
+
+from fleet import Fleet, generate_specs
+from publisher import Publisher
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    manifest = {"logging": {"summaryInterval": 0}, "profileDir": str(tmp_path / "profiles")}
+    fleet = Fleet(manifest, generate_specs("water", 2, first_id=1110), {}, dry_run=True)
+    yield fleet
+    fleet.log.close()
+    fleet.pool.close()
+
+
+def profile(fleet, target, op):
+    results = []
+    fleet.apply({"action": "profile", "target": target, "op": op}, results.append)
+    return results[0]
+
+
+def test_snapshots_in_the_same_second_keep_their_own_files(fleet):
+    assert profile(fleet, "memory", "start")["ok"]
+    files = [profile(fleet, "memory", "snapshot")["files"][0] for _ in range(3)]
+    files += profile(fleet, "memory", "stop")["files"][:1]
+    assert len(set(files)) == 4
+
+
+def test_unwritable_output_is_an_error_result(fleet, tmp_path):
+    (tmp_path / "profiles").write_text("not a directory")
+    assert profile(fleet, "cpu", "start")["ok"]
+    result = profile(fleet, "cpu", "stop")
+    assert not result["ok"] and "could not write" in result["error"]
+
+    (tmp_path / "profiles").unlink()
+    assert profile(fleet, "cpu", "stop")["ok"]  # still running, so the retry succeeds
+
+
+def test_flushed_readings_count_in_the_publish_stage(fleet):
+    profile(fleet, "stages", "start")
+    slot = fleet.devices[0].slot
+    fleet.pool.publishers[slot] = Publisher(fleet.pool.open(slot))
+    fleet.pending[slot][0] = "{}"
+    fleet.pending_count += 1
+    fleet.flush_pending()
+    assert fleet.profiler.stage_timer.stages["publish"][0] == 1
@@ -0,0 +1,118 @@
+import threading
+
+import paho.mqtt.client as mqtt
+
+from publisher import Publisher, EARLY_ACK_TTL, QOS1_WAIT, QOS1_WINDOW
+
+
+class MessageInfo:
+    def __init__(self, mid, rc=mqtt.MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+
+    def wait_for_publish(self, timeout=None):
+        # paho raises when the message could only be queued
+        if self.rc == mqtt.MQTT_ERR_NO_CONN:
+            raise RuntimeError("The client is not currently connected.")
+
+
+class FakeClient:
+    # mids wrap like paho's, from 1 to `wrap`; ack_inside acks a QoS 1
+    # message from within publish(), as a fast broker can
+    def __init__(self, wrap=65535, connected=True):
+        self.mid = 0
+        self.wrap = wrap
+        self.connected = connected
+        self.ack_inside = False
+        self.on_publish = None
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid = self.mid % self.wrap + 1
+        if self.connected and (qos == 0 or self.ack_inside):
+            self.on_publish(self, None, self.mid)
+        return MessageInfo(self.mid, mqtt.MQTT_ERR_SUCCESS if self.connected else mqtt.MQTT_ERR_NO_CONN)
+
+
+class LockingClient(FakeClient):
+    # Like paho: publish() takes the client's message lock, and the network
+    # thread calls on_publish with that lock held. The ack of each message
+    # comes from the network thread before publish() returns.
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.deadlocked = False
+
+    def network_ack(self, mid):
+        with self.lock:
+            self.on_publish(self, None, mid)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid += 1
+        network = threading.Thread(target=self.network_ack, args=(self.mid,))
+        network.start()
+        network.join(timeout=0.5)
+        if not self.lock.acquire(timeout=0.5):
+            self.deadlocked = True
+            raise RuntimeError("deadlock: the network thread holds the client lock")
+        self.lock.release()
+        return MessageInfo(self.mid)
+
+
+def test_ack_from_the_network_thread_during_publish():
+    client = LockingClient()
+    publisher = Publisher(client, QOS1_WINDOW)
+    for _ in range(3):
+        assert publisher.publish("sensor/2220/data", "{}")
+    assert not client.deadlocked
+    assert publisher.acked == 3 and not publisher.in_flight and not publisher.early_acks
+
+
+def test_replies_leave_no_early_acks():
+    client = FakeClient(wrap=4)
+    publisher = Publisher(client, QOS1_WINDOW)
+    for _ in range(4):
+        publisher.reply("device/0000/response", "ok")
+    assert not publisher.early_acks and not publisher.replies
+
+    publisher.publish("device/0000/data", "{}")  # reuses mid 1 after the wrap
+    assert publisher.acked == 0 and len(publisher.in_flight) == 1
+    publisher.on_publish(client, None, 1)
+    assert publisher.acked == 1 and not publisher.in_flight
+
+
+def test_stray_acks_expire():
+    client = FakeClient(wrap=4)
+    publisher = Publisher(client, QOS1_WINDOW)
+    client.publish("device/0000/response", "ok")  # made on the client directly
+    assert list(publisher.early_acks) == [1]
+    publisher.purged -= 2 * EARLY_ACK_TTL
+    publisher.early_acks[1] -= 2 * EARLY_ACK_TTL
+    publisher.publish("device/0000/data", "{}")
+    assert not publisher.early_acks and publisher.acked == 0
+
+
+def test_ack_inside_publish_is_recorded():
+    client = FakeClient()
+    publisher = Publisher(client, QOS1_WINDOW)
+    client.ack_inside = True
+    assert publisher.publish("device/0000/data", "{}")
+    assert publisher.acked == 1 and not publisher.in_flight and not publisher.early_acks
+
+
+def test_wait_while_disconnected_keeps_the_queued_message_in_flight():
+    client = FakeClient(connected=False)
+    publisher = Publisher(client, QOS1_WAIT)
+    assert publisher.publish("device/0000/data", "{}")
+    stats = publisher.stats()
+    assert stats["published"] == 1 and stats["errors"] == 0 and stats["queueDepth"] == 1
+    publisher.on_publish(client, None, 1)  # delivered after the reconnect
+    assert publisher.acked == 1 and not publisher.in_flight
+
+
+def test_drain_waits_for_outstanding_acks():
+    client = FakeClient()
+    publisher = Publisher(client, QOS1_WINDOW)
+    publisher.publish("sensor/2220/rollup/1m", "{}", force=True)
+    assert not publisher.drain(timeout=0.05)
+    publisher.on_publish(client, None, 1)
+    assert publisher.drain(timeout=0.05)
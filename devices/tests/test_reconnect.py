@@ -0,0 +1,93 @@
+import heapq
+
+import paho.mqtt.client as mqtt
+
+from fleet import ConnectionPool, FleetDevice
+from reconnect import ReconnectManager
+from sensors import create_sensor
+
+
+class SessionClient:
+    # Records the topics a broker session would hold for this connection
+    def __init__(self):
+        self.connected = True
+        self.topics = set()
+        self.subscribes = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topics):
+        if not self.connected:
+            return mqtt.MQTT_ERR_NO_CONN, None
+        self.subscribes += 1
+        self.topics.update(topic for topic, _ in topics)
+        return mqtt.MQTT_ERR_SUCCESS, self.subscribes
+
+    def unsubscribe(self, topics):
+        self.topics.difference_update([topics] if isinstance(topics, str) else topics)
+        return mqtt.MQTT_ERR_SUCCESS, None
+
+
+def run_jobs(manager):
+    while manager.jobs:
+        heapq.heappop(manager.jobs)[2]()
+
+
+def make_device(device_id):
+    return FleetDevice(create_sensor("water", device_id, state={}))
+
+
+def connect(pool, client, session_present):
+    client.connected = True
+    if not session_present:
+        client.topics = set()
+    pool.on_connect(client, 0, {"session present": session_present}, 0)
+    run_jobs(pool.reconnect)
+
+
+def test_resumed_session_catches_up_on_changes_made_while_down():
+    pool = ConnectionPool([("127.0.0.1", 1883)], 1, 0, reconnect=ReconnectManager(), persistent=True)
+    pool.control_topic = "fleet/control"
+    client = pool.clients[0] = SessionClient()
+    kept, removed, added = make_device("1110"), make_device("1111"), make_device("1112")
+    pool.add(kept, 0)
+    pool.add(removed, 1)
+    connect(pool, client, session_present=False)
+    assert client.topics == {"fleet/control", kept.topics["request"], removed.topics["request"]}
+
+    client.connected = False
+    pool.remove(removed)
+    pool.add(added, 2)
+    connect(pool, client, session_present=True)
+    assert client.topics == {"fleet/control", kept.topics["request"], added.topics["request"]}
+
+    subscribes = client.subscribes
+    connect(pool, client, session_present=True)
+    assert client.subscribes == subscribes  # nothing changed, nothing resent
+
+
+def test_lost_session_resubscribes_everything():
+    pool = ConnectionPool([("127.0.0.1", 1883)], 1, 0, reconnect=ReconnectManager(), persistent=True)
+    client = pool.clients[0] = SessionClient()
+    device = make_device("1110")
+    pool.add(device, 0)
+    connect(pool, client, session_present=False)
+    connect(pool, client, session_present=False)
+    assert client.topics == {device.topics["request"]}
+
+
+def test_close_disconnects_before_stopping_the_network_loop():
+    calls = []
+
+    class Client:
+        def disconnect(self):
+            calls.append("disconnect")
+
+        def loop_stop(self):
+            calls.append("loop_stop")
+
+    pool = ConnectionPool([("127.0.0.1", 1883)], 1, 0, reconnect=ReconnectManager())
+    pool.clients[0] = Client()
+    pool.close()
+    assert calls == ["disconnect", "loop_stop"]
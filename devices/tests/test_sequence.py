@@ -0,0 +1,32 @@
+import pytest
+
+from mqtt5 import split_metadata
+from sensors import create_sensor, device_topics
+from sequence import SequenceTracker, payload_device_id
+
+
+def compact_readings(device_id, count):
+    sensor = create_sensor("gas", device_id, state={})
+    topic = device_topics(device_id, "gas")["data"]
+    return [(topic, split_metadata(sensor.stamp(sensor.generate_data()))[1]) for _ in range(count)]
+
+
+def test_split_keeps_compact_readings_of_two_devices_apart():
+    batch = compact_readings("2220", 3) + compact_readings("2221", 3)
+    topics, payloads = zip(*batch)
+    assert all("deviceId" not in p and "sensorId" not in p for p in payloads)
+
+    tracker = SequenceTracker()
+    keep, duplicates = tracker.split(list(payloads), list(topics))
+    assert len(keep) == 6 and not duplicates
+    assert set(tracker.devices) == {"2220", "2221"}
+
+    keep, duplicates = tracker.split([payloads[0], payloads[3]], [topics[0], topics[3]])
+    assert not keep and len(duplicates) == 2
+
+
+def test_compact_reading_without_its_topic_is_refused():
+    (_, payload), = compact_readings("2220", 1)
+    with pytest.raises(ValueError):
+        SequenceTracker().track_payload(payload)
+    assert payload_device_id({"sensorId": "2220"}) == "2220"
@@ -0,0 +1,31 @@
+import time
+
+from fleet import Fleet, generate_specs
+from gateway import SiteGateway
+from topology import load_topology, TOPOLOGY_FILE
+
+
+def test_fleet_flushes_open_rollups_on_shutdown():
+    fleet = Fleet({"logging": {"summaryInterval": 0}}, generate_specs("gas", 3, first_id=2220), {}, dry_run=True)
+    sent = []
+    try:
+        now = time.monotonic()
+        for index, device in enumerate(fleet.devices):
+            fleet.pool.next_connect = 0.0
+            publisher = fleet.pool.publisher_for(device.slot)
+            fleet.tick(publisher, index, now)
+            publisher.publish = lambda topic, payload, retain=False, force=False: sent.append(topic) or True
+        fleet.flush_rollups()
+    finally:
+        fleet.log.close()
+        fleet.pool.close()
+    assert len(sent) == 3 * 3 and all("/rollup/" in topic for topic in sent)  # every device, every window
+    assert all(device.rollups.flush() == [] for device in fleet.devices)
+
+
+def test_gateway_flush_closes_every_device_bucket():
+    gateway = SiteGateway(load_topology(TOPOLOGY_FILE)[0], persist=False)
+    gateway.frame(time.time())
+    buckets = gateway.flush()
+    assert len(buckets) == 3 * len(gateway.devices)
+    assert all(bucket["partial"] for bucket in buckets)
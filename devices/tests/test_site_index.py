@@ -0,0 +1,58 @@
+import json
+from types import SimpleNamespace
+
+from mqtt5 import split_metadata
+from sensors import create_sensor, device_topics
+from site_index import SiteIndex, on_message
+from topology import load_topology, TOPOLOGY_FILE
+
+
+class RecordingClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, json.loads(payload)))
+
+
+def compact_reading(sensor):
+    # What the fleet sends with "encoding": "compact": no deviceId/sensorId
+    _, payload = split_metadata(sensor.stamp(sensor.generate_data()))
+    return payload
+
+
+def deliver(index, client, topic, payload):
+    on_message(client, index, SimpleNamespace(topic=topic, payload=json.dumps(payload).encode()))
+
+
+def test_compact_readings_are_tracked_per_device():
+    index = SiteIndex(load_topology(TOPOLOGY_FILE))
+    client = RecordingClient()
+    sensors = [create_sensor("gas", device_id, state={}) for device_id in ("2220", "2221")]
+
+    for _ in range(3):
+        for sensor in sensors:
+            payload = compact_reading(sensor)
+            assert "deviceId" not in payload and "sensorId" not in payload
+            deliver(index, client, device_topics(sensor.device_id, "gas")["data"], payload)
+
+    assert set(index.sequences.devices) == {"2220", "2221"}
+    stats = index.sequences.stats()
+    assert stats["new"] == 6
+    assert stats["duplicate"] == 0 and stats["missing"] == 0
+    assert set(index.latest) == {"2220", "2221"}
+    assert client.published[-1][1]["devices"] == 2
+
+
+def test_redelivered_compact_reading_is_not_counted_again():
+    index = SiteIndex(load_topology(TOPOLOGY_FILE))
+    client = RecordingClient()
+    sensor = create_sensor("gas", "2221", state={})
+    topic = device_topics("2221", "gas")["data"]
+
+    payload = compact_reading(sensor)
+    deliver(index, client, topic, payload)
+    deliver(index, client, topic, payload)
+
+    assert index.sequences.stats()["duplicate"] == 1
+    assert len(client.published) == 1
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+from status import StatusTable, read_table
+
+
+def device(device_id):
+    return SimpleNamespace(device_id=device_id, type="gas", paused=False, sensor=SimpleNamespace(total=1.5),
+                           last_publish=0.0, messages=3, errors=0, interval=60.0)
+
+
+def test_rows_past_the_capacity_grow_the_table(tmp_path):
+    path = tmp_path / "fleet.status"
+    table = StatusTable(path, capacity=2)
+    try:
+        table.update(0, device("a"), 0.0)
+        table.update(5, device("b"), 0.0)  # added at runtime, past the first size
+        assert table.capacity == 8
+        pid, rows = read_table(path)
+        assert [row["deviceId"] for row in rows] == ["a", "b"]
+        assert rows[1]["count"] == 3
+    finally:
+        table.close()
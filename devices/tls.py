@@ -0,0 +1,155 @@
+import ssl
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+from mqtt_packets import encode_connect
+
+MQTTS_PORT = 8883
+
+
+class HandshakeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, resumed):
+        with self.lock:
+            self.handshakes += 1
+            self.resumed += resumed
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+
+    def summary(self):
+        return {
+            "handshakes": self.handshakes,
+            "full": self.handshakes - self.resumed,
+            "resumed": self.resumed,
+            "meanMs": round(self.total_time / self.handshakes * 1000, 2) if self.handshakes else None,
+            "maxMs": round(self.max_time * 1000, 2),
+            "totalS": round(self.total_time, 3),
+        }
+
+
+class TrackedSSLSocket(ssl.SSLSocket):
+    def do_handshake(self, block=False):
+        start = time.perf_counter()
+        super().do_handshake(block)
+        self.context.handshake_done(self, time.perf_counter() - start)
+
+
+class FleetSSLContext(ssl.SSLContext):
+    # One client context shared by every connection of the fleet. It remembers
+    # the latest TLS session per server and offers it on the next connection,
+    # so only the first handshake to a broker (and after ticket expiry) is a
+    # full one; reconnect storms resume instead.
+    sslsocket_class = TrackedSSLSocket
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        self.stats = HandshakeStats()
+        self.sessions = {}  # server_hostname -> SSLSession
+        self.live = {}      # server_hostname -> latest socket, for TLS 1.3 tickets
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.session_for(server_hostname)
+        return super().wrap_socket(sock, server_side=server_side,
+                                   do_handshake_on_connect=do_handshake_on_connect,
+                                   suppress_ragged_eofs=suppress_ragged_eofs,
+                                   server_hostname=server_hostname, session=session)
+
+    def session_for(self, server_hostname):
+        # TLS 1.3 tickets arrive after the handshake, so prefer the session of
+        # a connection that is still open
+        sock = self.live.get(server_hostname)
+        if sock is not None:
+            try:
+                if sock.session is not None:
+                    self.sessions[server_hostname] = sock.session
+            except (ValueError, OSError):
+                pass
+        return self.sessions.get(server_hostname)
+
+    def handshake_done(self, sock, elapsed):
+        self.stats.record(elapsed, sock.session_reused)
+        self.live[sock.server_hostname] = sock
+        if sock.session is not None:
+            self.sessions[sock.server_hostname] = sock.session
+
+
+def create_tls_context(config):
+    # config: {"caFile", "certFile", "keyFile", "ciphers", "insecure", "maxVersion"}
+    context = FleetSSLContext()
+    if config.get("caFile"):
+        context.load_verify_locations(config["caFile"])
+    else:
+        context.load_default_certs()
+    if config.get("certFile"):
+        context.load_cert_chain(config["certFile"], config.get("keyFile"))
+    if config.get("ciphers"):
+        # Applies to TLS 1.2; TLS 1.3 suites are fixed by OpenSSL
+        context.set_ciphers(config["ciphers"])
+    if config.get("maxVersion"):
+        context.maximum_version = ssl.TLSVersion[config["maxVersion"]]
+    if config.get("insecure"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def make_self_signed_cert(directory, hostname="localhost"):
+    # Self-signed certificate for local broker stand-ins (needs the openssl CLI)
+    directory = Path(directory)
+    cert_file, key_file = directory / "broker.crt", directory / "broker.key"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+                    "-subj", f"/CN={hostname}", "-addext", f"subjectAltName=DNS:{hostname}",
+                    "-keyout", str(key_file), "-out", str(cert_file)],
+                   check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def check_local_broker(connections, tls_config):
+    # Opens `connections` mqtts connections to a local TLS broker stand-in
+    # through one shared context and reports how many handshakes resumed
+    from mock_broker import MockBroker, server_ssl_context
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_file, key_file = make_self_signed_cert(tmp)
+        broker = MockBroker(port=0, ssl_context=server_ssl_context(cert_file, key_file)).start_in_thread()
+        context = create_tls_context(dict(tls_config, caFile=str(cert_file)))
+        sockets = []
+        try:
+            for i in range(connections):
+                sock = context.wrap_socket(socket.create_connection(("127.0.0.1", broker.port)),
+                                           server_hostname="localhost")
+                sock.sendall(encode_connect(f"tls-check-{i}"))
+                sock.recv(4)  # CONNACK; also lets TLS 1.3 tickets arrive
+                sockets.append(sock)
+        finally:
+            for sock in sockets:
+                sock.close()
+            broker.stop_in_thread()
+    return context.stats.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check TLS session reuse against a local broker stand-in")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--ciphers")
+    parser.add_argument("--max-version", choices=["TLSv1_2", "TLSv1_3"])
+    args = parser.parse_args()
+
+    config = {"ciphers": args.ciphers, "maxVersion": args.max_version}
+    print(f"[TLS] {check_local_broker(args.connections, config)}")
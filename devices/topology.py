@@ -0,0 +1,61 @@
+import json
+import argparse
+from pathlib import Path
+
+# Site/device layout of the simulated fleet. Mirrors models/Site.js in the
+# backends: a site has a name and a type, and owns devices with a deviceId and
+# a device type.
+DEVICES_DIR = Path(__file__).parent.resolve()
+TOPOLOGY_FILE = DEVICES_DIR / "sites.json"
+SITE_TYPES = ("manufacturing", "farm", "building", "warehouse", "office")  # Site.js enum
+DEVICE_TYPES = ("energy", "water", "gas", "solar")                           # the simulated ones
+DEVICE_NAMES = {"energy": "Energy Meter", "water": "Water Meter", "gas": "Gas Meter", "solar": "Solar Sensor"}
+
+
+def load_topology(path=TOPOLOGY_FILE):
+    with open(path, 'r') as f:
+        return json.load(f).get("sites", [])
+
+
+def device_sites(sites):
+    # deviceId -> (site name, device type)
+    mapping = {}
+    for site in sites:
+        for device in site.get("devices", []):
+            mapping[str(device["deviceId"])] = (site["name"], device["type"])
+    return mapping
+
+
+def site_key(site_name):
+    # Same normalisation the data manager uses for per-site database names
+    return "_".join(site_name.split())
+
+
+def generate_topology(sites, devices_per_site, types=DEVICE_TYPES):
+    # Sites "Site 0001".. with devices spread round-robin over the types; the
+    # deviceId is the site number followed by the device number
+    width = len(str(devices_per_site - 1))
+    topology = []
+    for site in range(1, sites + 1):
+        devices = []
+        for i in range(devices_per_site):
+            device_id, device_type = f"{site:04d}{i:0{width}d}", types[i % len(types)]
+            devices.append({"deviceId": device_id, "type": device_type,
+                            "name": f"{DEVICE_NAMES[device_type]} {device_id}", "status": "active"})
+        topology.append({"name": f"Site {site:04d}", "type": SITE_TYPES[site % len(SITE_TYPES)],
+                         "devices": devices})
+    return topology
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a generated site/device topology file")
+    parser.add_argument("output", help="topology file to write (sites.json layout)")
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--devices-per-site", type=int, default=100)
+    parser.add_argument("--types", nargs="+", choices=DEVICE_TYPES, default=list(DEVICE_TYPES))
+    args = parser.parse_args()
+
+    sites = generate_topology(args.sites, args.devices_per_site, args.types)
+    with open(args.output, 'w') as f:
+        json.dump({"sites": sites}, f, indent=2)
+    print(f"Wrote {args.sites} sites, {sum(len(site['devices']) for site in sites)} devices to {args.output}")